@@ -1,16 +1,32 @@
-from flask import Flask, render_template, request, jsonify, session
-from config import config
+from flask import Flask, render_template, request, jsonify, session, g, Response, make_response
+from config import get_config
 import db_helpers
+import functools
 import json
+import math
+import time
 import uuid
 from datetime import datetime
 import os
-from llm_provider import create_llm_provider
+from llm_provider import create_llm_provider, stage_config, traced
+from llm_cache import CachingProvider, create_response_cache, cache_namespace
+from plan_cache import create_plan_cache, successful_queries
+from history import create_history_manager
+from result_store import ResultStore
+import export
+import diagrams
+from conversation_store import create_conversation_store
+from jobs import create_job_runner, JobCancelled
+from scheduler import schedule, set_conversation, SchedulerBusy, scheduler_stats
+import orchestrator
+import metrics
+import profiling
 import logging
 from logging.handlers import RotatingFileHandler
 
+app_config = get_config()  # APP_ENV, see gunicorn.conf.py for the production server
 app = Flask(__name__)
-app.config.from_object(config['development'])  # tASK: what about production?
+app.config.from_object(app_config)
 
 if not os.path.exists('logs'):
   os.makedirs('logs')
@@ -24,7 +40,45 @@ app.logger.addHandler(file_handler)
 app.logger.setLevel(logging.INFO)
 app.logger.info('Sales Assistant startup')
 
-llm_client = create_llm_provider(app.config['LLM_PROVIDER'], config['development'])
+if not app.config['DEBUG'] and app.config['SECRET_KEY'] == 'dev-secret-key-change-in-production':
+  app.logger.warning('SECRET_KEY is not set, using the development key')
+
+llm_provider = create_llm_provider(app.config['LLM_PROVIDER'], app_config)
+llm_client = schedule(traced(llm_provider, app.config['LLM_PROVIDER']), app_config)
+
+llm_cache = create_response_cache(app_config)
+if llm_cache:
+  llm_client = CachingProvider(llm_client, llm_cache, cache_namespace(app_config))
+
+# SQL_STAGE_MODEL: a smaller model runs the tool loop, llm_client only writes the answer
+sql_stage_provider = None
+sql_stage_client = None
+if app.config['SQL_STAGE_MODEL']:
+  sql_stage_config = stage_config(app_config, app.config['SQL_STAGE_MODEL'])
+  sql_stage_provider = create_llm_provider(sql_stage_config.LLM_PROVIDER, sql_stage_config)
+  sql_stage_client = schedule(traced(sql_stage_provider, sql_stage_config.LLM_PROVIDER), sql_stage_config)
+  if llm_cache:
+    sql_stage_client = CachingProvider(sql_stage_client, llm_cache, cache_namespace(sql_stage_config))
+
+plan_cache = create_plan_cache(app_config)
+history_manager = create_history_manager(app_config, llm_client)
+query_results = ResultStore(app.config['RESULT_STORE_SIZE'], app.config['RESULT_TTL'],
+                            app.config['RESULT_SPILL_DIR'] or None, app.config['RESULT_MEMORY_ROWS'])
+profile_gate = profiling.ProfileGate(app.config['PROFILE_MAX_CONCURRENT'])
+
+# gauges next to the request metrics on /metrics
+if llm_cache:
+  metrics.register_collector('llm_cache', llm_cache.stats)
+if plan_cache:
+  metrics.register_collector('plan_cache', plan_cache.stats)
+if getattr(llm_provider, 'token_usage', None):
+  metrics.register_collector('token_usage', llm_provider.token_usage.stats)
+if hasattr(llm_provider, 'stats'):
+  metrics.register_collector(app.config['LLM_PROVIDER'], llm_provider.stats)  # router: hedges, backend latencies
+metrics.register_collector('scheduler', scheduler_stats)
+metrics.register_collector('result_store', query_results.stats)
+if db_helpers.query_stats:
+  metrics.register_collector('query_stats', db_helpers.query_stats.stats)
 
 tools = [
   {
@@ -50,6 +104,50 @@ tools = [
       'required': ['query']
     }
   },
+  {
+    'name': 'execute_sql_batch',
+    'description': 'Execute several independent read-only SQL SELECT queries at once, e.g. for a dashboard or a comparison. All queries are validated before any runs, then they run concurrently. Returns one result per query with its timing.',
+    'parameters': {
+      'type': 'object',
+      'properties': {
+        'queries': {
+          'type': 'array',
+          'description': 'The queries to run (at most 8)',
+          'items': {
+            'type': 'object',
+            'properties': {
+              'name': {'type': 'string', 'description': 'Short name of the result (e.g., "Revenue by category")'},
+              'query': {'type': 'string', 'description': 'A SELECT SQL query'}
+            },
+            'required': ['name', 'query']
+          }
+        }
+      },
+      'required': ['queries']
+    }
+  },
+  {
+    'name': 'get_result_rows',
+    'description': 'Read rows of an earlier query result. Results with many rows are returned to you as a digest with a result_id, use this to page through the full result instead of running the query again.',
+    'parameters': {
+      'type': 'object',
+      'properties': {
+        'result_id': {
+          'type': 'string',
+          'description': 'The result_id from the digest'
+        },
+        'offset': {
+          'type': 'integer',
+          'description': 'Index of the first row to return (default: 0)'
+        },
+        'limit': {
+          'type': 'integer',
+          'description': 'Number of rows to return (default and max: 50)'
+        }
+      },
+      'required': ['result_id']
+    }
+  },
   {
     'name': 'get_sample_data',
     'description': 'Get sample rows from a specific table to understand the data structure.',
@@ -71,7 +169,7 @@ tools = [
   },
   {
     'name': 'generate_diagram',
-    'description': 'Generate a visual diagram/chart to present data insights. Use this when data is better understood visually (trends, comparisons, distributions). Choose the most appropriate chart type for the data.',
+    'description': 'Generate a visual diagram/chart to present data insights. Use this when data is better understood visually (trends, comparisons, distributions). Choose the most appropriate chart type for the data. To plot a query result pass its result_id with x_column and y_columns, the server reads the values from the result; pass labels and datasets only for values that are not in a result.',
     'parameters': {
       'type': 'object',
       'properties': {
@@ -99,33 +197,85 @@ tools = [
               'data': {'type': 'array', 'items': {'type': 'number'}, 'description': 'Numeric data values'}
             }
           }
+        },
+        'result_id': {
+          'type': 'string',
+          'description': 'The result_id of an execute_sql_query result to plot, instead of labels and datasets'
+        },
+        'x_column': {
+          'type': 'string',
+          'description': 'Result column with the labels (e.g., month, product name)'
+        },
+        'y_columns': {
+          'type': 'array',
+          'description': 'Numeric result columns to plot, one dataset each (default: all numeric columns)',
+          'items': {'type': 'string'}
+        },
+        'aggregate': {
+          'type': 'string',
+          'description': 'How rows with the same x_column value are combined (default: sum if there are any)',
+          'enum': ['sum', 'avg', 'count', 'min', 'max', 'none']
         }
       },
-      'required': ['chart_type', 'title', 'labels', 'datasets']
+      'required': ['chart_type', 'title']
     }
   }
 ]
 
-CONVERSATIONS_FILE = app.config['CONVERSATIONS_FILE']
+conversation_store = create_conversation_store(app_config)
 
-def load_conversations():
-  if not os.path.exists('data'):
-    os.makedirs('data')
-  
-  if os.path.exists(CONVERSATIONS_FILE):
-    try:
-      with open(CONVERSATIONS_FILE, 'r', encoding='utf-8') as f:
-        return json.load(f)
-    except:
-      return {}
-  return {}
+@metrics.timed('conversations.load')
+def load_conversation(conversation_id):
+  return conversation_store.get(conversation_id)
 
-def save_conversations(conversations):
-  if not os.path.exists('data'):
-    os.makedirs('data')
-  
-  with open(CONVERSATIONS_FILE, 'w', encoding='utf-8') as f:
-    json.dump(conversations, f, indent=2, ensure_ascii=False)
+@metrics.timed('conversations.save')
+def save_conversation(conversation):
+  conversation_store.save(conversation)
+
+metrics.register_collector('conversations', conversation_store.stats)
+
+def record_cancelled_job(conversation_id):
+  # a job cancelled in the queue never ran answer_turn, which records the cancellation
+  # of a running one; the user message must not stay without an answer
+  record_chat_error(load_conversation(conversation_id), str(JobCancelled()), False)
+
+chat_jobs = create_job_runner(app_config, cancelled=record_cancelled_job)
+metrics.register_collector('jobs', chat_jobs.stats)
+
+def warm_up():
+  # called in the server process before it forks the workers (gunicorn.conf.py):
+  # they start with the provider SDK loaded, the schema catalog and system prompt
+  # built, the conversation database set up and no open SQLite connections or
+  # pending statistics
+  llm_provider.warm_up()
+  if sql_stage_provider:
+    sql_stage_provider.warm_up()
+  system_instruction()
+  conversation_store.connection()
+  conversation_store.close()
+  chat_jobs.store.connection()
+  chat_jobs.store.close()
+  db_helpers.close_readonly_connection()
+  if db_helpers.query_stats:
+    db_helpers.query_stats.flush()
+
+def query_result(query, result):
+  if result['success']:
+    table = {
+      'type': 'table',
+      'query': query,
+      'columns': result['columns'],
+      'rows': result['rows'],
+      'row_count': result['row_count']
+    }
+    query_results.register(table)  # sets table['result_id']
+    return table
+  else:
+    return {
+      'type': 'error',
+      'error': result['error'],
+      'query': query
+    }
 
 def execute_function_call(function_name, function_args):
   if function_name == 'get_database_schema':
@@ -134,22 +284,32 @@ def execute_function_call(function_name, function_args):
   
   elif function_name == 'execute_sql_query':
     query = function_args.get('query', '')
-    result = db_helpers.execute_sql_query(query)
-    
-    if result['success']:
-      return {
-        'type': 'table',
-        'query': query,
-        'columns': result['columns'],
-        'rows': result['rows'],
-        'row_count': result['row_count']
-      }
-    else:
-      return {
-        'type': 'error',
-        'error': result['error'],
-        'query': query
-      }
+    return query_result(query, db_helpers.execute_sql_query(query))
+  
+  elif function_name == 'execute_sql_batch':
+    queries = function_args.get('queries') or []
+    if not isinstance(queries, list):
+      queries = [queries]
+    queries = [query if isinstance(query, dict) else {'query': query} for query in queries]
+    batch = db_helpers.execute_sql_batch(queries)
+    
+    if not batch['success']:
+      return {'type': 'error', 'error': batch['error']}
+    
+    results = []
+    for index, (query, result) in enumerate(zip(queries, batch['results'])):
+      item = query_result(query['query'], result)
+      item['title'] = query.get('name') or f'Query {index + 1}'
+      item['duration_ms'] = result['duration_ms']
+      results.append(item)
+    return {'type': 'batch', 'results': results}
+  
+  elif function_name == 'get_result_rows':
+    return query_results.page(
+      function_args.get('result_id', ''),
+      function_args.get('offset', 0),
+      function_args.get('limit', 50)
+    )
   
   elif function_name == 'get_sample_data':
     table_name = function_args.get('table_name', '')
@@ -171,16 +331,69 @@ def execute_function_call(function_name, function_args):
       }
   
   elif function_name == 'generate_diagram':
-    return {
+    diagram = {
       'type': 'diagram',
       'chart_type': function_args.get('chart_type', 'bar'),
       'title': function_args.get('title', ''),
       'labels': function_args.get('labels', []),
       'datasets': function_args.get('datasets', [])
     }
+    
+    result_id = function_args.get('result_id')
+    if not result_id:
+      return diagram
+    
+    result = query_results.get(result_id)
+    if not result:
+      return {'type': 'error', 'error': f'Result {result_id} is unknown or expired, run the query again.'}
+    
+    try:
+      diagram.update(diagrams.build_chart(
+        result,
+        diagram['chart_type'],
+        function_args.get('x_column') or result['columns'][0],
+        function_args.get('y_columns'),
+        function_args.get('aggregate'),
+        app.config['DIAGRAM_MAX_POINTS']
+      ))
+    except ValueError as e:
+      return {'type': 'error', 'error': str(e)}
+    return diagram
   
   return {'type': 'error', 'error': f'Unknown function: {function_name}'}
 
+@app.before_request
+def start_request_trace():
+  g.request_started = time.perf_counter()
+  metrics.start_trace()
+
+@app.after_request
+def observe_request(response):
+  endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+  metrics.observe_request(endpoint, response.status_code, time.perf_counter() - g.request_started, response.content_length)
+  return response
+
+@app.route('/metrics')
+def get_metrics():
+  if not app.config['METRICS']:
+    return jsonify({'error': 'Metrics are disabled'}), 404
+  
+  return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/query-stats', methods=['GET'])
+def get_query_stats():
+  # the SQL shapes by total time, with plans: candidates for an index or caching
+  if not db_helpers.query_stats:
+    return jsonify({'error': 'Query statistics are disabled'}), 404
+  
+  sort = request.args.get('sort', 'total_ms')
+  limit = request.args.get('limit', 20, type=int)
+  return jsonify({
+    **db_helpers.query_stats.stats(),
+    'slow_query_ms': db_helpers.query_stats.slow_ms,
+    'queries': db_helpers.query_stats.report(sort, limit)
+  })
+
 @app.route('/')
 def index():
   if app.config['LLM_PROVIDER'] == 'gemini':
@@ -195,10 +408,252 @@ def index():
     demo_mode=app.config['DEMO_MODE'],
     model_name=model_name)
 
+def system_instruction():
+  if not app.config['PRELOAD_SCHEMA']:
+    return app.config['SYSTEM_PROMPT']
+  
+  return app.config['SYSTEM_PROMPT'] + '\n\n' + db_helpers.get_schema_prompt()
+
+def log_stages(conversation_id, stages):
+  # one line per question, grep 'Pipeline stages' in logs/app.log to tune SQL_STAGE_MODEL
+  app.logger.info(f'Pipeline stages for {conversation_id}: {json.dumps(stages)}')
+
+@metrics.timed('history.compact')
+def compact_history(messages, include_function_results=False):
+  return history_manager.compact(orchestrator.build_chat_history(messages, include_function_results), system_instruction())
+
+def with_timings(payload):
+  # RESPONSE_TIMINGS: where the time of this request went, per phase
+  trace = metrics.current_trace.get()
+  if app.config['RESPONSE_TIMINGS'] and trace:
+    payload['timings'] = trace.breakdown()
+  return payload
+
+def answer_question(conversation_id, chat_history):
+  if not sql_stage_client:
+    return orchestrator.run_tool_loop(
+      llm_client, chat_history, system_instruction(), tools,
+      app.config['MAX_ITERATIONS'], execute_function_call
+    )
+  
+  stages = []
+  answer = orchestrator.run_tiered_loop(
+    sql_stage_client, llm_client, chat_history, system_instruction(), tools,
+    app.config['MAX_ITERATIONS'], execute_function_call, stages
+  )
+  log_stages(conversation_id, stages)
+  return answer
+
+def open_conversation_turn(conversation_id, user_message):
+  if not conversation_id:
+    conversation_id = str(uuid.uuid4())
+    conversation = {
+      'id': conversation_id,
+      'title': user_message[:50] + ('...' if len(user_message) > 50 else ''),
+      'created_at': datetime.now().isoformat(),
+      'messages': []
+    }
+  else:
+    conversation = load_conversation(conversation_id)
+  
+  if not conversation:
+    return conversation_id, None
+  
+  conversation['messages'].append({
+    'role': 'user',
+    'content': user_message,
+    'timestamp': datetime.now().isoformat()
+  })
+  
+  return conversation_id, conversation
+
+def rewind_conversation(conversation, message_index, new_message):
+  conversation['messages'] = conversation['messages'][:message_index]
+  
+  conversation['messages'].append({
+    'role': 'user',
+    'content': new_message,
+    'timestamp': datetime.now().isoformat()
+  })
+
+def append_assistant_message(conversation, assistant_text, function_results):
+  conversation['messages'].append({
+    'role': 'assistant',
+    'content': assistant_text,
+    'function_results': function_results,
+    'timestamp': datetime.now().isoformat()
+  })
+
+def match_cached_plan(conversation, user_message):
+  # only standalone questions, a follow-up depends on the earlier turns
+  if not plan_cache or len(conversation['messages']) != 1:
+    return None
+  
+  return plan_cache.match(user_message)
+
+def record_cached_plan(conversation, user_message, function_results):
+  if plan_cache and len(conversation['messages']) == 1:
+    plan_cache.record(user_message, successful_queries(function_results))
+
+def busy_payload(e):
+  return {
+    'error': str(e),
+    'is_critical': False,
+    'queue_position': e.position,
+    'eta_seconds': round(e.eta, 1)
+  }
+
+def busy_response(payload):
+  return jsonify(payload), 429, {'Retry-After': str(math.ceil(payload['eta_seconds']) or 1)}
+
+def classify_chat_error(e, conversation_id):
+  error_message = str(e)
+  is_critical = True
+  
+  if 'rate' in error_message.lower() or 'quota' in error_message.lower() or 'limit' in error_message.lower():
+    is_critical = False
+    error_message = 'Rate limit reached. Please wait a moment and try again.'
+    app.logger.warning(f'Rate limit hit for conversation {conversation_id}')
+  elif 'timeout' in error_message.lower() or 'connection' in error_message.lower():
+    is_critical = False
+    error_message = 'Connection issue. Please try again.'
+    app.logger.warning(f'Connection issue for conversation {conversation_id}')
+  else:
+    app.logger.error(f'Critical error for conversation {conversation_id}: {error_message}')
+  
+  return error_message, is_critical
+
+def record_chat_error(conversation, error_message, is_critical):
+  if conversation:
+    try:
+      conversation['messages'].append({
+        'role': 'error',
+        'content': error_message,
+        'is_critical': is_critical,
+        'timestamp': datetime.now().isoformat()
+      })
+      save_conversation(conversation)
+    except Exception as save_error:
+      app.logger.error(f'Failed to save error to conversation: {str(save_error)}')
+
+def profile_skipped(result):
+  response = make_response(result)
+  response.headers['X-Profile'] = 'skipped'  # too many profiled requests at once
+  return response
+
+def profiled(view):
+  # X-Profile / ?profile= with X-Admin-Token: run this request under a profiler, see profiling.py
+  @functools.wraps(view)
+  def wrapper(*args, **kwargs):
+    mode = profiling.requested_mode(request.headers.get('X-Profile') or request.args.get('profile'), app.config['PROFILE_MODE'])
+    if not mode:
+      return view(*args, **kwargs)
+    
+    if not profiling.is_authorized(request.headers.get('X-Admin-Token'), app.config['ADMIN_TOKEN']):
+      return jsonify({'error': 'Profiling requires a valid X-Admin-Token', 'is_critical': False}), 403
+    
+    if not profile_gate.acquire():
+      return profile_skipped(view(*args, **kwargs))
+    
+    try:
+      profile_session = profiling.ProfileSession(mode, app.config['PROFILE_INTERVAL'])
+      if not profile_session.start():
+        return profile_skipped(view(*args, **kwargs))
+      
+      try:
+        response = make_response(view(*args, **kwargs))
+      finally:
+        profile_session.stop()
+      
+      conversation_id = (response.get_json(silent=True) or {}).get('conversation_id') or (request.get_json(silent=True) or {}).get('conversation_id')
+      path = profile_session.write(app.config['PROFILE_DIR'], conversation_id)
+      app.logger.info(f'Profiled {request.path} for conversation {conversation_id}: {path}')
+      response.headers['X-Profile'] = os.path.basename(path)
+      return response
+    finally:
+      profile_gate.release()
+  
+  return wrapper
+
+def wants_job(data):
+  background = data.get('background')
+  return app.config['CHAT_JOBS'] if background is None else bool(background)
+
+def answer_turn(conversation, user_message):
+  # the model part of a chat turn, run in the request or as a background job
+  conversation_id = conversation['id']
+  
+  try:
+    set_conversation(conversation_id)
+    
+    chat_history = compact_history(conversation['messages'])
+    
+    answer = None
+    plan = match_cached_plan(conversation, user_message)
+    if plan:
+      answer = orchestrator.run_cached_plan(
+        llm_client, chat_history, system_instruction(), tools,
+        plan[1], execute_function_call, app.config['PLAN_CACHE_MODE'] != 'fast'
+      )
+      if not answer:
+        plan_cache.forget(plan[0])
+    
+    if not answer:
+      answer = answer_question(conversation_id, chat_history)
+      record_cached_plan(conversation, user_message, answer[1])
+    
+    assistant_text, function_results = answer
+    
+    append_assistant_message(conversation, assistant_text, function_results)
+    save_conversation(conversation)
+    
+    return 200, with_timings({
+      'conversation_id': conversation_id,
+      'message': assistant_text,
+      'function_results': function_results
+    })
+  
+  except SchedulerBusy as e:
+    # nothing was saved, the user can simply send the message again
+    app.logger.warning(f'Scheduler busy for conversation {conversation_id}: position {e.position}, eta {e.eta:.1f}s')
+    return 429, busy_payload(e)
+  
+  except JobCancelled as e:
+    app.logger.info(f'Chat job cancelled for conversation {conversation_id}')
+    record_chat_error(conversation, str(e), False)
+    raise
+  
+  except Exception as e:
+    app.logger.error(f'Error in chat endpoint: {str(e)}', exc_info=True)
+    
+    error_message, is_critical = classify_chat_error(e, conversation_id)
+    record_chat_error(conversation, error_message, is_critical)
+    
+    return 500, {
+      'error': error_message,
+      'is_critical': is_critical,
+      'conversation_id': conversation_id
+    }
+
+def run_chat_job(conversation, user_message):
+  status, payload = answer_turn(conversation, user_message)
+  if status == 429:
+    # the question is already saved, keep the refusal next to it
+    record_chat_error(conversation, payload['error'], False)
+  return status, payload
+
+def submit_chat_job(conversation, user_message):
+  # the user message is saved right away, a reload shows it while the job runs
+  save_conversation(conversation)
+  job_id = chat_jobs.submit(conversation['id'], run_chat_job, conversation, user_message)
+  app.logger.info(f'Queued chat job {job_id} for conversation {conversation["id"]}')
+  return {'job_id': job_id, 'conversation_id': conversation['id'], 'status': 'queued'}
+
 @app.route('/api/chat', methods=['POST'])
+@profiled
 def chat():
   conversation_id = None
-  conversations = None
+  conversation = None
   
   try:
     data = request.json
@@ -208,137 +663,23 @@ def chat():
     if not user_message:
       return jsonify({'error': 'Message is required', 'is_critical': False}), 400
     
-    conversations = load_conversations()
-    
-    if not conversation_id:
-      conversation_id = str(uuid.uuid4())
-      conversations[conversation_id] = {
-        'id': conversation_id,
-        'title': user_message[:50] + ('...' if len(user_message) > 50 else ''),
-        'created_at': datetime.now().isoformat(),
-        'messages': []
-      }
-    
-    conversation = conversations.get(conversation_id)
+    conversation_id, conversation = open_conversation_turn(conversation_id, user_message)
     if not conversation:
       return jsonify({'error': 'Conversation missing', 'is_critical': False}), 404
     
-    conversation['messages'].append({
-      'role': 'user',
-      'content': user_message,
-      'timestamp': datetime.now().isoformat()
-    })
-    
-    chat_history = []
-    for msg in conversation['messages'][:-1]:
-      if msg['role'] == 'user':
-        chat_history.append({'role': 'user', 'parts': [{'text': msg['content']}]})
-      elif msg['role'] == 'assistant':
-        chat_history.append({'role': 'model', 'parts': [{'text': msg['content']}]})
-    
-    chat_history.append({'role': 'user', 'parts': [{'text': user_message}]})
-    
-    response = llm_client.generate_content(
-      contents=chat_history,
-      system_instruction=app.config['SYSTEM_PROMPT'],
-      tools=[{'function_declarations': tools}]
-    )
-    
-    function_results = []
-    assistant_text = ''
-    
-    iteration = 0
-    
-    while iteration < app.config['MAX_ITERATIONS']:
-      iteration += 1
-      
-      current_function_calls = []
-      
-      if response.candidates[0].content.parts:
-        for part in response.candidates[0].content.parts:
-          if hasattr(part, 'function_call') and part.function_call:
-            current_function_calls.append(part.function_call)
-          elif hasattr(part, 'text'):
-            assistant_text += part.text
-            
-      if current_function_calls:
-        for function_call in current_function_calls:
-            function_name = function_call.name if hasattr(function_call, 'name') and function_call.name else None
-            if not function_name:
-              continue
-            
-            if hasattr(function_call, 'args'):
-              function_args = function_call.args if isinstance(function_call.args, dict) else dict(function_call.args)
-            else:
-              function_args = {}
-            
-            result = execute_function_call(function_name, function_args)
-            function_results.append(result)
-            
-            chat_history.append({'role': 'model', 'parts': [{'function_call': function_call}]})
-            chat_history.append({
-              'role': 'user',
-              'parts': [{
-                'function_response': {
-                  'name': function_name,
-                  'response': result
-                }
-              }]
-            })
-            
-        response = llm_client.generate_content(
-          contents=chat_history,
-          system_instruction=app.config['SYSTEM_PROMPT'],
-          tools=[{'function_declarations': tools}]
-        )
-      else:
-        break
-    
-    conversation['messages'].append({
-      'role': 'assistant',
-      'content': assistant_text,
-      'function_results': function_results,
-      'timestamp': datetime.now().isoformat()
-    })
-    
-    save_conversations(conversations)
+    if wants_job(data):
+      return jsonify(submit_chat_job(conversation, user_message)), 202
     
-    return jsonify({
-      'conversation_id': conversation_id,
-      'message': assistant_text,
-      'function_results': function_results
-    })
+    status, payload = answer_turn(conversation, user_message)
+    if status == 429:
+      return busy_response(payload)
+    return jsonify(payload), status
   
   except Exception as e:
     app.logger.error(f'Error in chat endpoint: {str(e)}', exc_info=True)
     
-    error_message = str(e)
-    is_critical = True
-    
-    if 'rate' in error_message.lower() or 'quota' in error_message.lower() or 'limit' in error_message.lower():
-      is_critical = False
-      error_message = 'Rate limit reached. Please wait a moment and try again.'
-      app.logger.warning(f'Rate limit hit for conversation {conversation_id}')
-    elif 'timeout' in error_message.lower() or 'connection' in error_message.lower():
-      is_critical = False
-      error_message = 'Connection issue. Please try again.'
-      app.logger.warning(f'Connection issue for conversation {conversation_id}')
-    else:
-      app.logger.error(f'Critical error for conversation {conversation_id}: {error_message}')
-    
-    if conversation_id and conversations:
-      try:
-        conversation = conversations.get(conversation_id)
-        if conversation:
-          conversation['messages'].append({
-            'role': 'error',
-            'content': error_message,
-            'is_critical': is_critical,
-            'timestamp': datetime.now().isoformat()
-          })
-          save_conversations(conversations)
-      except Exception as save_error:
-        app.logger.error(f'Failed to save error to conversation: {str(save_error)}')
+    error_message, is_critical = classify_chat_error(e, conversation_id)
+    record_chat_error(conversation, error_message, is_critical)
     
     return jsonify({
       'error': error_message,
@@ -346,23 +687,126 @@ def chat():
       'conversation_id': conversation_id
     }), 500
 
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+  # long-poll: ?since=<version> waits up to ?wait= seconds for a newer state. The ASGI
+  # server answers these on the event loop (asgi.job_status); here every waiting poll
+  # holds one of the THREADS request threads, so the wait is kept short and the
+  # client simply polls again
+  since = request.args.get('since', -1, type=int)
+  wait = min(max(request.args.get('wait', 0, type=float), 0), app.config['JOB_POLL_WAIT_WSGI'])
+  job = chat_jobs.wait(job_id, since, wait)
+  
+  if not job:
+    return jsonify({'error': 'Job not found'}), 404
+  
+  return jsonify(job)
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+  job = chat_jobs.cancel(job_id)
+  
+  if not job:
+    return jsonify({'error': 'Job not found'}), 404
+  
+  app.logger.info(f'Cancel requested for chat job {job_id}')
+  return jsonify(job)
+
+@app.route('/api/results/<result_id>', methods=['GET'])
+def get_result_page(result_id):
+  # rows of a query result for the table in the UI, without the SQL or the model
+  page = query_results.view(
+    result_id,
+    request.args.get('offset', 0, type=int),
+    request.args.get('limit', 100, type=int),
+    sort=request.args.get('sort') or None,
+    descending=request.args.get('order') == 'desc',
+    filter_text=request.args.get('filter', '').strip(),
+    max_limit=app.config['RESULT_PAGE_MAX']
+  )
+  
+  if not page:
+    return jsonify({'error': 'Result not found or expired'}), 404
+  
+  return jsonify(page)
+
+@app.route('/api/results', methods=['POST'])
+def reopen_result():
+  # runs the query of an expired result again, with the checks of execute_sql_query
+  query = (request.json or {}).get('query', '').strip()
+  
+  if not query:
+    return jsonify({'error': 'Missing required parameters'}), 400
+  
+  result = execute_function_call('execute_sql_query', {'query': query})
+  
+  if result['type'] == 'error':
+    return jsonify({'error': result['error']}), 400
+  
+  return jsonify({'result_id': result['result_id'], 'columns': result['columns'], 'row_count': result['row_count']})
+
+def result_query(conversation, result_id):
+  # the query behind a table of the conversation, also one inside a batch
+  for message in conversation['messages'] if conversation else []:
+    for result in message.get('function_results') or []:
+      for table in result['results'] if result.get('type') == 'batch' else [result]:
+        if table.get('result_id') == result_id:
+          return table.get('query')
+  return None
+
+@app.route('/api/export', methods=['GET'])
+def export_result():
+  # ?format=csv|parquet&result_id=&conversation_id=: a result that is still in the
+  # result store is written from there, an expired one by running its query from the
+  # conversation again; the rows are streamed in batches either way
+  export_format = request.args.get('format', 'csv')
+  result_id = request.args.get('result_id', '')
+  conversation_id = request.args.get('conversation_id', '')
+  batch_rows = app.config['EXPORT_BATCH_ROWS']
+  
+  if export_format not in export.CONTENT_TYPES:
+    return jsonify({'error': f"Unknown format, use one of {', '.join(export.CONTENT_TYPES)}"}), 400
+  
+  if export_format == 'parquet' and not export.parquet_available():
+    return jsonify({'error': 'Parquet export requires pyarrow (pip install pyarrow)'}), 400
+  
+  if not result_id:
+    return jsonify({'error': 'Missing required parameters'}), 400
+  
+  result = query_results.get(result_id)
+  if result:
+    # Parquet columns get the numbers back the stored text was made from
+    columns, batches = result['columns'], export.stored_batches(result['rows'], batch_rows, typed=export_format == 'parquet')
+  else:
+    query = result_query(load_conversation(conversation_id), result_id) if conversation_id else None
+    if not query:
+      return jsonify({'error': 'Result not found or expired'}), 404
+    
+    stream = db_helpers.stream_sql_query(query, batch_rows)
+    if not stream['success']:
+      return jsonify({'error': stream['error']}), 400
+    columns, batches = stream['columns'], stream['batches']
+  
+  if export_format == 'csv':
+    chunks = export.csv_chunks(columns, batches)
+  else:
+    chunks = export.parquet_chunks(columns, batches)
+  
+  file_name = f"sales-export-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{export_format}"
+  headers = {'Content-Disposition': f'attachment; filename="{file_name}"'}
+  
+  # Parquet is compressed already
+  if export_format == 'csv' and 'gzip' in request.headers.get('Accept-Encoding', ''):
+    chunks = export.gzip_chunks(chunks)
+    headers['Content-Encoding'] = 'gzip'
+    headers['Vary'] = 'Accept-Encoding'
+  
+  return Response(chunks, content_type=export.CONTENT_TYPES[export_format], headers=headers)
+
 @app.route('/api/conversations', methods=['GET'])
 def get_conversations():
   try:
-    conversations = load_conversations()
-    
-    conversation_list = []
-    for conv_id, conv in conversations.items():
-      conversation_list.append({
-        'id': conv['id'],
-        'title': conv['title'],
-        'created_at': conv['created_at'],
-        'message_count': len(conv['messages'])
-      })
-    
-    conversation_list.sort(key=lambda x: x['created_at'], reverse=True)
-    
-    return jsonify({'conversations': conversation_list})
+    return jsonify({'conversations': conversation_store.list()})
   
   except Exception as e:
     app.logger.error(f'Error loading conversations: {str(e)}', exc_info=True)
@@ -371,8 +815,7 @@ def get_conversations():
 @app.route('/api/conversations/<conversation_id>', methods=['GET'])
 def get_conversation(conversation_id):
   try:
-    conversations = load_conversations()
-    conversation = conversations.get(conversation_id)
+    conversation = load_conversation(conversation_id)
     
     if not conversation:
       app.logger.warning(f'Conversation not found: {conversation_id}')
@@ -387,14 +830,10 @@ def get_conversation(conversation_id):
 @app.route('/api/conversations/<conversation_id>', methods=['DELETE'])
 def delete_conversation(conversation_id):
   try:
-    conversations = load_conversations()
-    
-    if conversation_id not in conversations:
+    if not conversation_store.delete(conversation_id):
       app.logger.warning(f'Attempted to delete non-existent conversation: {conversation_id}')
       return jsonify({'error': 'Conversation missing'}), 404
     
-    del conversations[conversation_id]
-    save_conversations(conversations)
     app.logger.info(f'Deleted conversation: {conversation_id}')
     
     return jsonify({'success': True})
@@ -404,7 +843,11 @@ def delete_conversation(conversation_id):
     return jsonify({'error': str(e)}), 500
 
 @app.route('/api/chat/rerun', methods=['POST'])
+@profiled
 def rerun_message():
+  conversation_id = None
+  conversation = None
+  
   try:
     data = request.json
     conversation_id = data.get('conversation_id')
@@ -414,129 +857,33 @@ def rerun_message():
     if not conversation_id or message_index is None or not new_message:
       return jsonify({'error': 'Missing required parameters'}), 400
     
-    conversations = load_conversations()
+    conversation = load_conversation(conversation_id)
     
-    if conversation_id not in conversations:
+    if not conversation:
       return jsonify({'error': 'Conversation not found'}), 404
     
-    conversation = conversations[conversation_id]
-    
     if message_index >= len(conversation['messages']):
       return jsonify({'error': 'Invalid message index'}), 400
     
-    conversation['messages'] = conversation['messages'][:message_index]
+    rewind_conversation(conversation, message_index, new_message)
+    save_conversation(conversation)
     
-    conversation['messages'].append({
-      'role': 'user',
-      'content': new_message,
-      'timestamp': datetime.now().isoformat()
-    })
+    set_conversation(conversation_id)
     
-    save_conversations(conversations)
-    
-    chat_history = []
-    for msg in conversation['messages']:
-      if msg['role'] == 'user':
-        chat_history.append({'role': 'user', 'parts': [{'text': msg['content']}]})
-      elif msg['role'] == 'assistant':
-        parts = []
-        if msg.get('content'):
-          parts.append({'text': msg['content']})
-        if msg.get('function_results'):
-          for func_result in msg['function_results']:
-            parts.append({
-              'function_call': {
-                'name': func_result.get('name', ''),
-                'args': func_result.get('args', {})
-              }
-            })
-            parts.append({
-              'function_response': {
-                'name': func_result.get('name', ''),
-                'response': func_result
-              }
-            })
-        if parts:
-          chat_history.append({'role': 'model', 'parts': parts})
-    
-    iteration = 0
-    while iteration < app.config['MAX_ITERATIONS']:
-      iteration += 1
-      
-      response = llm_client.generate_content(
-        contents=chat_history,
-        system_instruction=app.config['SYSTEM_PROMPT'],
-        tools=[{'function_declarations': tools}]
-      )
-      
-      assistant_text = ''
-      current_function_calls = []
-      
-      for part in response.parts:
-        if hasattr(part, 'function_call'):
-          current_function_calls.append(part.function_call)
-        elif hasattr(part, 'text'):
-          assistant_text += part.text
-      
-      if current_function_calls:
-        function_results = []
-        
-        for function_call in current_function_calls:
-          function_name = function_call.name if hasattr(function_call, 'name') and function_call.name else None
-          if not function_name:
-            continue
-          
-          if hasattr(function_call, 'args'):
-            function_args = function_call.args if isinstance(function_call.args, dict) else dict(function_call.args)
-          else:
-            function_args = {}
-          
-          result = execute_function_call(function_name, function_args)
-          result['name'] = function_name
-          result['args'] = function_args
-          function_results.append(result)
-        
-        conversation['messages'].append({
-          'role': 'assistant',
-          'content': assistant_text,
-          'function_results': function_results,
-          'timestamp': datetime.now().isoformat()
-        })
-        
-        save_conversations(conversations)
-        
-        chat_history.append({'role': 'model', 'parts': [{'text': assistant_text}] if assistant_text else []})
-        
-        for func_result in function_results:
-          chat_history[-1]['parts'].append({
-            'function_call': {
-              'name': func_result['name'],
-              'args': func_result['args']
-            }
-          })
-          chat_history.append({
-            'role': 'function',
-            'parts': [{
-              'function_response': {
-                'name': func_result['name'],
-                'response': func_result
-              }
-            }]
-          })
-        
-        if assistant_text:
-          break
-      else:
-        conversation['messages'].append({
-          'role': 'assistant',
-          'content': assistant_text,
-          'timestamp': datetime.now().isoformat()
-        })
-        
-        save_conversations(conversations)
-        break
-    
-    return jsonify({'success': True, 'conversation_id': conversation_id})
+    chat_history = compact_history(conversation['messages'], include_function_results=True)
+    
+    assistant_text, function_results = answer_question(conversation_id, chat_history)
+    
+    append_assistant_message(conversation, assistant_text, function_results)
+    save_conversation(conversation)
+    
+    return jsonify(with_timings({'success': True, 'conversation_id': conversation_id}))
+  
+  except SchedulerBusy as e:
+    app.logger.warning(f'Scheduler busy for rerun in {conversation_id}: position {e.position}, eta {e.eta:.1f}s')
+    # the rewound conversation is already saved, keep the refusal next to the edited question
+    record_chat_error(conversation, str(e), False)
+    return busy_response(busy_payload(e))
   
   except Exception as e:
     app.logger.error(f'Error in rerun endpoint: {str(e)}', exc_info=True)
@@ -0,0 +1,330 @@
+import asyncio
+import json
+import math
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from app import (
+  app, app_config, tools, llm_cache, plan_cache, load_conversation, save_conversation, execute_function_call,
+  open_conversation_turn, rewind_conversation, append_assistant_message, compact_history,
+  match_cached_plan, record_cached_plan, system_instruction, log_stages, with_timings,
+  classify_chat_error, record_chat_error, busy_payload, profile_gate, chat_jobs, wants_job, submit_chat_job
+)
+from llm_provider import create_async_llm_provider, stage_config, traced_async
+from llm_cache import AsyncCachingProvider, cache_namespace
+from scheduler import schedule_async, set_conversation, SchedulerBusy
+import orchestrator
+import metrics
+import profiling
+
+# ASGI entry point: the chat endpoints run natively on the event loop so a
+# conversation waiting on the model holds no worker thread; every other route
+# is served by the Flask app through the WSGI adapter.
+#
+#   uvicorn asgi:application --port 5000
+#   gunicorn -c gunicorn.conf.py              # production, several workers
+
+async_llm_client = None
+async_sql_stage_client = None
+
+async def write_conversation(conversation, assistant_text=None, function_results=None):
+  if assistant_text is not None:
+    append_assistant_message(conversation, assistant_text, function_results)
+  await asyncio.to_thread(save_conversation, conversation)
+
+async def answer_question(conversation_id, chat_history):
+  if not async_sql_stage_client:
+    return await orchestrator.run_tool_loop_async(
+      async_llm_client, chat_history, system_instruction(), tools,
+      app.config['MAX_ITERATIONS'], execute_function_call
+    )
+  
+  stages = []
+  answer = await orchestrator.run_tiered_loop_async(
+    async_sql_stage_client, async_llm_client, chat_history, system_instruction(), tools,
+    app.config['MAX_ITERATIONS'], execute_function_call, stages
+  )
+  log_stages(conversation_id, stages)
+  return answer
+
+async def chat(data):
+  conversation_id = None
+  conversation = None
+  
+  try:
+    user_message = data.get('message', '')
+    conversation_id = data.get('conversation_id')
+    
+    if not user_message:
+      return 400, {'error': 'Message is required', 'is_critical': False}
+    
+    conversation_id, conversation = await asyncio.to_thread(open_conversation_turn, conversation_id, user_message)
+    if not conversation:
+      return 404, {'error': 'Conversation missing', 'is_critical': False}
+    
+    if wants_job(data):
+      return 202, await asyncio.to_thread(submit_chat_job, conversation, user_message)
+    
+    set_conversation(conversation_id)
+    
+    # may summarize through the sync provider, keep it off the event loop
+    chat_history = await asyncio.to_thread(compact_history, conversation['messages'])
+    
+    answer = None
+    plan = await asyncio.to_thread(match_cached_plan, conversation, user_message)
+    if plan:
+      answer = await orchestrator.run_cached_plan_async(
+        async_llm_client, chat_history, system_instruction(), tools,
+        plan[1], execute_function_call, app.config['PLAN_CACHE_MODE'] != 'fast'
+      )
+      if not answer:
+        await asyncio.to_thread(plan_cache.forget, plan[0])
+    
+    if not answer:
+      answer = await answer_question(conversation_id, chat_history)
+      # saves the plan file, keep it off the event loop
+      await asyncio.to_thread(record_cached_plan, conversation, user_message, answer[1])
+    
+    assistant_text, function_results = answer
+    
+    await write_conversation(conversation, assistant_text, function_results)
+    
+    return 200, with_timings({
+      'conversation_id': conversation_id,
+      'message': assistant_text,
+      'function_results': function_results
+    })
+  
+  except SchedulerBusy as e:
+    app.logger.warning(f'Scheduler busy for conversation {conversation_id}: position {e.position}, eta {e.eta:.1f}s')
+    return 429, busy_payload(e)
+  
+  except Exception as e:
+    app.logger.error(f'Error in async chat endpoint: {str(e)}', exc_info=True)
+    
+    error_message, is_critical = classify_chat_error(e, conversation_id)
+    await asyncio.to_thread(record_chat_error, conversation, error_message, is_critical)
+    
+    return 500, {
+      'error': error_message,
+      'is_critical': is_critical,
+      'conversation_id': conversation_id
+    }
+
+async def rerun_message(data):
+  conversation_id = None
+  conversation = None
+  
+  try:
+    conversation_id = data.get('conversation_id')
+    message_index = data.get('message_index')
+    new_message = data.get('new_message', '').strip()
+    
+    if not conversation_id or message_index is None or not new_message:
+      return 400, {'error': 'Missing required parameters'}
+    
+    conversation = await asyncio.to_thread(load_conversation, conversation_id)
+    
+    if not conversation:
+      return 404, {'error': 'Conversation not found'}
+    
+    if message_index >= len(conversation['messages']):
+      return 400, {'error': 'Invalid message index'}
+    
+    rewind_conversation(conversation, message_index, new_message)
+    await write_conversation(conversation)
+    
+    set_conversation(conversation_id)
+    
+    chat_history = await asyncio.to_thread(compact_history, conversation['messages'], True)
+    
+    assistant_text, function_results = await answer_question(conversation_id, chat_history)
+    
+    await write_conversation(conversation, assistant_text, function_results)
+    
+    return 200, with_timings({'success': True, 'conversation_id': conversation_id})
+  
+  except SchedulerBusy as e:
+    app.logger.warning(f'Scheduler busy for rerun in {conversation_id}: position {e.position}, eta {e.eta:.1f}s')
+    # the rewound conversation is already saved, keep the refusal next to the edited question
+    await asyncio.to_thread(record_chat_error, conversation, str(e), False)
+    return 429, busy_payload(e)
+  
+  except Exception as e:
+    app.logger.error(f'Error in async rerun endpoint: {str(e)}', exc_info=True)
+    return 500, {'error': str(e)}
+
+ASYNC_ROUTES = {
+  '/api/chat': chat,
+  '/api/chat/rerun': rerun_message
+}
+
+# long-polls of background jobs wait on the event loop, through Flask each would hold a thread
+JOB_PATH = re.compile(r'/api/jobs/([^/]+)')
+
+def query_number(query, name, default):
+  try:
+    return float(query[name][0])
+  except (KeyError, ValueError):
+    return default
+
+async def job_status(scope, job_id):
+  query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+  since = query_number(query, 'since', -1)
+  wait = min(max(query_number(query, 'wait', 0), 0), app.config['JOB_POLL_WAIT'])
+  job = await chat_jobs.wait_async(job_id, since, wait)
+  
+  if not job:
+    return 404, {'error': 'Job not found'}
+  
+  return 200, job
+
+# asgiref runs every WSGI request on one shared thread (thread_sensitive), which
+# serializes the Flask routes and breaks under load ("CurrentThreadExecutor already
+# quit or is broken"); Flask is thread-safe, give it a pool like the WSGI server's
+flask_pool = ThreadPoolExecutor(max_workers=app.config['THREADS'], thread_name_prefix='flask')
+
+
+class FlaskInstance(WsgiToAsgiInstance):
+  run_wsgi_app = sync_to_async(WsgiToAsgiInstance.__dict__['run_wsgi_app'].func, thread_sensitive=False, executor=flask_pool)
+
+
+class FlaskApplication(WsgiToAsgi):
+  
+  async def __call__(self, scope, receive, send):
+    await FlaskInstance(self.wsgi_application)(scope, receive, send)
+
+
+flask_application = FlaskApplication(app)
+
+async def read_body(receive):
+  body = b''
+  more_body = True
+  
+  while more_body:
+    message = await receive()
+    body += message.get('body', b'')
+    more_body = message.get('more_body', False)
+  
+  return body
+
+def request_flag(scope, header, param):
+  for name, value in scope.get('headers') or []:
+    if name == header:
+      return value.decode('latin-1')
+  return (parse_qs(scope.get('query_string', b'').decode('latin-1')).get(param) or [None])[0]
+
+async def run_handler(scope, handler, data):
+  # same profiling switch as the profiled decorator in app.py
+  mode = profiling.requested_mode(request_flag(scope, b'x-profile', 'profile'), app.config['PROFILE_MODE'])
+  if not mode:
+    return (*await handler(data), [])
+  
+  if not profiling.is_authorized(request_flag(scope, b'x-admin-token', None), app.config['ADMIN_TOKEN']):
+    return 403, {'error': 'Profiling requires a valid X-Admin-Token', 'is_critical': False}, []
+  
+  if not profile_gate.acquire():
+    return (*await handler(data), [(b'x-profile', b'skipped')])
+  
+  try:
+    profile_session = profiling.ProfileSession(mode, app.config['PROFILE_INTERVAL'])
+    if not profile_session.start():
+      return (*await handler(data), [(b'x-profile', b'skipped')])
+    
+    try:
+      status, payload = await handler(data)
+    finally:
+      profile_session.stop()
+    
+    conversation_id = payload.get('conversation_id') or data.get('conversation_id')
+    path = await asyncio.to_thread(profile_session.write, app.config['PROFILE_DIR'], conversation_id)
+    app.logger.info(f'Profiled {scope["path"]} for conversation {conversation_id}: {path}')
+    return status, payload, [(b'x-profile', os.path.basename(path).encode('latin-1'))]
+  finally:
+    profile_gate.release()
+
+async def send_json(send, status, payload, extra_headers=()):
+  # returns the body size for the request metrics
+  body = json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+  headers = [
+    (b'content-type', b'application/json'),
+    (b'content-length', str(len(body)).encode('ascii')),
+    *extra_headers
+  ]
+  if status == 429:
+    headers.append((b'retry-after', str(math.ceil(payload['eta_seconds']) or 1).encode('ascii')))
+  
+  await send({
+    'type': 'http.response.start',
+    'status': status,
+    'headers': headers
+  })
+  await send({'type': 'http.response.body', 'body': body})
+  return len(body)
+
+async def lifespan(receive, send):
+  global async_llm_client, async_sql_stage_client
+  
+  while True:
+    message = await receive()
+    
+    if message['type'] == 'lifespan.startup':
+      # SDK clients are created before the first request; in a thread, without the
+      # preloading server of gunicorn.conf.py this also imports the SDK
+      async_provider = create_async_llm_provider(app.config['LLM_PROVIDER'], app_config)
+      await asyncio.to_thread(async_provider.warm_up)
+      async_llm_client = schedule_async(traced_async(async_provider, app.config['LLM_PROVIDER']), app_config)
+      if llm_cache:
+        async_llm_client = AsyncCachingProvider(async_llm_client, llm_cache, cache_namespace(app_config))
+      if app.config['SQL_STAGE_MODEL']:
+        sql_stage_config = stage_config(app_config, app.config['SQL_STAGE_MODEL'])
+        async_provider = create_async_llm_provider(sql_stage_config.LLM_PROVIDER, sql_stage_config)
+        await asyncio.to_thread(async_provider.warm_up)
+        async_sql_stage_client = schedule_async(traced_async(async_provider, sql_stage_config.LLM_PROVIDER), sql_stage_config)
+        if llm_cache:
+          async_sql_stage_client = AsyncCachingProvider(async_sql_stage_client, llm_cache, cache_namespace(sql_stage_config))
+      app.logger.info('Sales Assistant ASGI startup')
+      await send({'type': 'lifespan.startup.complete'})
+    elif message['type'] == 'lifespan.shutdown':
+      if async_llm_client:
+        await async_llm_client.aclose()
+      if async_sql_stage_client:
+        await async_sql_stage_client.aclose()
+      await send({'type': 'lifespan.shutdown.complete'})
+      return
+
+async def application(scope, receive, send):
+  if scope['type'] == 'lifespan':
+    await lifespan(receive, send)
+    return
+  
+  job = JOB_PATH.fullmatch(scope.get('path', '')) if scope['type'] == 'http' and scope['method'] == 'GET' else None
+  if job:
+    started = time.perf_counter()
+    status, payload = await job_status(scope, job.group(1))
+    body_bytes = await send_json(send, status, payload)
+    metrics.observe_request('/api/jobs/<job_id>', status, time.perf_counter() - started, body_bytes)
+    return
+  
+  handler = ASYNC_ROUTES.get(scope.get('path')) if scope['type'] == 'http' and scope['method'] == 'POST' else None
+  if not handler:
+    await flask_application(scope, receive, send)
+    return
+  
+  started = time.perf_counter()
+  metrics.start_trace()
+  
+  try:
+    data = json.loads(await read_body(receive) or b'{}')
+  except ValueError:
+    status = 400
+    body_bytes = await send_json(send, status, {'error': 'Invalid JSON body', 'is_critical': False})
+  else:
+    status, payload, headers = await run_handler(scope, handler, data)
+    body_bytes = await send_json(send, status, payload, headers)
+  
+  metrics.observe_request(scope['path'], status, time.perf_counter() - started, body_bytes)
@@ -0,0 +1,63 @@
+import json
+import os
+import statistics
+import sys
+from typing import Dict, List, Optional
+
+# Shared helpers of the benchmark scripts in this folder
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if ROOT not in sys.path:
+  sys.path.insert(0, ROOT)
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+  if not values:
+    return None
+  ordered = sorted(values)
+  index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))
+  return ordered[index]
+
+def summarize(samples: List[float], unit: str = 'ms') -> Dict:
+  if not samples:
+    return {'count': 0}
+  
+  return {
+    'count': len(samples),
+    f'mean_{unit}': round(statistics.fmean(samples), 3),
+    f'stdev_{unit}': round(statistics.stdev(samples), 3) if len(samples) > 1 else 0.0,
+    f'min_{unit}': round(min(samples), 3),
+    f'p50_{unit}': round(percentile(samples, 50), 3),
+    f'p95_{unit}': round(percentile(samples, 95), 3),
+    f'p99_{unit}': round(percentile(samples, 99), 3),
+    f'max_{unit}': round(max(samples), 3)
+  }
+
+def peak_memory_kb(pid: int) -> Optional[int]:
+  # VmHWM = peak resident set size, Linux only
+  try:
+    with open(f'/proc/{pid}/status', 'r') as f:
+      for line in f:
+        if line.startswith('VmHWM:'):
+          return int(line.split()[1])
+  except OSError:
+    pass
+  return None
+
+def child_pids(pid: int) -> List[int]:
+  # direct children, e.g. the workers of a gunicorn server (Linux only)
+  pids = []
+  try:
+    for task in os.listdir(f'/proc/{pid}/task'):
+      with open(f'/proc/{pid}/task/{task}/children', 'r') as f:
+        pids.extend(int(child) for child in f.read().split())
+  except OSError:
+    pass
+  return pids
+
+def write_report(report: Dict, output: Optional[str]) -> None:
+  text = json.dumps(report, indent=2)
+  if output:
+    with open(output, 'w', encoding='utf-8') as f:
+      f.write(text + '\n')
+  print(text)
@@ -0,0 +1,308 @@
+"""End-to-end load test of the chat API.
+
+Starts the app (Flask, ASGI or the production gunicorn profile) in a scratch
+directory with a scaled copy of sales.db and the offline replay provider, drives
+it with concurrent virtual users and prints a JSON report (throughput, latency
+percentiles per phase, server memory high-water mark, conversation database
+growth).
+
+  python bench/load_test.py --users 20 --duration 60 --scale 10 --output load.json
+  python bench/load_test.py --server asgi --latency 800 --think-time 2
+  python bench/load_test.py --server gunicorn --workers 4 --users 50
+  python bench/load_test.py --provider replay --cassette data/cassette.jsonl
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+import requests
+from common import ROOT, summarize, peak_memory_kb, child_pids, write_report
+import init_db
+
+DEFAULT_QUESTIONS = [
+  {'question': 'Who are our top 10 customers by revenue?', 'weight': 3},
+  {'question': 'Show the monthly revenue for the last 6 months', 'weight': 2},
+  {'question': 'Which product category sells best?', 'weight': 2},
+  {'question': 'How many orders are still processing?', 'weight': 1},
+  {'question': 'Compare revenue by country', 'weight': 1}
+]
+
+SERVER_COMMANDS = {
+  'flask': [sys.executable, '-c', (
+    'import sys; from werkzeug.serving import run_simple; from app import app; '
+    'run_simple("127.0.0.1", int(sys.argv[1]), app, threaded=True)'
+  ), '{port}'],
+  'asgi': [sys.executable, '-m', 'uvicorn', 'asgi:application', '--host', '127.0.0.1', '--log-level', 'warning', '--port', '{port}'],
+  # production profile, gunicorn.conf.py with --workers processes
+  'gunicorn': [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'), '--bind', '127.0.0.1:{port}'],
+  'gunicorn-asgi': [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'), '--bind', '127.0.0.1:{port}']
+}
+
+
+class Recorder:
+  
+  def __init__(self):
+    self.samples = defaultdict(list)  # phase -> latencies in ms
+    self.statuses = defaultdict(lambda: defaultdict(int))  # phase -> status code -> count
+    self.questions = 0
+    self.lock = threading.Lock()
+  
+  def add(self, phase: str, elapsed_ms: float, status: int) -> None:
+    with self.lock:
+      self.statuses[phase][status] += 1
+      if status < 400:
+        self.samples[phase].append(elapsed_ms)
+  
+  def report(self) -> Dict:
+    phases = {}
+    for phase in sorted(self.statuses):
+      statuses = self.statuses[phase]
+      phases[phase] = {
+        **summarize(self.samples[phase]),
+        'errors': sum(count for status, count in statuses.items() if status >= 400 and status != 429),
+        'busy': statuses.get(429, 0),
+        'statuses': {str(status): count for status, count in sorted(statuses.items())}
+      }
+    return phases
+
+
+class VirtualUser(threading.Thread):
+  
+  def __init__(self, index: int, args: argparse.Namespace, base_url: str, questions: List[Dict],
+               recorder: Recorder, deadline: float):
+    super().__init__(name=f'user-{index}', daemon=True)
+    self.args = args
+    self.base_url = base_url
+    self.questions = questions
+    self.recorder = recorder
+    self.deadline = deadline
+    self.rng = random.Random(args.seed + index)
+    self.session = requests.Session()
+  
+  def call(self, phase: str, method: str, path: str, payload: Optional[Dict] = None) -> Optional[Dict]:
+    started = time.perf_counter()
+    try:
+      response = self.session.request(method, self.base_url + path, json=payload, timeout=self.args.timeout)
+      status = response.status_code
+      data = response.json() if response.content else {}
+    except (requests.RequestException, ValueError):
+      status, data = 599, None
+    self.recorder.add(phase, (time.perf_counter() - started) * 1000, status)
+    return data if status < 400 else None
+  
+  def think(self) -> None:
+    if self.args.think_time > 0:
+      time.sleep(min(self.rng.expovariate(1 / self.args.think_time), max(0.0, self.deadline - time.monotonic())))
+  
+  def question(self) -> str:
+    weights = [q.get('weight', 1) for q in self.questions]
+    return self.rng.choices(self.questions, weights=weights)[0]['question']
+  
+  def run(self) -> None:
+    while time.monotonic() < self.deadline:
+      conversation_id = None
+      
+      for turn in range(self.args.turns):
+        if time.monotonic() >= self.deadline:
+          break
+        
+        data = self.call('chat_new' if not conversation_id else 'chat_followup', 'POST', '/api/chat',
+                         {'message': self.question(), 'conversation_id': conversation_id})
+        if not data:
+          break
+        conversation_id = data['conversation_id']
+        with self.recorder.lock:
+          self.recorder.questions += 1
+        
+        # the UI reloads the sidebar after the first answer
+        if turn == 0:
+          self.call('list_conversations', 'GET', '/api/conversations')
+        
+        self.think()
+        
+        if self.rng.random() < self.args.rerun_ratio:
+          conversation = self.call('get_conversation', 'GET', f'/api/conversations/{conversation_id}')
+          if conversation:
+            message_index = max(i for i, m in enumerate(conversation['messages']) if m['role'] == 'user')
+            if self.call('rerun', 'POST', '/api/chat/rerun', {
+              'conversation_id': conversation_id,
+              'message_index': message_index,
+              'new_message': self.question()
+            }):
+              with self.recorder.lock:
+                self.recorder.questions += 1
+            self.think()
+      
+      if conversation_id and self.rng.random() < self.args.delete_ratio:
+        self.call('delete_conversation', 'DELETE', f'/api/conversations/{conversation_id}')
+    
+    self.session.close()
+
+
+def free_port() -> int:
+  with socket.socket() as s:
+    s.bind(('127.0.0.1', 0))
+    return s.getsockname()[1]
+
+def database_size(path: str) -> int:
+  return sum(os.path.getsize(p) for p in (path, path + '-wal') if os.path.exists(p))
+
+def server_memory_kb(server: subprocess.Popen) -> Optional[int]:
+  # gunicorn: the server process and its workers
+  peaks = [peak_memory_kb(pid) for pid in [server.pid, *child_pids(server.pid)]]
+  return sum(peak for peak in peaks if peak) or None
+
+def prepare_workdir(args: argparse.Namespace) -> str:
+  workdir = tempfile.mkdtemp(prefix='sales-load-')
+  os.makedirs(os.path.join(workdir, 'data'))
+  
+  random.seed(args.seed)
+  with contextlib.redirect_stdout(io.StringIO()):  # keep stdout for the report
+    init_db.init_database(os.path.join(workdir, 'sales.db'), args.scale)
+  return workdir
+
+def start_server(args: argparse.Namespace, workdir: str, port: int) -> subprocess.Popen:
+  env = dict(
+    os.environ,
+    PYTHONPATH=ROOT,
+    LLM_PROVIDER='replay',
+    REPLAY_MODE=args.provider,
+    REPLAY_LATENCY=str(args.latency),
+    REPLAY_CASSETTE=os.path.abspath(args.cassette) if args.cassette else os.path.join(workdir, 'data', 'cassette.jsonl'),
+    REPLAY_SCRIPT=os.path.abspath(args.script) if args.script else '',
+    LLM_CACHE='false',
+    PLAN_CACHE=args.plan_cache,
+    METRICS='true' if args.metrics == 'on' else 'false',
+    WEB_CONCURRENCY=str(args.workers),
+    APP_SERVER='asgi' if args.server == 'gunicorn-asgi' else 'wsgi'
+  )
+  command = [part.format(port=port) for part in SERVER_COMMANDS[args.server]]
+  log = open(os.path.join(workdir, 'server.log'), 'w')
+  server = subprocess.Popen(command, cwd=workdir, env=env, stdout=log, stderr=log)
+  
+  base_url = f'http://127.0.0.1:{port}'
+  for _ in range(100):
+    if server.poll() is not None:
+      raise RuntimeError(f'Server exited, see {workdir}/server.log')
+    try:
+      requests.get(base_url + '/api/conversations', timeout=1)
+      return server
+    except requests.RequestException:
+      time.sleep(0.1)
+  
+  server.terminate()
+  raise RuntimeError('Server did not start within 10 seconds')
+
+def monitor(server: subprocess.Popen, conversations_db: str, stop: threading.Event, timeline: List[Dict], started: float) -> None:
+  while not stop.wait(1.0):
+    timeline.append({
+      't_s': round(time.monotonic() - started, 1),
+      'conversations_db_bytes': database_size(conversations_db),
+      'peak_rss_kb': server_memory_kb(server)
+    })
+
+def load_questions(path: Optional[str]) -> List[Dict]:
+  if not path:
+    return DEFAULT_QUESTIONS
+  
+  with open(path, 'r', encoding='utf-8') as f:
+    questions = json.load(f)
+  return [q if isinstance(q, dict) else {'question': q} for q in questions]
+
+def run(args: argparse.Namespace) -> Dict:
+  workdir = prepare_workdir(args)
+  conversations_db = os.path.join(workdir, 'data', 'conversations.db')
+  port = free_port()
+  server = start_server(args, workdir, port)
+  
+  recorder = Recorder()
+  timeline = []
+  stop = threading.Event()
+  started = time.monotonic()
+  deadline = started + args.duration
+  
+  try:
+    watcher = threading.Thread(target=monitor, args=(server, conversations_db, stop, timeline, started), daemon=True)
+    watcher.start()
+    
+    questions = load_questions(args.questions)
+    users = [VirtualUser(i, args, f'http://127.0.0.1:{port}', questions, recorder, deadline) for i in range(args.users)]
+    for user in users:
+      user.start()
+      time.sleep(args.ramp_up / max(1, args.users))
+    for user in users:
+      user.join()
+    
+    elapsed = time.monotonic() - started
+    stop.set()
+    peak_rss = server_memory_kb(server)
+  finally:
+    server.terminate()
+    server.wait(30)
+  
+  phases = recorder.report()
+  requests_done = sum(phase['count'] for phase in phases.values())
+  conversations_bytes = database_size(conversations_db)
+  
+  report = {
+    'config': {k: v for k, v in vars(args).items() if k != 'output'},
+    'elapsed_s': round(elapsed, 2),
+    'requests': requests_done,
+    'questions': recorder.questions,
+    'throughput_rps': round(requests_done / elapsed, 2),
+    'questions_per_s': round(recorder.questions / elapsed, 3),
+    'phases': phases,
+    'server': {
+      'peak_rss_kb': peak_rss,
+      'conversations_db_bytes': conversations_bytes,
+      'conversations_db_bytes_per_question': round(conversations_bytes / recorder.questions) if recorder.questions else None
+    },
+    'timeline': timeline
+  }
+  
+  if args.keep:
+    report['workdir'] = workdir
+  else:
+    shutil.rmtree(workdir, ignore_errors=True)
+  return report
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+  parser = argparse.ArgumentParser(description='Load test the chat API with an offline LLM provider.')
+  parser.add_argument('--server', choices=sorted(SERVER_COMMANDS), default='flask')
+  parser.add_argument('--workers', type=int, default=2, help='worker processes of the gunicorn servers')
+  parser.add_argument('--users', type=int, default=10, help='concurrent virtual users')
+  parser.add_argument('--duration', type=float, default=30, help='seconds')
+  parser.add_argument('--ramp-up', type=float, default=2, help='seconds until all users are running')
+  parser.add_argument('--turns', type=int, default=3, help='questions per conversation')
+  parser.add_argument('--think-time', type=float, default=1.0, help='mean seconds between requests of a user (exponential)')
+  parser.add_argument('--rerun-ratio', type=float, default=0.1, help='share of turns that are edited and rerun')
+  parser.add_argument('--delete-ratio', type=float, default=0.2, help='share of conversations deleted at the end')
+  parser.add_argument('--questions', help='JSON file with questions or {"question", "weight"} objects')
+  parser.add_argument('--scale', type=int, default=1, help='sales.db scale factor (init_db.py)')
+  parser.add_argument('--provider', choices=['synthetic', 'replay'], default='synthetic')
+  parser.add_argument('--latency', default='500', help="simulated model latency in ms, or 'recorded' for replay")
+  parser.add_argument('--cassette', help='cassette for --provider replay')
+  parser.add_argument('--script', help='script for --provider synthetic (see llm_replay.py)')
+  parser.add_argument('--plan-cache', default='off', choices=['off', 'narrate', 'fast'])
+  parser.add_argument('--metrics', default='on', choices=['on', 'off'], help='off measures the cost of the instrumentation')
+  parser.add_argument('--timeout', type=float, default=120)
+  parser.add_argument('--seed', type=int, default=1)
+  parser.add_argument('--keep', action='store_true', help='keep the scratch directory (database, conversations, logs)')
+  parser.add_argument('--output', help='write the JSON report to this file as well')
+  return parser.parse_args(argv)
+
+if __name__ == '__main__':
+  args = parse_args()
+  write_report(run(args), args.output)
@@ -0,0 +1,223 @@
+"""Micro-benchmarks of the database helpers that run on every tool call.
+
+Each case is timed on a small (scale 1) and a scaled copy of sales.db: a few
+warmup rounds, then repeated timed batches (sized like timeit's autorange) with
+the garbage collector off. The median time per call is compared against a
+stored baseline; the script exits with status 1 if a case got slower than the
+baseline by more than the threshold.
+
+  python bench/micro.py --save-baseline          # record bench/micro_baseline.json
+  python bench/micro.py --threshold 0.2          # compare, fail on > 20% regressions
+  python bench/micro.py --filter validate --reps 30
+
+The helpers are instrumented (metrics.py, query_stats.py), compare a run with
+METRICS=false or QUERY_STATS=false to see the cost; metrics.span is the cost of
+a single span.
+"""
+
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from common import ROOT, summarize, write_report
+import init_db
+import db_helpers
+import metrics
+from query_stats import QueryStats
+from config import Config
+
+DEFAULT_BASELINE = os.path.join(ROOT, 'bench', 'micro_baseline.json')
+
+VALIDATE_QUERIES = {
+  'simple': 'SELECT name, email, city FROM customers WHERE country = \'Germany\' ORDER BY name',
+  'join': (
+    'SELECT c.name, SUM(o.amount_sum) AS revenue FROM customers c '
+    'JOIN orders o ON o.customer_id = c.id GROUP BY c.id ORDER BY revenue DESC LIMIT 10'
+  ),
+  'star': 'SELECT * FROM order_items WHERE quantity > 2',
+  'invalid': 'SELECT name, revenue FROM customers'
+}
+
+RESULT_QUERIES = {
+  'rows_10': 'SELECT * FROM customers LIMIT 10',
+  'rows_all_orders': 'SELECT * FROM orders',
+  'rows_all_items': 'SELECT * FROM order_items'
+}
+
+
+def build_databases(workdir: str, scales: List[int], seed: int) -> Dict[int, str]:
+  paths = {}
+  for scale in scales:
+    path = os.path.join(workdir, f'sales_x{scale}.db')
+    random.seed(seed)
+    with contextlib.redirect_stdout(io.StringIO()):
+      init_db.init_database(path, scale)
+    paths[scale] = path
+  return paths
+
+def use_database(path: str) -> None:
+  # db_helpers keeps a read-only connection per thread and caches the schema
+  Config.DB_PATH = path
+  db_helpers.close_readonly_connection()
+  db_helpers._schema_cache.update(version=None, catalog=None, prompt=None)
+  if db_helpers.query_stats:
+    db_helpers.query_stats = QueryStats()  # in memory, keeps the benchmark out of data/query_stats.json
+
+def load_mcp_server() -> Tuple[Optional[Any], str]:
+  try:
+    import mcp_server  # the tools are plain functions, fastmcp is only imported to serve them
+  except Exception as e:
+    return None, f'{type(e).__name__}: {e}'
+  return mcp_server, ''
+
+def schema_cold() -> Any:
+  db_helpers._schema_cache['version'] = None
+  return db_helpers.get_schema_dict()
+
+def empty_span() -> None:
+  with metrics.span('bench'):
+    pass
+
+def cases(mcp_server: Optional[Any]) -> List[Tuple[str, Callable]]:
+  cases = [
+    ('metrics.span', empty_span),
+    ('get_schema_dict', db_helpers.get_schema_dict),
+    ('get_schema_dict.cold', schema_cold)
+  ]
+  cases += [(f'validate_sql_against_schema.{name}', lambda q=query: db_helpers.validate_sql_against_schema(q))
+            for name, query in VALIDATE_QUERIES.items()]
+  cases += [(f'execute_sql_query.{name}', lambda q=query: db_helpers.execute_sql_query(q))
+            for name, query in RESULT_QUERIES.items()]
+  cases += [
+    ('get_sample_data.5', lambda: db_helpers.get_sample_data('orders', 5)),
+    ('get_sample_data.100', lambda: db_helpers.get_sample_data('order_items', 100))
+  ]
+  
+  if mcp_server:
+    execute = mcp_server.execute_sql_query
+    sample = mcp_server.get_sample_data
+    cases += [(f'mcp.execute_sql_query.{name}', lambda q=query: execute(q)) for name, query in RESULT_QUERIES.items()]
+    cases += [('mcp.get_sample_data.100', lambda: sample('order_items', 100))]
+  return cases
+
+def calibrate(fn: Callable, min_time: float) -> int:
+  # calls per timed batch, so that one batch takes at least min_time seconds
+  number = 1
+  while True:
+    started = time.perf_counter()
+    for _ in range(number):
+      fn()
+    if time.perf_counter() - started >= min_time or number >= 1_000_000:
+      return number
+    number *= 2
+
+def measure(fn: Callable, warmup: int, reps: int, min_time: float) -> Dict:
+  for _ in range(warmup):
+    fn()
+  number = calibrate(fn, min_time)
+  
+  samples_us = []
+  gc_was_enabled = gc.isenabled()
+  gc.disable()
+  try:
+    for _ in range(reps):
+      started = time.perf_counter()
+      for _ in range(number):
+        fn()
+      samples_us.append((time.perf_counter() - started) * 1_000_000 / number)
+  finally:
+    if gc_was_enabled:
+      gc.enable()
+  
+  return {**summarize(samples_us, 'us'), 'calls_per_sample': number}
+
+def compare(results: Dict, baseline: Dict, threshold: float) -> List[Dict]:
+  regressions = []
+  for name, result in results.items():
+    before = baseline.get(name)
+    if not before or 'p50_us' not in result:
+      continue
+    
+    change = result['p50_us'] / before['p50_us'] - 1 if before['p50_us'] else 0.0
+    result['baseline_p50_us'] = before['p50_us']
+    result['change'] = round(change, 3)
+    if change > threshold:
+      regressions.append({'case': name, 'baseline_p50_us': before['p50_us'], 'p50_us': result['p50_us'], 'change': round(change, 3)})
+  return regressions
+
+def run(args: argparse.Namespace) -> Tuple[Dict, int]:
+  workdir = tempfile.mkdtemp(prefix='sales-micro-')
+  original_db = Config.DB_PATH
+  mcp_server, mcp_missing = load_mcp_server()
+  results = {}
+  
+  try:
+    databases = build_databases(workdir, args.scales, args.seed)
+    for scale, path in databases.items():
+      use_database(path)
+      if mcp_server:
+        mcp_server.DB_PATH = path
+      
+      for name, fn in cases(mcp_server):
+        case = f'{name}@x{scale}'
+        if args.filter and not re.search(args.filter, case):
+          continue
+        results[case] = measure(fn, args.warmup, args.reps, args.min_time)
+        print(f"{case:55} {results[case]['p50_us']:12.3f} us", file=sys.stderr)
+  finally:
+    use_database(original_db)
+    shutil.rmtree(workdir, ignore_errors=True)
+  
+  report = {
+    'config': {k: v for k, v in vars(args).items() if k != 'output'},
+    'python': sys.version.split()[0],
+    'skipped': {'mcp_server': mcp_missing} if mcp_missing else {},
+    'results': results
+  }
+  
+  if args.save_baseline:
+    with open(args.baseline, 'w', encoding='utf-8') as f:
+      json.dump({name: {'p50_us': r['p50_us']} for name, r in results.items()}, f, indent=2)
+      f.write('\n')
+    report['baseline_saved'] = args.baseline
+    return report, 0
+  
+  if not os.path.exists(args.baseline):
+    report['regressions'] = None  # nothing to compare against yet
+    return report, 0
+  
+  with open(args.baseline, 'r', encoding='utf-8') as f:
+    baseline = json.load(f)
+  report['regressions'] = compare(results, baseline, args.threshold)
+  return report, 1 if report['regressions'] else 0
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+  parser = argparse.ArgumentParser(description='Micro-benchmark the database helpers against a stored baseline.')
+  parser.add_argument('--scales', type=int, nargs='+', default=[1, 50], help='sales.db scale factors (init_db.py)')
+  parser.add_argument('--warmup', type=int, default=3, help='untimed calls before measuring')
+  parser.add_argument('--reps', type=int, default=15, help='timed batches per case')
+  parser.add_argument('--min-time', type=float, default=0.05, help='minimum seconds per timed batch')
+  parser.add_argument('--filter', help='only run cases matching this regex, e.g. validate or @x50')
+  parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+  parser.add_argument('--save-baseline', action='store_true', help='store the results as the new baseline')
+  parser.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown of the median, 0.25 = 25%%')
+  parser.add_argument('--seed', type=int, default=1)
+  parser.add_argument('--output', help='write the JSON report to this file as well')
+  return parser.parse_args(argv)
+
+if __name__ == '__main__':
+  args = parse_args()
+  report, status = run(args)
+  write_report(report, args.output)
+  if report.get('regressions'):
+    print(f"{len(report['regressions'])} case(s) slower than the baseline by more than {args.threshold:.0%}", file=sys.stderr)
+  sys.exit(status)
@@ -0,0 +1,155 @@
+"""Import-time budget of the entry points.
+
+Every module is imported in a fresh interpreter, a few times: the median time of
+the import itself (without the interpreter start) is compared against its budget
+in milliseconds. One more run with -X importtime lists the slowest direct imports
+of each module. The script exits with status 1 if a module is over budget or
+loaded a module it must leave to first use, e.g. google.genai or fastmcp.
+
+  python bench/startup.py                         # LLM_PROVIDER=ollama, default budgets
+  python bench/startup.py --provider gemini --reps 10
+  python bench/startup.py --budget app=400 --output startup.json
+
+The budgets are for a warm file system cache and compiled bytecode, one untimed
+import per module comes first.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List, Optional, Tuple
+from common import ROOT, summarize, write_report
+
+BUDGETS_MS = {
+  'db_helpers': 100,
+  'mcp_server': 100,
+  'app': 600
+}
+
+# loaded on first use (provider SDK, MCP server), never by the import
+DEFERRED = {
+  'db_helpers': ['flask', 'requests', 'httpx', 'google.genai', 'fastmcp'],
+  'mcp_server': ['flask', 'requests', 'httpx', 'google.genai', 'fastmcp'],
+  'app': ['google.genai', 'fastmcp']
+}
+
+CHILD = '''
+import json, sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps({{'ms': elapsed * 1000, 'loaded': [name for name in {deferred!r} if name in sys.modules]}}))
+'''
+
+def child_env(provider: str) -> Dict[str, str]:
+  env = dict(os.environ)
+  env['PYTHONPATH'] = ROOT + os.pathsep + env.get('PYTHONPATH', '')
+  env['LLM_PROVIDER'] = provider
+  return env
+
+def import_once(module: str, workdir: str, env: Dict[str, str]) -> Dict:
+  # the working directory is a scratch folder, app.py creates logs/ and data/ there
+  result = subprocess.run(
+    [sys.executable, '-c', CHILD.format(module=module, deferred=DEFERRED.get(module, []))],
+    cwd=workdir, env=env, capture_output=True, text=True
+  )
+  if result.returncode != 0:
+    raise RuntimeError(f'import {module} failed:\n{result.stderr.strip()}')
+  return json.loads(result.stdout.strip().splitlines()[-1])
+
+def slowest_imports(module: str, workdir: str, env: Dict[str, str], top: int) -> List[Dict]:
+  # -X importtime: "import time: self [us] | cumulative | name", a module is listed after
+  # its own imports, which are indented by two more spaces
+  result = subprocess.run(
+    [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+    cwd=workdir, env=env, capture_output=True, text=True
+  )
+  imports = []
+  for line in result.stderr.splitlines():
+    if not line.startswith('import time:') or '|' not in line:
+      continue
+    _, cumulative, name = line[len('import time:'):].split('|')
+    if not cumulative.strip().isdigit():
+      continue
+    if not name.startswith('  '):
+      if name.strip() == module:
+        break
+      imports = []  # imports of the interpreter start (site)
+    elif not name.startswith('    '):
+      imports.append({'module': name.strip(), 'cumulative_ms': round(int(cumulative) / 1000, 2)})
+  return sorted(imports, key=lambda entry: entry['cumulative_ms'], reverse=True)[:top]
+
+def measure(module: str, workdir: str, env: Dict[str, str], reps: int, top: int) -> Dict:
+  import_once(module, workdir, env)  # writes the bytecode cache
+  
+  samples_ms = []
+  loaded = set()
+  for _ in range(reps):
+    sample = import_once(module, workdir, env)
+    samples_ms.append(sample['ms'])
+    loaded.update(sample['loaded'])
+  
+  return {
+    **summarize(samples_ms),
+    'deferred_but_loaded': sorted(loaded),
+    'slowest_imports': slowest_imports(module, workdir, env, top)
+  }
+
+def parse_budgets(overrides: List[str]) -> Dict[str, float]:
+  budgets = dict(BUDGETS_MS)
+  for override in overrides:
+    module, _, ms = override.partition('=')
+    budgets[module] = float(ms)
+  return budgets
+
+def run(args: argparse.Namespace) -> Tuple[Dict, int]:
+  workdir = tempfile.mkdtemp(prefix='sales-startup-')
+  env = child_env(args.provider)
+  budgets = parse_budgets(args.budget)
+  modules = args.modules or list(budgets)
+  results = {}
+  failures = []
+  
+  try:
+    for module in modules:
+      result = measure(module, workdir, env, args.reps, args.top)
+      result['budget_ms'] = budgets.get(module)
+      results[module] = result
+      print(f"{module:20} {result['p50_ms']:10.1f} ms  (budget {result['budget_ms']} ms)", file=sys.stderr)
+      
+      if result['budget_ms'] is not None and result['p50_ms'] > result['budget_ms']:
+        failures.append({'module': module, 'p50_ms': result['p50_ms'], 'budget_ms': result['budget_ms']})
+      if result['deferred_but_loaded']:
+        failures.append({'module': module, 'loaded': result['deferred_but_loaded']})
+  finally:
+    shutil.rmtree(workdir, ignore_errors=True)
+  
+  report = {
+    'config': {k: v for k, v in vars(args).items() if k != 'output'},
+    'python': sys.version.split()[0],
+    'results': results,
+    'failures': failures
+  }
+  return report, 1 if failures else 0
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+  parser = argparse.ArgumentParser(description='Measure the import time of the entry points against a budget.')
+  parser.add_argument('modules', nargs='*', help=f'modules to import (default: {", ".join(BUDGETS_MS)})')
+  parser.add_argument('--provider', default='ollama', help='LLM_PROVIDER for the imports')
+  parser.add_argument('--reps', type=int, default=5, help='timed imports per module')
+  parser.add_argument('--budget', action='append', default=[], metavar='MODULE=MS', help='override a budget, repeatable')
+  parser.add_argument('--top', type=int, default=8, help='slowest direct imports listed per module')
+  parser.add_argument('--output', help='write the JSON report to this file as well')
+  return parser.parse_args(argv)
+
+if __name__ == '__main__':
+  args = parse_args()
+  report, status = run(args)
+  write_report(report, args.output)
+  if report['failures']:
+    print(f"{len(report['failures'])} import budget violation(s)", file=sys.stderr)
+  sys.exit(status)
@@ -21,8 +21,96 @@ class Config:
   OPENROUTER_API_KEY = os.environ.get('OPENROUTER_API_KEY')
   OPENROUTER_MODEL   = os.environ.get('OPENROUTER_MODEL', 'anthropic/claude-3.5-sonnet')
   
+  # LLM_PROVIDER=replay: offline provider for benchmarks, see llm_replay.py
+  REPLAY_MODE        = os.environ.get('REPLAY_MODE', 'replay')  # 'record', 'replay' or 'synthetic'
+  REPLAY_BACKEND     = os.environ.get('REPLAY_BACKEND', 'gemini')  # provider that is recorded
+  REPLAY_CASSETTE    = os.environ.get('REPLAY_CASSETTE', 'data/cassette.jsonl')
+  REPLAY_SCRIPT      = os.environ.get('REPLAY_SCRIPT', '')  # synthetic mode: JSON file with scripted tool calls
+  REPLAY_LATENCY     = os.environ.get('REPLAY_LATENCY', 'recorded')  # 'recorded' or milliseconds per request
+  
+  # Provider limits the request scheduler keeps to (requests / tokens per minute),
+  # providers without an entry are not limited
+  RATE_LIMITS        = {
+    'gemini':     {'rpm': 10, 'tpm': 250000},
+    'openrouter': {'rpm': 20}
+  }
+  QUEUE_SIZE         = 50  # requests waiting for a provider, more are refused
+  QUEUE_MAX_WAIT     = 60  # seconds, a request that would wait longer is refused with its queue position and ETA
+  
+  # LLM_PROVIDER=router: route each request to the fastest healthy of these backends
+  ROUTER_BACKENDS    = [name.strip() for name in os.environ.get('ROUTER_BACKENDS', 'ollama,openrouter').split(',') if name.strip()]
+  ROUTER_HEDGE_AT    = 95   # latency percentile of the primary after which a duplicate goes to the next backend
+  ROUTER_HEDGE_MIN   = 1.0  # seconds, never hedge earlier than this
+  ROUTER_MAX_ERRORS  = 0.5  # error rate above which a backend counts as unhealthy
+  ROUTER_WINDOW      = 50   # requests per backend the statistics are computed over
+  
   MAX_ITERATIONS     = 5
-  CONVERSATIONS_FILE = 'data/conversations.json'
+  SQL_STAGE_MODEL    = os.environ.get('SQL_STAGE_MODEL', '')  # e.g. 'ollama:qwen2.5-coder:7b' writes the SQL, the main model the answer
+  PRELOAD_SCHEMA     = True  # put the schema into the system prompt, saves the get_database_schema round trip
+  TOOL_WORKERS       = 4  # tool calls of one model turn run concurrently on this many threads
+  SQL_BATCH_WORKERS  = int(os.environ.get('SQL_BATCH_WORKERS', '4'))  # queries of an execute_sql_batch call that run at the same time
+  SQL_BATCH_MAX      = 8  # queries per execute_sql_batch call
+  CONVERSATIONS_DB   = 'data/conversations.db'
+  CONVERSATIONS_FILE = 'data/conversations.json'  # imported into CONVERSATIONS_DB once
+  
+  # Background chat turns, see jobs.py
+  CHAT_JOBS          = os.environ.get('CHAT_JOBS', 'false').lower() == 'true'  # /api/chat queues a job unless the request sends "background": false
+  JOB_WORKERS        = int(os.environ.get('JOB_WORKERS', '4'))  # chat turns answered at a time per worker process
+  JOB_TTL            = 3600  # seconds finished jobs can still be polled
+  JOB_POLL_WAIT      = 25    # seconds a long-poll of /api/jobs/<id> waits at most
+  JOB_POLL_WAIT_WSGI = 2     # the same through Flask (WSGI), where every waiting poll holds a request thread
+  
+  LLM_CACHE_ENABLED  = os.environ.get('LLM_CACHE', 'true').lower() == 'true'
+  LLM_CACHE_SIZE     = 256   # entries, least recently used are evicted first
+  LLM_CACHE_TTL      = 3600  # seconds
+  LLM_CACHE_FILE     = os.environ.get('LLM_CACHE_FILE', '')  # e.g. data/llm_cache.json to keep the cache across restarts
+  
+  PROMPT_CACHE       = os.environ.get('PROMPT_CACHE', 'true').lower() == 'true'  # provider-side caching of system prompt + tools
+  PROMPT_CACHE_TTL   = 3600  # seconds, Gemini cached content lifetime (extended while in use)
+  
+  PLAN_CACHE_MODE    = os.environ.get('PLAN_CACHE', 'narrate').lower()  # 'off', 'narrate' (model only writes the summary) or 'fast' (no model call)
+  PLAN_CACHE_FILE    = 'data/plan_cache.json'
+  PLAN_CACHE_SIZE    = 500
+  PLAN_SIMILARITY    = 0.9  # min. token similarity of two question templates
+  
+  # Prompt token budget for the system instruction and the conversation history, per provider or 'provider:model'
+  HISTORY_BUDGET     = {
+    'default':    8000,
+    'gemini':     32000,
+    'ollama':     6000,
+    'openrouter': 16000
+  }
+  HISTORY_TURNS      = 2  # turns always sent verbatim, older tool results are digested
+  HISTORY_SUMMARIZE  = os.environ.get('HISTORY_SUMMARIZE', 'false').lower() == 'true'  # let the model summarize dropped turns
+  
+  RESULT_STORE_SIZE  = 200   # query results kept server-side for paging
+  RESULT_TTL         = 1800  # seconds
+  RESULT_SPILL_DIR   = os.environ.get('RESULT_SPILL_DIR', 'data/results')  # results on disk, shared by the workers; empty keeps them in memory only
+  RESULT_MEMORY_ROWS = 200000  # rows of all results held in memory, older results are read back from disk
+  RESULT_PAGE_MAX    = 500  # rows per page of /api/results
+  EXPORT_BATCH_ROWS  = 5000  # rows fetched and written at a time by /api/export
+  DIAGRAM_MAX_POINTS = int(os.environ.get('DIAGRAM_MAX_POINTS', '200'))  # points per dataset of a diagram built from a result
+  
+  QUERY_STATS        = os.environ.get('QUERY_STATS', 'true').lower() == 'true'  # statement statistics of the executed SQL, see query_stats.py
+  QUERY_STATS_FILE   = 'data/query_stats.json'
+  QUERY_STATS_SIZE   = 1000  # query shapes, least recently run are dropped first
+  SLOW_QUERY_MS      = float(os.environ.get('SLOW_QUERY_MS', '500'))  # slower statements go to logs/slow_queries.log
+  
+  # Per-request profiling of /api/chat (X-Profile header or ?profile=), see profiling.py
+  ADMIN_TOKEN        = os.environ.get('ADMIN_TOKEN', '')  # required as X-Admin-Token, empty disables profiling
+  PROFILE_MODE       = os.environ.get('PROFILE_MODE', 'cprofile')  # for X-Profile: 1, 'cprofile' (.pstats) or 'sampling' (speedscope)
+  PROFILE_MAX_CONCURRENT = 1  # profiled requests at a time, further ones run unprofiled
+  PROFILE_INTERVAL   = 0.005  # seconds between samples of the sampling profiler
+  PROFILE_DIR        = 'logs'
+  
+  # Production server (gunicorn.conf.py), each worker process has its own caches and
+  # keeps RATE_LIMITS divided by WORKERS
+  WORKERS            = 1
+  THREADS            = int(os.environ.get('THREADS', '8'))  # request threads per worker (WSGI)
+  DRAIN_TIMEOUT      = int(os.environ.get('DRAIN_TIMEOUT', '90'))  # seconds running conversations get to finish on shutdown
+  
+  METRICS            = os.environ.get('METRICS', 'true').lower() == 'true'  # /metrics endpoint and request phase timings
+  RESPONSE_TIMINGS   = os.environ.get('RESPONSE_TIMINGS', 'false').lower() == 'true'  # add a 'timings' breakdown to chat responses
   
   @property
   def SHOW_LIMITED_AI_WARNING(self):
@@ -48,6 +136,7 @@ STRICT EXECUTION PROTOCOL:
    - Always use `LIMIT` for unconstrained lists (default to 10 rows unless requested differently).
    - Use standard aggregations (SUM, COUNT, AVG) for summary statistics.
 4. **Execution**: Use `execute_sql_query()` with the raw SQL string.
+   - If a question needs several independent queries (e.g. a dashboard: revenue by category, top customers and the monthly trend), send them together in one `execute_sql_batch()` call.
 5. **Visualization (IMPORTANT)**:
    - After executing a query, evaluate if a diagram would enhance understanding.
    - Use `generate_diagram()` for: comparisons, trends over time, distributions, top N rankings, category breakdowns.
@@ -56,6 +145,7 @@ STRICT EXECUTION PROTOCOL:
      * **line**: Trends over time, temporal patterns
      * **pie/doughnut**: Proportions, market share, category distribution (use when <8 categories)
      * **radar**: Multi-dimensional comparisons
+   - Plot a query result by its `result_id` with `x_column` and `y_columns` instead of copying labels and numbers; the server reads the values and thins out long series.
    - You can show BOTH a table AND a diagram for the same data when helpful.
 6. **Analysis & Response (CRITICAL)**:
    - You MUST ALWAYS provide a natural language summary AFTER the tool output.
@@ -71,6 +161,7 @@ RESPONSE STYLE:
 class ProductionConfig(Config):
   DEBUG = False
   MAX_ITERATIONS = 5
+  WORKERS = int(os.environ.get('WEB_CONCURRENCY') or min(4, os.cpu_count() or 1))
 
 class DevelopmentConfig(Config):
   DEBUG = True
@@ -80,3 +171,10 @@ config = {
   'production': ProductionConfig,
   'default': DevelopmentConfig
 }
+
+def get_config(name=None):
+  # APP_ENV=production selects ProductionConfig
+  name = name or os.environ.get('APP_ENV', 'default')
+  if name not in config:
+    raise ValueError(f"Unknown APP_ENV: {name}")
+  return config[name]
@@ -0,0 +1,136 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Any, Optional
+
+# Conversations live in a SQLite database (WAL mode) instead of one JSON file
+# that every request loads and rewrites: a turn writes only its own conversation
+# in a transaction, so threads and the worker processes of a production server
+# (gunicorn.conf.py) no longer overwrite each other's changes.
+#
+# An existing conversations.json is imported once when the database is created.
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS conversations (
+  id            TEXT PRIMARY KEY,
+  title         TEXT NOT NULL,
+  created_at    TEXT NOT NULL,
+  message_count INTEGER NOT NULL,
+  data          TEXT NOT NULL,
+  updated_at    REAL NOT NULL
+)'''
+
+BUSY_TIMEOUT = 10  # seconds a writer waits for another process' transaction
+
+
+class SQLiteStore:
+  # a table in the conversation database, shared by the threads and worker processes
+  
+  def __init__(self, db_path: str):
+    self.db_path = db_path
+    self.local = threading.local()
+    self.ready = False
+    self.lock = threading.Lock()
+  
+  def connection(self) -> sqlite3.Connection:
+    # one connection per thread, and new ones in a forked worker process
+    conn = getattr(self.local, 'conn', None)
+    if conn is None or self.local.pid != os.getpid():
+      conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT, isolation_level=None)
+      conn.execute('PRAGMA journal_mode=WAL')
+      conn.execute('PRAGMA synchronous=NORMAL')
+      self.local.conn = conn
+      self.local.pid = os.getpid()
+    
+    if not self.ready:
+      with self.lock:
+        if not self.ready:
+          conn.execute('BEGIN IMMEDIATE')
+          try:
+            self.setup(conn)
+            conn.execute('COMMIT')
+          except Exception:
+            conn.execute('ROLLBACK')
+            raise
+          self.ready = True
+    return conn
+  
+  def setup(self, conn: sqlite3.Connection) -> None:
+    raise NotImplementedError
+  
+  def close(self) -> None:
+    # the calling thread's connection, e.g. in the server process before it forks workers
+    conn = getattr(self.local, 'conn', None)
+    if conn is not None:
+      conn.close()
+      self.local.conn = None
+
+
+class ConversationStore(SQLiteStore):
+  
+  def __init__(self, db_path: str, import_path: Optional[str] = None):
+    super().__init__(db_path)
+    self.import_path = import_path
+  
+  def setup(self, conn: sqlite3.Connection) -> None:
+    created = not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'conversations'").fetchone()
+    conn.execute(SCHEMA)
+    if created and self.import_path and os.path.exists(self.import_path):
+      self.import_json(conn, self.import_path)
+  
+  def import_json(self, conn: sqlite3.Connection, path: str) -> None:
+    try:
+      with open(path, 'r', encoding='utf-8') as f:
+        conversations = json.load(f)
+    except (OSError, ValueError):
+      return
+    
+    conn.executemany(
+      'INSERT OR IGNORE INTO conversations VALUES (?, ?, ?, ?, ?, ?)',
+      [self.row(conversation) for conversation in conversations.values()]
+    )
+  
+  def row(self, conversation: Dict) -> tuple:
+    return (
+      conversation['id'],
+      conversation['title'],
+      conversation['created_at'],
+      len(conversation['messages']),
+      json.dumps(conversation, ensure_ascii=False),
+      time.time()
+    )
+  
+  def get(self, conversation_id: str) -> Optional[Dict]:
+    row = self.connection().execute('SELECT data FROM conversations WHERE id = ?', (conversation_id,)).fetchone()
+    return json.loads(row[0]) if row else None
+  
+  def list(self) -> List[Dict]:
+    rows = self.connection().execute(
+      'SELECT id, title, created_at, message_count FROM conversations ORDER BY created_at DESC'
+    ).fetchall()
+    return [{'id': conversation_id, 'title': title, 'created_at': created_at, 'message_count': message_count}
+            for conversation_id, title, created_at, message_count in rows]
+  
+  def save(self, conversation: Dict) -> None:
+    self.connection().execute(
+      '''INSERT INTO conversations VALUES (?, ?, ?, ?, ?, ?)
+         ON CONFLICT(id) DO UPDATE SET
+           title = excluded.title, message_count = excluded.message_count,
+           data = excluded.data, updated_at = excluded.updated_at''',
+      self.row(conversation)
+    )
+  
+  def delete(self, conversation_id: str) -> bool:
+    return self.connection().execute('DELETE FROM conversations WHERE id = ?', (conversation_id,)).rowcount > 0
+  
+  def stats(self) -> Dict:
+    count = self.connection().execute('SELECT COUNT(*) FROM conversations').fetchone()[0]
+    file_bytes = sum(os.path.getsize(path) for path in (self.db_path, self.db_path + '-wal') if os.path.exists(path))
+    return {'count': count, 'file_bytes': file_bytes}
+
+
+def create_conversation_store(config: Any) -> ConversationStore:
+  os.makedirs(os.path.dirname(config.CONVERSATIONS_DB) or '.', exist_ok=True)
+  return ConversationStore(config.CONVERSATIONS_DB, import_path=config.CONVERSATIONS_FILE)
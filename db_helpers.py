@@ -1,6 +1,14 @@
+import contextvars
 import sqlite3
 import re
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from config import Config
+import metrics
+from query_stats import create_query_stats, explain, StepCounter
 
 # The functions get_db_connection, get_schema_dict, and validate_sql_against_schema
 # are duplicated in mcp_server.py. This is intentional:
@@ -13,22 +21,131 @@ def get_db_connection():
   conn.row_factory = sqlite3.Row
   return conn
 
-def get_schema_dict():
-  conn = get_db_connection()
+# Tool calls run concurrently on a thread pool (see orchestrator.py), each worker
+# thread keeps its own read-only connection instead of opening one per query.
+_readonly = threading.local()
+
+def get_readonly_connection():
+  conn = getattr(_readonly, 'conn', None)
+  if conn is None:
+    conn = sqlite3.connect(Path(Config.DB_PATH).absolute().as_uri() + '?mode=ro', uri=True)
+    conn.row_factory = sqlite3.Row
+    _readonly.conn = conn
+  return conn
+
+def close_readonly_connection():
+  # the calling thread's connection; a forked worker must not share it with its parent
+  conn = getattr(_readonly, 'conn', None)
+  if conn is not None:
+    conn.close()
+    _readonly.conn = None
+
+def get_data_version() -> str:
+  # changes with every committed write, including writes still sitting in the WAL
+  versions = []
+  for path in (Config.DB_PATH, Config.DB_PATH + '-wal'):
+    try:
+      stat = os.stat(path)
+      versions.append(f'{stat.st_mtime_ns}:{stat.st_size}')
+    except OSError:
+      versions.append('-')
+  return '/'.join(versions)
+
+def get_schema_version() -> int:
+  return get_readonly_connection().execute('PRAGMA schema_version').fetchone()[0]
+
+# The schema catalog is built once and reused until PRAGMA schema_version changes.
+# It backs the SQL validation on every query and the schema section of the system prompt.
+DOMAIN_MAX_VALUES = 12
+_schema_cache = {'version': None, 'catalog': None, 'prompt': None}
+_schema_lock = threading.Lock()
+
+def build_schema_catalog() -> dict:
+  conn = get_readonly_connection()
   cursor = conn.cursor()
   
-  cursor.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name")
-  tables = cursor.fetchall()
+  cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY name")
+  tables = [row[0] for row in cursor.fetchall()]
   
-  schema = {}
-  for table in tables:
-    table_name = table[0]
+  catalog = {}
+  for table_name in tables:
     cursor.execute(f"PRAGMA table_info({table_name})")
-    columns = cursor.fetchall()
-    schema[table_name] = [col[1].lower() for col in columns]
+    columns = [
+      {'name': col[1], 'type': col[2], 'not_null': bool(col[3]), 'primary_key': bool(col[5])}
+      for col in cursor.fetchall()
+    ]
+    
+    cursor.execute(f"PRAGMA foreign_key_list({table_name})")
+    foreign_keys = {fk[3]: f'{fk[2]}.{fk[4]}' for fk in cursor.fetchall()}
+    
+    cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
+    row_count = cursor.fetchone()[0]
+    
+    domains = {}
+    for col in columns:
+      col_name = col['name']
+      if col['type'].upper() != 'TEXT' or col['primary_key']:
+        continue
+      
+      if col_name.endswith('_date') or col_name.endswith('_at'):
+        cursor.execute(f"SELECT MIN({col_name}), MAX({col_name}) FROM {table_name}")
+        low, high = cursor.fetchone()
+        if low:
+          domains[col_name] = {'range': [low, high]}
+        continue
+      
+      cursor.execute(f"SELECT COUNT(DISTINCT {col_name}) FROM {table_name}")
+      distinct = cursor.fetchone()[0]
+      if 0 < distinct <= DOMAIN_MAX_VALUES and distinct * 2 <= row_count:
+        cursor.execute(f"SELECT DISTINCT {col_name} FROM {table_name} WHERE {col_name} IS NOT NULL ORDER BY {col_name}")
+        domains[col_name] = {'values': [row[0] for row in cursor.fetchall()]}
+    
+    catalog[table_name] = {'columns': columns, 'foreign_keys': foreign_keys, 'domains': domains}
   
-  conn.close()
-  return schema
+  cursor.close()
+  return catalog
+
+def render_schema_prompt(catalog: dict) -> str:
+  lines = ['DATABASE SCHEMA (already loaded, call get_database_schema() only if a query fails on a missing table or column):']
+  
+  for table_name, table in catalog.items():
+    columns = []
+    for col in table['columns']:
+      text = f"{col['name']} {col['type']}"
+      if col['primary_key']:
+        text += ' PK'
+      if col['name'] in table['foreign_keys']:
+        text += f" -> {table['foreign_keys'][col['name']]}"
+      columns.append(text)
+    lines.append(f"- {table_name}({', '.join(columns)})")
+  
+  domains = [(table_name, col_name, domain) for table_name, table in catalog.items() for col_name, domain in table['domains'].items()]
+  if domains:
+    lines.append('Known values:')
+    for table_name, col_name, domain in domains:
+      if 'range' in domain:
+        lines.append(f"- {table_name}.{col_name}: {domain['range'][0][:10]} to {domain['range'][1][:10]}")
+      else:
+        lines.append(f"- {table_name}.{col_name}: {', '.join(str(v) for v in domain['values'])}")
+  
+  return '\n'.join(lines)
+
+def get_schema_catalog() -> dict:
+  version = get_schema_version()
+  
+  with _schema_lock:
+    if _schema_cache['version'] != version:
+      catalog = build_schema_catalog()
+      _schema_cache.update(version=version, catalog=catalog, prompt=render_schema_prompt(catalog))
+    return _schema_cache['catalog']
+
+def get_schema_prompt() -> str:
+  get_schema_catalog()
+  return _schema_cache['prompt']
+
+def get_schema_dict():
+  catalog = get_schema_catalog()
+  return {table_name: [col['name'].lower() for col in table['columns']] for table_name, table in catalog.items()}
 
 def validate_sql_against_schema(query: str) -> tuple[bool, str]:
   schema = get_schema_dict()
@@ -89,6 +206,28 @@ def validate_sql_against_schema(query: str) -> tuple[bool, str]:
   
   return True, ""
 
+# every statement the assistant runs is recorded here, see query_stats.py
+query_stats = create_query_stats(Config)
+
+def run_query(conn: sqlite3.Connection, query: str, params: tuple = ()) -> tuple:
+  if not query_stats:
+    with metrics.span('sql.execute'):
+      cursor = conn.execute(query, params)
+      return cursor.description, cursor.fetchall()
+  
+  started = time.perf_counter()
+  counter = StepCounter(conn)
+  try:
+    with metrics.span('sql.execute'), counter:
+      cursor = conn.execute(query, params)
+      results = cursor.fetchall()
+  except sqlite3.Error as e:
+    query_stats.record(query, time.perf_counter() - started, 0, counter.steps, error=str(e))
+    raise
+  
+  query_stats.record(query, time.perf_counter() - started, len(results), counter.steps, lambda: explain(conn, query, params))
+  return cursor.description, results
+
 def get_database_schema() -> str:
   conn = get_db_connection()
   cursor = conn.cursor()
@@ -114,40 +253,42 @@ def get_database_schema() -> str:
   conn.close()
   return "\n".join(schema_info)
 
-def execute_sql_query(query: str) -> dict:
+def check_sql_query(query: str) -> str:
+  # the read-only rules for SQL of the assistant and the exports, an error message or ''
+  if not isinstance(query, str):
+    return "The query must be SQL text."  # e.g. null or an object in a batch from the model
+  
   query_upper = query.strip().upper()
   if not query_upper.startswith('SELECT'):
-    return {
-      'success': False,
-      'error': "Only SELECT queries are allowed."
-    }
+    return "Only SELECT queries are allowed."
   
   if any(keyword in query_upper for keyword in ['DROP', 'ALTER', 'CREATE', 'TRUNCATE']):
-    return {
-      'success': False,
-      'error': "DDL statements (DROP, ALTER, CREATE, TRUNCATE) aren't allowed."
-    }
+    return "DDL statements (DROP, ALTER, CREATE, TRUNCATE) aren't allowed."
   
-  is_valid, error_msg = validate_sql_against_schema(query)
-  if not is_valid:
+  with metrics.span('sql.validate'):
+    is_valid, error_msg = validate_sql_against_schema(query)
+  return '' if is_valid else error_msg
+
+def execute_sql_query(query: str) -> dict:
+  error_msg = check_sql_query(query)
+  if error_msg:
     return {
       'success': False,
       'error': error_msg
     }
   
+  return fetch_query_rows(query)
+
+def fetch_query_rows(query: str) -> dict:
+  # a query that passed check_sql_query
   try:
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(query)
+    description, results = run_query(get_readonly_connection(), query)
+    columns = [column[0] for column in description]
     
-    results = cursor.fetchall()
-    columns = [description[0] for description in cursor.description]
-    
-    rows = []
-    for row in results:
-      rows.append([str(value) if value is not None else "NULL" for value in row])
-    
-    conn.close()
+    with metrics.span('sql.format'):
+      rows = []
+      for row in results:
+        rows.append([str(value) if value is not None else "NULL" for value in row])
     
     return {
       'success': True,
@@ -167,6 +308,90 @@ def execute_sql_query(query: str) -> dict:
       'error': f"Error: {str(e)}"
     }
 
+# The queries of a batch run on a pool of their own, each thread with its read-only
+# connection: the tool call itself runs on orchestrator.tool_pool, and waiting there
+# for tasks queued on the same pool could take all of its threads
+batch_pool = ThreadPoolExecutor(max_workers=Config.SQL_BATCH_WORKERS, thread_name_prefix='sql')
+
+def timed_fetch(query: str) -> dict:
+  started = time.perf_counter()
+  result = fetch_query_rows(query)
+  result['duration_ms'] = round((time.perf_counter() - started) * 1000, 2)
+  return result
+
+def execute_sql_batch(queries: list) -> dict:
+  # every query is checked before the first one runs, then they run concurrently
+  if not queries:
+    return {
+      'success': False,
+      'error': "No queries given."
+    }
+  
+  if len(queries) > Config.SQL_BATCH_MAX:
+    return {
+      'success': False,
+      'error': f"At most {Config.SQL_BATCH_MAX} queries per batch."
+    }
+  
+  errors = []
+  for index, query in enumerate(queries):
+    error_msg = check_sql_query(query.get('query', ''))
+    if error_msg:
+      errors.append(f"{query.get('name') or index + 1}: {error_msg}")
+  if errors:
+    return {
+      'success': False,
+      'error': "No query was run. " + " ".join(errors)
+    }
+  
+  # copy_context: the spans of the pool threads count towards the request's trace
+  futures = [batch_pool.submit(contextvars.copy_context().run, timed_fetch, query['query']) for query in queries]
+  return {
+    'success': True,
+    'results': [future.result() for future in futures]
+  }
+
+def stream_sql_query(query: str, batch_rows: int = 5000) -> dict:
+  # for exports: the statement runs on a connection of its own and 'batches' fetches
+  # the rows while the response is sent, at most batch_rows at a time
+  error_msg = check_sql_query(query)
+  if error_msg:
+    return {
+      'success': False,
+      'error': error_msg
+    }
+  
+  conn = sqlite3.connect(Path(Config.DB_PATH).absolute().as_uri() + '?mode=ro', uri=True)
+  started = time.perf_counter()
+  try:
+    cursor = conn.execute(query)
+  except sqlite3.Error as e:
+    conn.close()
+    return {
+      'success': False,
+      'error': f"SQL Error: {str(e)}"
+    }
+  
+  def batches():
+    row_count = 0
+    try:
+      while True:
+        batch = cursor.fetchmany(batch_rows)
+        if not batch:
+          break
+        row_count += len(batch)
+        yield batch
+    finally:
+      conn.close()
+      if query_stats:
+        query_stats.record(query, time.perf_counter() - started, row_count)
+  
+  return {
+    'success': True,
+    'columns': [column[0] for column in cursor.description],
+    'batches': batches()
+  }
+
 def get_sample_data(table_name: str, limit: int = 5) -> dict:
   allowed_tables = ['customers', 'products', 'orders', 'order_items']
   if table_name not in allowed_tables:
@@ -176,18 +401,13 @@ def get_sample_data(table_name: str, limit: int = 5) -> dict:
     }
   
   try:
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(f"SELECT * FROM {table_name} LIMIT ?", (limit,))
-    
-    results = cursor.fetchall()
-    columns = [description[0] for description in cursor.description]
+    description, results = run_query(get_readonly_connection(), f"SELECT * FROM {table_name} LIMIT ?", (limit,))
+    columns = [column[0] for column in description]
     
-    rows = []
-    for row in results:
-      rows.append([str(value) if value is not None else "NULL" for value in row])
-    
-    conn.close()
+    with metrics.span('sql.format'):
+      rows = []
+      for row in results:
+        rows.append([str(value) if value is not None else "NULL" for value in row])
     
     return {
       'success': True,
@@ -0,0 +1,157 @@
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from result_store import is_number
+
+# Chart data built from a query result in the result store: generate_diagram with a
+# result_id and column names instead of labels and numbers copied by the model.
+# Rows with the same x value are aggregated, and the points are reduced to the
+# budget: LTTB (largest triangle three buckets) keeps the shape of a line, bars are
+# averaged over buckets of neighbouring points and pies keep their largest slices.
+
+AGGREGATES = ('sum', 'avg', 'count', 'min', 'max', 'none')
+PIE_TYPES = ('pie', 'doughnut', 'polarArea')
+PIE_MAX_SLICES = 8  # the smaller slices are combined into 'Other'
+
+
+def to_number(value: str) -> Optional[float]:
+  if value == 'NULL':
+    return None
+  number = float(value)  # ValueError for text
+  return int(number) if number.is_integer() else number
+
+def is_numeric_column(result: Dict, column: str) -> bool:
+  index = result['columns'].index(column)
+  values = [row[index] for row in result['rows'] if row[index] != 'NULL']
+  return bool(values) and all(is_number(value) for value in values)
+
+def column_values(result: Dict, column: str) -> List[Optional[float]]:
+  index = result['columns'].index(column)
+  try:
+    return [to_number(row[index]) for row in result['rows']]
+  except ValueError:
+    raise ValueError(f"Column '{column}' isn't numeric, use it as x_column")
+
+def aggregate_values(values: List[Optional[float]], aggregate: str) -> Optional[float]:
+  present = [value for value in values if value is not None]
+  if aggregate == 'count':
+    return len(values)
+  if not present:
+    return None
+  if aggregate == 'avg':
+    return round(sum(present) / len(present), 4)
+  if aggregate == 'min':
+    return min(present)
+  if aggregate == 'max':
+    return max(present)
+  return round(sum(present), 4)
+
+def group_rows(labels: List[str], series: List[List[Optional[float]]], aggregate: str) -> Tuple[List[str], List[List]]:
+  # one point per x value, in the order of the rows
+  groups = OrderedDict()
+  for index, label in enumerate(labels):
+    groups.setdefault(label, []).append(index)
+  
+  return list(groups), [[aggregate_values([values[i] for i in indices], aggregate) for indices in groups.values()]
+                        for values in series]
+
+def lttb(xs: List[float], ys: List[float], threshold: int) -> List[int]:
+  # indices of the points to keep, always the first and the last one
+  n = len(ys)
+  if threshold >= n or threshold < 3:
+    return list(range(n))
+  
+  every = (n - 2) / (threshold - 2)
+  indices = [0]
+  previous = 0
+  
+  for bucket in range(threshold - 2):
+    start = int(bucket * every) + 1
+    end = int((bucket + 1) * every) + 1
+    next_end = min(int((bucket + 2) * every) + 1, n)
+    
+    # the third corner of the triangles: the average of the next bucket
+    avg_x = sum(xs[end:next_end]) / (next_end - end)
+    avg_y = sum(ys[end:next_end]) / (next_end - end)
+    
+    best, best_area = start, -1.0
+    for i in range(start, end):
+      area = abs((xs[previous] - avg_x) * (ys[i] - ys[previous]) - (xs[previous] - xs[i]) * (avg_y - ys[previous]))
+      if area > best_area:
+        best, best_area = i, area
+    
+    indices.append(best)
+    previous = best
+  
+  indices.append(n - 1)
+  return indices
+
+def bucket_points(labels: List[str], series: List[List], max_points: int) -> Tuple[List[str], List[List]]:
+  # neighbouring points averaged, labelled with the first and the last x value
+  size = len(labels) / max_points
+  bounds = [(int(bucket * size), int((bucket + 1) * size)) for bucket in range(max_points)]
+  
+  bucket_labels = [labels[start] if end - start == 1 else f'{labels[start]} – {labels[end - 1]}' for start, end in bounds]
+  return bucket_labels, [[aggregate_values(values[start:end], 'avg') for start, end in bounds] for values in series]
+
+def top_slices(labels: List[str], series: List[List], max_slices: int) -> Tuple[List[str], List[List]]:
+  # largest slices of the first dataset, the rest summed up as 'Other'
+  order = sorted(range(len(labels)), key=lambda i: series[0][i] or 0, reverse=True)
+  keep, rest = sorted(order[:max_slices - 1]), order[max_slices - 1:]
+  
+  return [labels[i] for i in keep] + ['Other'], [
+    [values[i] for i in keep] + [aggregate_values([values[i] for i in rest], 'sum')] for values in series
+  ]
+
+def build_chart(result: Dict, chart_type: str, x_column: str, y_columns: Optional[List[str]] = None,
+                aggregate: Optional[str] = None, max_points: int = 200) -> Dict:
+  # labels, datasets and what was done to them; ValueError if the columns don't fit the result
+  columns = result['columns']
+  if x_column not in columns:
+    raise ValueError(f"Unknown x_column '{x_column}', the result has the columns {', '.join(columns)}")
+  if aggregate and aggregate not in AGGREGATES:
+    raise ValueError(f"Unknown aggregate '{aggregate}', use one of {', '.join(AGGREGATES)}")
+  
+  if aggregate == 'count':
+    y_columns = []
+  elif not y_columns:
+    y_columns = [column for column in columns if column != x_column and is_numeric_column(result, column)]
+  unknown = [column for column in y_columns if column not in columns]
+  if unknown:
+    raise ValueError(f"Unknown y_columns {', '.join(unknown)}, the result has the columns {', '.join(columns)}")
+  
+  x_index = columns.index(x_column)
+  labels = [row[x_index] for row in result['rows']]
+  series = [column_values(result, column) for column in y_columns]
+  source = {'result_id': result.get('result_id'), 'x_column': x_column, 'rows': len(labels)}
+  
+  if aggregate == 'count':
+    labels, series = group_rows(labels, [[None] * len(labels)], 'count')
+    y_columns = ['count']
+    source['aggregate'] = 'count'
+  elif aggregate != 'none' and (aggregate or len(set(labels)) < len(labels)):
+    labels, series = group_rows(labels, series, aggregate or 'sum')
+    source['aggregate'] = aggregate or 'sum'
+  
+  if not series:
+    raise ValueError('No numeric columns to plot, pass y_columns or aggregate=count')
+  
+  if chart_type in PIE_TYPES and len(labels) > PIE_MAX_SLICES:
+    labels, series = top_slices(labels, series, PIE_MAX_SLICES)
+    source['downsampled'] = 'top_slices'
+  elif chart_type == 'line' and len(labels) > max_points:
+    xs = [float(label) for label in labels] if all(is_number(label) for label in labels) else list(range(len(labels)))
+    indices = lttb(xs, [value or 0 for value in series[0]], max_points)
+    labels, series = [labels[i] for i in indices], [[values[i] for i in indices] for values in series]
+    source['downsampled'] = 'lttb'
+  elif len(labels) > max_points:
+    labels, series = bucket_points(labels, series, max_points)
+    source['downsampled'] = 'buckets'
+  
+  source['y_columns'] = y_columns
+  source['points'] = len(labels)
+  return {
+    'labels': labels,
+    'datasets': [{'label': column, 'data': values} for column, values in zip(y_columns, series)],
+    'source': source
+  }
+
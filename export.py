@@ -0,0 +1,183 @@
+import csv
+import importlib.util
+import io
+import itertools
+import math
+import zlib
+from typing import Iterable, Iterator, List, Sequence
+
+# Streaming downloads of query results (/api/export): the rows come in batches, from
+# the result store or from running the query again (db_helpers.stream_sql_query),
+# and leave as chunks of CSV or Parquet. No step holds the whole file.
+#
+# Parquet needs pyarrow (requirements.txt), imported on the first Parquet export only
+
+CONTENT_TYPES = {
+  'csv': 'text/csv; charset=utf-8',
+  'parquet': 'application/vnd.apache.parquet'
+}
+
+def parquet_available() -> bool:
+  return importlib.util.find_spec('pyarrow') is not None
+
+def stored_value(value: str):
+  # the number a value of the result store was written from (str(value)); text that
+  # only looks like one, '007' or '1.50', stays text
+  if value == 'NULL':
+    return None
+  try:
+    number = int(value)
+    return number if str(number) == value else value
+  except ValueError:
+    pass
+  try:
+    number = float(value)
+    return number if math.isfinite(number) and repr(number) == value else value
+  except ValueError:
+    return value
+
+def stored_batches(rows: List[List[str]], batch_rows: int, typed: bool = False) -> Iterator[List[List]]:
+  # rows of the result store are strings with 'NULL' for None, exported like a new
+  # query; typed turns numbers back into numbers for formats with column types
+  for start in range(0, len(rows), batch_rows):
+    if typed:
+      yield [[stored_value(value) for value in row] for row in rows[start:start + batch_rows]]
+    else:
+      yield [[None if value == 'NULL' else value for value in row] for row in rows[start:start + batch_rows]]
+
+def csv_chunks(columns: List[str], batches: Iterable[Sequence[Sequence]]) -> Iterator[bytes]:
+  buffer = io.StringIO()
+  writer = csv.writer(buffer)
+  
+  writer.writerow(columns)
+  for batch in batches:
+    writer.writerows(batch)
+    yield buffer.getvalue().encode('utf-8')
+    buffer.seek(0)
+    buffer.truncate()
+  
+  if buffer.tell():
+    yield buffer.getvalue().encode('utf-8')  # only the header, the result is empty
+
+
+class ChunkSink(io.RawIOBase):
+  # file object for the Parquet writer that hands out what was written so far;
+  # tell() counts every byte, the writer puts these offsets into the file footer
+  
+  def __init__(self):
+    super().__init__()
+    self.chunks = []
+    self.position = 0
+  
+  def writable(self) -> bool:
+    return True
+  
+  def write(self, data: bytes) -> int:
+    self.chunks.append(bytes(data))
+    self.position += len(data)
+    return len(data)
+  
+  def tell(self) -> int:
+    return self.position
+  
+  def take(self) -> bytes:
+    data = b''.join(self.chunks)
+    self.chunks = []
+    return data
+
+
+def unique_names(columns: List[str]) -> List[str]:
+  # a join returns e.g. 'id' three times, Parquet readers need distinct names: id, id_2, id_3
+  names = []
+  for column in columns:
+    name = column
+    suffix = 1
+    while name in names:
+      suffix += 1
+      name = f'{column}_{suffix}'
+    names.append(name)
+  return names
+
+PARQUET_TYPE_BATCHES = 4  # batches read before the column types are fixed
+
+KINDS = {type(None): 'null', bool: 'bool', int: 'int', float: 'float', bytes: 'bytes', str: 'str'}
+
+def value_kind(value) -> str:
+  return KINDS.get(type(value), 'str')
+
+def column_kind(kinds: set) -> str:
+  # SQLite types per value: integers and reals make a float column, any other mix is
+  # written as text, a column without values as well
+  kinds = kinds - {'null'}
+  if len(kinds) == 1:
+    return kinds.pop()
+  if kinds and kinds <= {'bool', 'int', 'float'}:
+    return 'float' if 'float' in kinds else 'int'
+  return 'str'
+
+def coerce_value(value, kind: str):
+  # a value of another type than its column's; None if the column can't hold it
+  if value is None or value_kind(value) == kind:
+    return value
+  if kind == 'str':
+    return value.decode('utf-8', 'replace') if isinstance(value, bytes) else str(value)
+  if kind == 'float' and isinstance(value, (int, float)):
+    return float(value)
+  if kind == 'int' and isinstance(value, (int, float)) and float(value).is_integer():
+    return int(value)
+  return None
+
+def column_array(pa, values: Sequence, kind: str, type_):
+  # a safe cast: an integer column refuses 2.5 instead of truncating it
+  try:
+    array = pa.array(values)
+    return array if array.type == type_ else array.cast(type_)
+  except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError, OverflowError):
+    return pa.array([coerce_value(value, kind) for value in values], type=type_)
+
+def parquet_chunks(columns: List[str], batches: Iterable[Sequence[Sequence]]) -> Iterator[bytes]:
+  # one row group per batch. The column types come from the first PARQUET_TYPE_BATCHES
+  # batches, values of later batches are converted to them: an integer in a float
+  # column becomes a float, anything in a text column its text. A fractional number
+  # in an integer column or text in a numeric one can't be written there and is NULL.
+  import pyarrow as pa
+  import pyarrow.parquet as pq
+  
+  types = {'null': pa.string(), 'bool': pa.bool_(), 'int': pa.int64(), 'float': pa.float64(),
+           'str': pa.string(), 'bytes': pa.binary()}
+  columns = unique_names(columns)
+  batches = iter(batches)
+  ahead = []
+  seen = [set() for _ in columns]
+  
+  for batch in batches:
+    ahead.append(batch)
+    for index, column in enumerate(zip(*batch)):
+      seen[index].update(map(type, column))
+    if len(ahead) == PARQUET_TYPE_BATCHES:
+      break
+  
+  kinds = [column_kind({KINDS.get(value_type, 'str') for value_type in value_types}) for value_types in seen]
+  schema = pa.schema([pa.field(name, types[kind]) for name, kind in zip(columns, kinds)])
+  sink = ChunkSink()
+  writer = pq.ParquetWriter(sink, schema, compression='zstd')
+  
+  for batch in itertools.chain(ahead, batches):
+    if not batch:
+      continue
+    values = list(zip(*batch))
+    arrays = [column_array(pa, column, kind, field.type) for column, kind, field in zip(values, kinds, schema)]
+    writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+    yield sink.take()
+  
+  writer.close()
+  yield sink.take()
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+  # Content-Encoding: gzip for a response whose length is unknown up front
+  compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+  for chunk in chunks:
+    data = compressor.compress(chunk)
+    if data:
+      yield data
+  yield compressor.flush()
@@ -0,0 +1,50 @@
+import os
+
+# Production launch profile: several worker processes behind one socket, forked
+# from a server process that has already imported the app and warmed it up.
+#
+#   gunicorn -c gunicorn.conf.py                   # ASGI (default), chat on the event loop
+#   APP_SERVER=wsgi gunicorn -c gunicorn.conf.py   # WSGI, threads per worker
+#
+# WEB_CONCURRENCY (workers), THREADS, BIND and DRAIN_TIMEOUT can be set in the
+# environment. On SIGTERM the workers stop accepting connections and finish the
+# conversations they are answering, for up to DRAIN_TIMEOUT seconds.
+
+os.environ.setdefault('APP_ENV', 'production')
+
+from config import get_config
+
+app_config = get_config()
+app_server = os.environ.get('APP_SERVER', 'asgi')
+
+if app_server == 'asgi':
+  try:
+    import uvicorn_worker  # successor of the deprecated uvicorn.workers module
+    worker_class = 'uvicorn_worker.UvicornWorker'
+  except ImportError:
+    worker_class = 'uvicorn.workers.UvicornWorker'
+  wsgi_app = 'asgi:application'
+else:
+  worker_class = 'gthread'
+  threads = app_config.THREADS
+  wsgi_app = 'app:app'
+
+bind = os.environ.get('BIND', '127.0.0.1:5000')
+workers = app_config.WORKERS
+preload_app = True  # import and warm up once, the workers share the memory
+graceful_timeout = app_config.DRAIN_TIMEOUT
+timeout = 120
+keepalive = 5
+accesslog = '-'
+errorlog = '-'
+
+def when_ready(server):
+  # runs in the server process after the app is loaded and before the first fork
+  from app import warm_up
+  warm_up()
+  server.log.info(f'Warmed up, starting {workers} {app_server} workers')
+
+def worker_exit(server, worker):
+  import db_helpers
+  if db_helpers.query_stats:
+    db_helpers.query_stats.flush()
@@ -0,0 +1,169 @@
+import hashlib
+import json
+import math
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Any, Callable, Optional
+import orchestrator
+from llm_provider import active_model
+
+# Keeps the prompt of a conversation within a token budget. The most recent turns
+# are sent verbatim, tool results of older turns are replaced by digests and, if
+# that is still too much, the oldest turns are folded into a short summary.
+# The system instruction is sent along and counts towards the same budget.
+
+DIGEST_ROWS = 3
+DIGEST_TEXT_CHARS = 300
+
+SUMMARY_PROMPT = '''Summarize the following part of a conversation between a user and a sales data assistant in at most 5 short bullet points. Keep numbers, names and the SQL tables involved. Answer with the bullet points only.'''
+
+def count_tokens(value: Any) -> int:
+  # ~4 characters per token holds well enough for English text, JSON and SQL
+  # on all supported models and needs no tokenizer download
+  text = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False, default=str)
+  return math.ceil(len(text) / 4)
+
+def digest_result(result: Dict) -> Dict:
+  if result.get('type') == 'batch':
+    return {**result, 'results': [digest_result(item) for item in result['results']]}
+  
+  if result.get('type') == 'table':
+    digest = {k: result[k] for k in ('type', 'name', 'title', 'query', 'table_name', 'columns', 'row_count') if k in result}
+    digest['rows'] = result.get('rows', [])[:DIGEST_ROWS]
+    if result.get('row_count', 0) > DIGEST_ROWS:
+      digest['note'] = f"first {DIGEST_ROWS} of {result['row_count']} rows, the user has seen the full table"
+    return digest
+  
+  if result.get('type') == 'text' and len(result.get('content', '')) > DIGEST_TEXT_CHARS:
+    return {**result, 'content': result['content'][:DIGEST_TEXT_CHARS] + ' ...'}
+  
+  if result.get('type') == 'diagram':
+    return {'type': 'diagram', 'name': result.get('name'), 'title': result.get('title'),
+            'chart_type': result.get('chart_type'), 'points': len(result.get('labels', []))}
+  
+  return result
+
+def digest_entry(entry: Dict) -> Dict:
+  parts = []
+  for part in entry.get('parts', []):
+    if isinstance(part, dict) and 'function_response' in part:
+      response = part['function_response']
+      part = {'function_response': {**response, 'response': digest_result(response.get('response', {}))}}
+    parts.append(part)
+  return {**entry, 'parts': parts}
+
+def split_turns(chat_history: List[Dict]) -> List[List[Dict]]:
+  turns = []
+  for entry in chat_history:
+    starts_turn = entry['role'] == 'user' and any(isinstance(p, dict) and 'text' in p for p in entry.get('parts', []))
+    if starts_turn or not turns:
+      turns.append([])
+    turns[-1].append(entry)
+  return turns
+
+def turn_text(turn: List[Dict]) -> str:
+  lines = []
+  for entry in turn:
+    for part in entry.get('parts', []):
+      if isinstance(part, dict) and part.get('text'):
+        speaker = 'User' if entry['role'] == 'user' else 'Assistant'
+        lines.append(f"{speaker}: {part['text']}")
+  return '\n'.join(lines)
+
+def local_summary(turns: List[List[Dict]]) -> str:
+  lines = []
+  for turn in turns:
+    for entry in turn:
+      for part in entry.get('parts', []):
+        if isinstance(part, dict) and part.get('text'):
+          text = part['text'].strip().replace('\n', ' ')
+          lines.append(('- User asked: ' if entry['role'] == 'user' else '  Answer: ') + text[:200])
+  return '\n'.join(lines)
+
+
+class HistoryManager:
+  
+  def __init__(self, token_budget: int, recent_turns: int = 2, summarize: Optional[Callable[[str], str]] = None,
+               max_summaries: int = 256):
+    self.token_budget = token_budget
+    self.recent_turns = max(1, recent_turns)
+    self.summarize = summarize
+    self.max_summaries = max_summaries
+    self.summaries = OrderedDict()  # hash of the dropped turns -> model summary
+    self.lock = threading.Lock()
+  
+  def compact(self, chat_history: List[Dict], system_instruction: str = '') -> List[Dict]:
+    # PRELOAD_SCHEMA makes the system instruction a large part of the prompt
+    budget = self.token_budget - count_tokens(system_instruction)
+    turns = split_turns(chat_history)
+    older = [[digest_entry(entry) for entry in turn] for turn in turns[:-self.recent_turns]]
+    recent = turns[-self.recent_turns:]
+    
+    total = sum(count_tokens(turn) for turn in older + recent)
+    
+    dropped = []
+    while older and total > budget:
+      turn = older.pop(0)
+      dropped.append(turn)
+      total -= count_tokens(turn)
+    
+    # still too large: only the current question keeps its tool results verbatim
+    if total > budget:
+      recent = [[digest_entry(entry) for entry in turn] for turn in recent[:-1]] + recent[-1:]
+    
+    kept = [entry for turn in older + recent for entry in turn]
+    
+    if dropped and kept:
+      summary = self._summary(dropped)
+      first = kept[0]
+      kept[0] = {**first, 'parts': [{'text': f'Context from earlier in this conversation:\n{summary}'}] + first['parts']}
+    
+    return kept
+  
+  def _summary(self, turns: List[List[Dict]]) -> str:
+    if not self.summarize:
+      return local_summary(turns)
+    
+    # every request of a conversation drops the same turns until the next one is
+    # dropped, the summary is made once per conversation and drop point
+    text = '\n\n'.join(turn_text(turn) for turn in turns)
+    key = hashlib.sha256(text.encode('utf-8')).hexdigest()
+    with self.lock:
+      if key in self.summaries:
+        self.summaries.move_to_end(key)
+        return self.summaries[key]
+    
+    try:
+      summary = self.summarize(text)
+    except Exception:
+      return local_summary(turns)  # a failed summary must not fail the question
+    
+    with self.lock:
+      self.summaries[key] = summary
+      while len(self.summaries) > self.max_summaries:
+        self.summaries.popitem(last=False)
+    return summary
+
+
+def history_budget(config: Any) -> int:
+  budgets = config.HISTORY_BUDGET
+  model_key = f'{config.LLM_PROVIDER}:{active_model(config)}'
+  return budgets.get(model_key) or budgets.get(config.LLM_PROVIDER) or budgets['default']
+
+def llm_summarizer(llm_client: Any) -> Callable[[str], str]:
+  def summarize(text: str) -> str:
+    response = llm_client.generate_content(
+      contents=[{'role': 'user', 'parts': [{'text': text}]}],
+      system_instruction=SUMMARY_PROMPT,
+      tools=[]
+    )
+    text, _ = orchestrator.split_response(response)
+    return text
+  return summarize
+
+def create_history_manager(config: Any, llm_client: Any) -> HistoryManager:
+  return HistoryManager(
+    token_budget=history_budget(config),
+    recent_turns=config.HISTORY_TURNS,
+    summarize=llm_summarizer(llm_client) if config.HISTORY_SUMMARIZE else None
+  )
@@ -1,9 +1,11 @@
 import sqlite3
+import sys
 from datetime import datetime, timedelta
 import random
 
-def init_database():
-  conn = sqlite3.connect('sales.db')
+def init_database(db_path='sales.db', scale=1):
+  # scale > 1 multiplies customers and orders, used for benchmarks (bench/)
+  conn = sqlite3.connect(db_path)
   cursor = conn.cursor()
   
   cursor.execute('DROP TABLE IF EXISTS order_items')
@@ -75,9 +77,14 @@ def init_database():
     ('Alpine Trading GmbH', 'info@alpine.de', '+49-89-5550110', 'Munich', 'Germany'),
   ]
   
+  customers += [
+    (f'{name} {n}', email.replace('@', f'{n}@'), phone, city, country)
+    for n in range(2, scale + 1) for name, email, phone, city, country in customers[:10]
+  ]
+  
   base_date = datetime.now() - timedelta(days=365)
   for i, (name, email, phone, city, country) in enumerate(customers):
-    created = base_date + timedelta(days=i*30)
+    created = base_date + timedelta(days=(i % 10)*30 + i // 10)
     cursor.execute(
       'INSERT INTO customers (name, email, phone, city, country, created_at) VALUES (?, ?, ?, ?, ?, ?)',
       (name, email, phone, city, country, created.isoformat())
@@ -112,9 +119,9 @@ def init_database():
   
   order_id = 1
   for days_ago in range(180, 0, -7):
-    num_orders = random.randint(2, 5)
+    num_orders = random.randint(2, 5) * scale
     for _ in range(num_orders):
-      customer_id = random.randint(1, 10)
+      customer_id = random.randint(1, len(customers))
       order_date = datetime.now() - timedelta(days=days_ago + random.randint(0, 6))
       status = random.choice(order_statuses)
       
@@ -153,4 +160,5 @@ def init_database():
   print(f'Created {order_id - 1} orders with multiple order items')
 
 if __name__ == '__main__':
-  init_database()
+  # python init_db.py [db_path] [scale]
+  init_database(*sys.argv[1:2], *[int(arg) for arg in sys.argv[2:3]])
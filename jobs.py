@@ -0,0 +1,256 @@
+import asyncio
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Callable, Optional, Tuple
+from conversation_store import SQLiteStore
+import metrics
+
+# Background chat turns: /api/chat with "background": true (or CHAT_JOBS) answers
+# 202 with a job id and the turn runs on a local worker pool, so no HTTP worker
+# waits for the model. The job table lives in the conversation database, every
+# worker process of a production server can report a job's progress and cancel it.
+#
+# The tool loop reports its progress (iteration, tools being run) through
+# report_progress; that is also where a requested cancellation takes effect, a
+# model call that already runs is finished first.
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+  id               TEXT PRIMARY KEY,
+  conversation_id  TEXT NOT NULL,
+  status           TEXT NOT NULL,
+  progress         TEXT NOT NULL,
+  result           TEXT,
+  http_status      INTEGER,
+  cancel_requested INTEGER NOT NULL DEFAULT 0,
+  version          INTEGER NOT NULL DEFAULT 0,
+  pid              INTEGER NOT NULL,
+  created_at       REAL NOT NULL,
+  updated_at       REAL NOT NULL
+)'''
+
+FINISHED = ('done', 'failed', 'cancelled')
+POLL_INTERVAL = 0.2  # seconds between looks at the table while a client long-polls
+WORKER_LOST = {'error': 'The server restarted, please send the message again.', 'is_critical': False}
+
+current_job = contextvars.ContextVar('current_job', default=None)
+
+
+class JobCancelled(Exception):
+  
+  def __init__(self):
+    super().__init__('Cancelled by the user.')
+
+
+def report_progress(**progress: Any) -> None:
+  # no-op outside a job; raises JobCancelled once the user cancelled the job
+  job = current_job.get()
+  if job:
+    job.report(progress)
+
+
+def process_alive(pid: int) -> bool:
+  try:
+    os.kill(pid, 0)
+  except ProcessLookupError:
+    return False
+  except OSError:
+    pass
+  return True
+
+
+class JobStore(SQLiteStore):
+  
+  def setup(self, conn: sqlite3.Connection) -> None:
+    conn.execute(SCHEMA)
+  
+  def create(self, conversation_id: str) -> str:
+    job_id = str(uuid.uuid4())
+    now = time.time()
+    self.connection().execute(
+      'INSERT INTO jobs (id, conversation_id, status, progress, pid, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+      (job_id, conversation_id, 'queued', '{}', os.getpid(), now, now)
+    )
+    return job_id
+  
+  def start(self, job_id: str) -> bool:
+    # False if the job was cancelled while it waited in the queue
+    return self.connection().execute(
+      "UPDATE jobs SET status = 'running', version = version + 1, updated_at = ? WHERE id = ? AND status = 'queued'",
+      (time.time(), job_id)
+    ).rowcount > 0
+  
+  def progress(self, job_id: str, progress: Dict) -> bool:
+    # returns whether a cancellation was requested
+    conn = self.connection()
+    conn.execute(
+      'UPDATE jobs SET progress = ?, version = version + 1, updated_at = ? WHERE id = ?',
+      (json.dumps(progress), time.time(), job_id)
+    )
+    row = conn.execute('SELECT cancel_requested FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    return bool(row and row[0])
+  
+  def finish(self, job_id: str, status: str, http_status: Optional[int], result: Optional[Dict]) -> None:
+    self.connection().execute(
+      'UPDATE jobs SET status = ?, http_status = ?, result = ?, version = version + 1, updated_at = ? WHERE id = ?',
+      (status, http_status, json.dumps(result, ensure_ascii=False, default=str) if result is not None else None, time.time(), job_id)
+    )
+  
+  def cancel(self, job_id: str) -> bool:
+    # a queued job is cancelled right away (True), a running one at its next progress report
+    conn = self.connection()
+    now = time.time()
+    cancelled = conn.execute(
+      "UPDATE jobs SET status = 'cancelled', cancel_requested = 1, version = version + 1, updated_at = ? WHERE id = ? AND status = 'queued'",
+      (now, job_id)
+    ).rowcount > 0
+    conn.execute(
+      "UPDATE jobs SET cancel_requested = 1, version = version + 1, updated_at = ? WHERE id = ? AND status = 'running' AND cancel_requested = 0",
+      (now, job_id)
+    )
+    return cancelled
+  
+  def get(self, job_id: str) -> Optional[Dict]:
+    row = self.connection().execute(
+      'SELECT id, conversation_id, status, progress, result, http_status, cancel_requested, version, pid, created_at FROM jobs WHERE id = ?',
+      (job_id,)
+    ).fetchone()
+    if not row:
+      return None
+    
+    job_id, conversation_id, status, progress, result, http_status, cancel_requested, version, pid, created_at = row
+    if status not in FINISHED and not process_alive(pid):
+      # the worker process that ran the job was killed (e.g. after DRAIN_TIMEOUT); a
+      # poll only reports it, the next sweep writes the same state
+      status, http_status, result, version = 'failed', 500, json.dumps(WORKER_LOST), version + 1
+    
+    return {
+      'job_id': job_id,
+      'conversation_id': conversation_id,
+      'status': status,
+      'progress': json.loads(progress),
+      'result': json.loads(result) if result else None,
+      'http_status': http_status,
+      'cancel_requested': bool(cancel_requested),
+      'version': version,
+      'elapsed_seconds': round(time.time() - created_at, 1)
+    }
+  
+  def sweep(self) -> None:
+    # fail the unfinished jobs of worker processes that are gone
+    rows = self.connection().execute(
+      f"SELECT id, pid FROM jobs WHERE status NOT IN ({', '.join('?' * len(FINISHED))})", FINISHED
+    ).fetchall()
+    for job_id, pid in rows:
+      if not process_alive(pid):
+        self.finish(job_id, 'failed', 500, WORKER_LOST)
+  
+  def purge(self, ttl: float) -> int:
+    self.sweep()
+    return self.connection().execute(
+      f"DELETE FROM jobs WHERE status IN ({', '.join('?' * len(FINISHED))}) AND updated_at < ?",
+      (*FINISHED, time.time() - ttl)
+    ).rowcount
+  
+  def stats(self) -> Dict:
+    rows = self.connection().execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall()
+    return dict(rows)
+
+
+class Job:
+  
+  def __init__(self, runner: 'JobRunner', job_id: str):
+    self.runner = runner
+    self.job_id = job_id
+    self.progress = {}
+  
+  def report(self, progress: Dict) -> None:
+    self.progress.update(progress)
+    if self.runner.store.progress(self.job_id, self.progress):
+      raise JobCancelled()
+    self.runner.notify()
+
+
+class JobRunner:
+  
+  def __init__(self, store: JobStore, workers: int, ttl: float, cancelled: Optional[Callable[[str], None]] = None):
+    self.store = store
+    self.ttl = ttl
+    self.cancelled = cancelled  # called with the conversation id of a job cancelled before it ran
+    self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+    self.changed = threading.Condition()
+  
+  def submit(self, conversation_id: str, run: Callable[..., Tuple[int, Dict]], *args: Any) -> str:
+    # run returns (http status, response payload) like a chat handler
+    self.store.purge(self.ttl)
+    job_id = self.store.create(conversation_id)
+    # a fresh context per job: nothing of the request or of earlier jobs leaks into it
+    self.pool.submit(contextvars.Context().run, self.execute, job_id, run, args)
+    return job_id
+  
+  def execute(self, job_id: str, run: Callable[..., Tuple[int, Dict]], args: Tuple) -> None:
+    if not self.store.start(job_id):
+      return
+    
+    current_job.set(Job(self, job_id))
+    metrics.start_trace()
+    try:
+      status, payload = run(*args)
+      self.store.finish(job_id, 'done' if status == 200 else 'failed', status, payload)
+    except JobCancelled as e:
+      self.store.finish(job_id, 'cancelled', None, {'error': str(e), 'is_critical': False})
+    except Exception as e:
+      self.store.finish(job_id, 'failed', 500, {'error': str(e), 'is_critical': True})
+    finally:
+      self.notify()
+  
+  def notify(self) -> None:
+    with self.changed:
+      self.changed.notify_all()
+  
+  def get(self, job_id: str) -> Optional[Dict]:
+    return self.store.get(job_id)
+  
+  def cancel(self, job_id: str) -> Optional[Dict]:
+    if self.store.cancel(job_id) and self.cancelled:
+      self.cancelled(self.store.get(job_id)['conversation_id'])
+    self.notify()
+    return self.store.get(job_id)
+  
+  def wait(self, job_id: str, since: int, timeout: float) -> Optional[Dict]:
+    # long-poll: return as soon as the job is newer than the client's version;
+    # jobs of this process wake the waiter, those of other workers are polled
+    deadline = time.monotonic() + timeout
+    while True:
+      job = self.store.get(job_id)
+      remaining = deadline - time.monotonic()
+      if not job or job['version'] > since or job['status'] in FINISHED or remaining <= 0:
+        return job
+      with self.changed:
+        self.changed.wait(min(POLL_INTERVAL, remaining))
+  
+  async def wait_async(self, job_id: str, since: int, timeout: float) -> Optional[Dict]:
+    # the same for the ASGI server, the waiting holds no thread
+    deadline = time.monotonic() + timeout
+    while True:
+      job = await asyncio.to_thread(self.store.get, job_id)
+      remaining = deadline - time.monotonic()
+      if not job or job['version'] > since or job['status'] in FINISHED or remaining <= 0:
+        return job
+      await asyncio.sleep(min(POLL_INTERVAL, remaining))
+  
+  def stats(self) -> Dict:
+    return self.store.stats()
+
+
+def create_job_runner(config: Any, cancelled: Optional[Callable[[str], None]] = None) -> JobRunner:
+  os.makedirs(os.path.dirname(config.CONVERSATIONS_DB) or '.', exist_ok=True)
+  store = JobStore(config.CONVERSATIONS_DB)
+  store.purge(config.JOB_TTL)  # also fails the jobs a previous server left unfinished
+  return JobRunner(store, config.JOB_WORKERS, config.JOB_TTL, cancelled)
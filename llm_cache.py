@@ -0,0 +1,239 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional
+from llm_provider import LLMProvider, AsyncLLMProvider, active_model
+from llm_messages import ModelResponse, FunctionCall
+from query_stats import file_lock
+import db_helpers
+import orchestrator
+
+# Exact-match cache for generate_content. Reruns, retries and demo sessions send
+# byte-identical requests; the key is a hash of the normalized request plus the
+# data version of the sales database, so a changed database never serves a stale answer.
+
+VOLATILE_KEYS = {'duration_ms', 'result_id'}  # differ between identical tool executions
+
+# The key ignores result ids, so a response whose function calls pass one (e.g.
+# generate_diagram on an earlier result) would replay an id of another session or
+# one that expired; such responses are not cached.
+
+def references_result(value: Any) -> bool:
+  if isinstance(value, dict):
+    return 'result_id' in value or any(references_result(v) for v in value.values())
+  if isinstance(value, list):
+    return any(references_result(v) for v in value)
+  return False
+
+def normalize(value: Any) -> Any:
+  if isinstance(value, dict):
+    return {k: normalize(v) for k, v in value.items() if k not in VOLATILE_KEYS}
+  if isinstance(value, (list, tuple)):
+    return [normalize(v) for v in value]
+  if hasattr(value, 'model_dump'):
+    return normalize(value.model_dump(exclude_none=True))
+  return value
+
+def request_key(namespace: str, contents: List[Dict], system_instruction: str, tools: List[Dict]) -> str:
+  payload = json.dumps(
+    [namespace, normalize(contents), system_instruction, normalize(tools)],
+    sort_keys=True, ensure_ascii=False, default=str
+  )
+  return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def serialize_response(response: Any) -> Dict:
+  text, function_calls = orchestrator.split_response(response)
+  return {
+    'text': text,
+    'function_calls': [dict(zip(('name', 'args'), orchestrator.function_call_signature(call))) for call in function_calls]
+  }
+
+def deserialize_response(data: Dict) -> ModelResponse:
+  return ModelResponse(data['text'], [FunctionCall(call['name'], call['args']) for call in data['function_calls']])
+
+
+class ResponseCache:
+  
+  def __init__(self, max_entries: int = 256, ttl: float = 3600, file_path: Optional[str] = None):
+    self.max_entries = max_entries
+    self.ttl = ttl
+    self.file_path = file_path
+    self.entries = OrderedDict()  # key -> (stored_at, data_version, serialized response)
+    self.lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.data_version = None
+    self.file_lines = 0
+    
+    if file_path:
+      self._load()
+  
+  def get(self, key: str) -> Optional[Dict]:
+    data_version = db_helpers.get_data_version()
+    
+    with self.lock:
+      if data_version != self.data_version:
+        # everything cached so far answered questions about other data
+        self.entries.clear()
+        self.data_version = data_version
+      
+      entry = self.entries.get(key)
+      if entry and time.time() - entry[0] <= self.ttl:
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[2]
+      
+      if entry:
+        del self.entries[key]
+      self.misses += 1
+      return None
+  
+  def put(self, key: str, data: Dict) -> None:
+    if references_result(data['function_calls']):
+      return
+    
+    with self.lock:
+      entry = (time.time(), self.data_version, data)
+      self.entries[key] = entry
+      self.entries.move_to_end(key)
+      
+      while len(self.entries) > self.max_entries:
+        self.entries.popitem(last=False)
+        self.evictions += 1
+      
+      if self.file_path:
+        self._append(key, entry)
+  
+  def stats(self) -> Dict:
+    with self.lock:
+      return {
+        'hits': self.hits,
+        'misses': self.misses,
+        'evictions': self.evictions,
+        'entries': len(self.entries)
+      }
+  
+  # The file is a log with one JSON line per new entry, appended on every miss; it
+  # is rewritten with the live entries only at startup and once it grew to several
+  # times the cache size. Worker processes of the production server share the file,
+  # so every write happens under a lock and a rewrite keeps the entries the other
+  # workers appended.
+  
+  def _load(self) -> None:
+    self.data_version = db_helpers.get_data_version()
+    with file_lock(self.file_path):
+      self._compact()
+  
+  def _read(self) -> List:
+    if not os.path.exists(self.file_path):
+      return []
+    
+    stored = []
+    try:
+      with open(self.file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+          try:
+            record = json.loads(line)
+          except ValueError:
+            continue  # a line cut off by a crash
+          # older files hold all entries as one JSON list
+          stored += record if record and isinstance(record[0], list) else [record]
+    except OSError:
+      return []
+    return stored
+  
+  def _append(self, key: str, entry: tuple) -> None:
+    with file_lock(self.file_path):
+      if self.file_lines >= 4 * self.max_entries:
+        self._compact()
+        return
+      
+      with open(self.file_path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps([key, *entry], ensure_ascii=False) + '\n')
+      self.file_lines += 1
+  
+  def _compact(self) -> None:
+    # entries only the file has go first, so they are evicted before our own
+    merged = OrderedDict()
+    now = time.time()
+    for key, stored_at, entry_version, data in sorted(self._read(), key=lambda record: record[1]):
+      if entry_version == self.data_version and now - stored_at <= self.ttl and not references_result(data['function_calls']):
+        merged.pop(key, None)
+        merged[key] = (stored_at, entry_version, data)
+    for key in self.entries:
+      merged.pop(key, None)
+    merged.update(self.entries)
+    
+    while len(merged) > self.max_entries:
+      merged.popitem(last=False)
+    
+    tmp_path = f'{self.file_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+      for key, entry in merged.items():
+        f.write(json.dumps([key, *entry], ensure_ascii=False) + '\n')
+    os.replace(tmp_path, self.file_path)
+    self.entries = merged
+    self.file_lines = len(merged)
+
+
+class CachingProvider(LLMProvider):
+  
+  def __init__(self, provider: LLMProvider, cache: ResponseCache, namespace: str):
+    self.provider = provider
+    self.cache = cache
+    self.namespace = namespace
+    self.token_usage = getattr(provider, 'token_usage', None)
+  
+  def generate_content(self, contents: List[Dict], system_instruction: str, tools: List[Dict]) -> Any:
+    key = request_key(self.namespace, contents, system_instruction, tools)
+    
+    cached = self.cache.get(key)
+    if cached is not None:
+      return deserialize_response(cached)
+    
+    response = self.provider.generate_content(contents, system_instruction, tools)
+    self.cache.put(key, serialize_response(response))
+    return response
+
+
+class AsyncCachingProvider(AsyncLLMProvider):
+  
+  def __init__(self, provider: AsyncLLMProvider, cache: ResponseCache, namespace: str):
+    self.provider = provider
+    self.cache = cache
+    self.namespace = namespace
+    self.token_usage = getattr(provider, 'token_usage', None)
+  
+  async def generate_content(self, contents: List[Dict], system_instruction: str, tools: List[Dict]) -> Any:
+    key = request_key(self.namespace, contents, system_instruction, tools)
+    
+    # get reads the data version from the database, put may write the cache file
+    cached = await asyncio.to_thread(self.cache.get, key)
+    if cached is not None:
+      return deserialize_response(cached)
+    
+    response = await self.provider.generate_content(contents, system_instruction, tools)
+    await asyncio.to_thread(self.cache.put, key, serialize_response(response))
+    return response
+  
+  async def aclose(self) -> None:
+    await self.provider.aclose()
+
+
+def cache_namespace(config: Any) -> str:
+  return f'{config.LLM_PROVIDER}:{active_model(config)}'
+
+def create_response_cache(config: Any) -> Optional[ResponseCache]:
+  if not config.LLM_CACHE_ENABLED:
+    return None
+  
+  return ResponseCache(
+    max_entries=config.LLM_CACHE_SIZE,
+    ttl=config.LLM_CACHE_TTL,
+    file_path=config.LLM_CACHE_FILE or None
+  )
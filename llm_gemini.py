@@ -0,0 +1,236 @@
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from typing import Dict, List, Any, Optional
+from llm_provider import LLMProvider, AsyncLLMProvider, TokenUsage
+from llm_messages import response_from_gemini
+
+# LLM_PROVIDER=gemini. google.genai takes about half a second to import, it is
+# loaded with the first client: on the first request, or in warm_up before a
+# production server forks its workers (gunicorn.conf.py).
+
+genai = None
+genai_errors = None
+
+def load_sdk() -> None:
+  global genai, genai_errors
+  if genai is None:
+    from google import genai as sdk
+    from google.genai import errors
+    genai_errors = errors  # set first, genai is what the other threads check
+    genai = sdk
+
+
+def cache_refused(error: Any) -> bool:
+  # the prefix can't be cached at all (too small for the model, unsupported content)
+  return error.status == 'INVALID_ARGUMENT' or (error.code == 400 and not error.status)
+
+def cache_missing(error: Any) -> bool:
+  # the cached content was deleted or expired on the server; the API answers
+  # NOT_FOUND, or PERMISSION_DENIED with "CachedContent not found"
+  if error.code == 404 or error.status == 'NOT_FOUND':
+    return True
+  message = (error.message or '').lower()
+  return 'cachedcontent' in message.replace(' ', '') and ('not found' in message or 'expired' in message)
+
+
+class GeminiPromptCache:
+  """Cached content on the Gemini side for the static prefix of every request
+  (system instruction + tool declarations). An entry is created on first use,
+  its TTL extended when it gets close to expiry and replaced once it expired.
+  A prefix the API refuses to cache (INVALID_ARGUMENT, e.g. below the model's
+  minimum size) is remembered and sent uncached from then on; rate limits and
+  other errors are raised and the entry is tried again with the next request.
+  The API calls run outside the lock; requests arriving meanwhile use the old
+  entry while it is valid, or go uncached."""
+  
+  def __init__(self, client: Any, model: str, ttl: int = 3600, refresh_margin: int = 300):
+    self.client = client
+    self.model = model
+    self.ttl = ttl
+    self.refresh_margin = min(refresh_margin, ttl // 2)
+    self.entries = {}  # prefix key -> (cache name, expires_at)
+    self.refused = set()
+    self.refreshing = set()  # prefix keys with an update or create in flight
+    self.lock = threading.Lock()
+  
+  def prefix_key(self, system_instruction: str, tools: List[Dict]) -> str:
+    payload = json.dumps([self.model, system_instruction, tools], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+  
+  def lookup(self, system_instruction: str, tools: List[Dict]) -> Optional[str]:
+    key = self.prefix_key(system_instruction, tools)
+    now = time.time()
+    
+    with self.lock:
+      if key in self.refused:
+        return None
+      
+      entry = self.entries.get(key)
+      if entry and entry[1] - now > self.refresh_margin:
+        return entry[0]
+      
+      if key in self.refreshing:
+        # another request is talking to the API, use the old entry meanwhile
+        return entry[0] if entry and entry[1] > now else None
+      self.refreshing.add(key)
+    
+    try:
+      name = None
+      if entry and entry[1] > now:
+        try:
+          self.client.caches.update(name=entry[0], config={'ttl': f'{self.ttl}s'})
+          name = entry[0]
+        except genai_errors.ClientError as e:
+          if not cache_missing(e):
+            raise
+      
+      if name is None:
+        try:
+          name = self.client.caches.create(
+            model=self.model,
+            config={
+              'system_instruction': system_instruction,
+              'tools': tools,
+              'ttl': f'{self.ttl}s',
+              'display_name': 'sales-assistant-prefix'
+            }
+          ).name
+        except genai_errors.ClientError as e:
+          refused = cache_refused(e)
+          with self.lock:
+            self.entries.pop(key, None)
+            if refused:
+              self.refused.add(key)
+          if not refused:
+            raise
+          return None
+      
+      with self.lock:
+        self.entries[key] = (name, now + self.ttl)
+      return name
+    finally:
+      with self.lock:
+        self.refreshing.discard(key)
+  
+  def invalidate(self, name: str) -> None:
+    with self.lock:
+      self.entries = {key: entry for key, entry in self.entries.items() if entry[0] != name}
+
+
+def gemini_request_config(cached_content: Optional[str], system_instruction: str, tools: List[Dict]) -> Dict:
+  # the cached content already holds system instruction and tools, the API rejects them twice
+  if cached_content:
+    return {'cached_content': cached_content}
+  
+  return {
+    'system_instruction': system_instruction,
+    'tools': tools
+  }
+
+def record_gemini_usage(token_usage: TokenUsage, response: Any) -> None:
+  usage = getattr(response, 'usage_metadata', None)
+  if usage:
+    token_usage.record(usage.prompt_token_count, usage.cached_content_token_count)
+
+
+class GeminiClient:
+  # client, prompt cache and token counts shared by the sync and async provider
+  
+  def __init__(self, api_key: str, model: str, prompt_cache_ttl: int = 0):
+    self.api_key = api_key
+    self.model = model
+    self.prompt_cache_ttl = prompt_cache_ttl
+    self.client = None
+    self.prompt_cache = None
+    self.token_usage = TokenUsage()
+    self.lock = threading.Lock()
+  
+  def warm_up(self) -> None:
+    if self.client is not None:
+      return
+    
+    with self.lock:
+      if self.client is None:
+        load_sdk()
+        client = genai.Client(api_key=self.api_key)
+        self.prompt_cache = GeminiPromptCache(client, self.model, self.prompt_cache_ttl) if self.prompt_cache_ttl else None
+        self.client = client
+
+
+class GeminiProvider(GeminiClient, LLMProvider):
+  
+  def generate_content(self, contents: List[Dict], system_instruction: str, tools: List[Dict]) -> Any:
+    self.warm_up()
+    cached_content = self.prompt_cache.lookup(system_instruction, tools) if self.prompt_cache and tools else None
+    
+    try:
+      response = self.client.models.generate_content(
+        model=self.model,
+        contents=contents,
+        config=gemini_request_config(cached_content, system_instruction, tools)
+      )
+    except genai_errors.ClientError as e:
+      if not cached_content or not cache_missing(e):
+        raise
+      # deleted or expired on the server before our TTL said so, send this one uncached
+      self.prompt_cache.invalidate(cached_content)
+      response = self.client.models.generate_content(
+        model=self.model,
+        contents=contents,
+        config=gemini_request_config(None, system_instruction, tools)
+      )
+    
+    record_gemini_usage(self.token_usage, response)
+    return response_from_gemini(response)
+
+
+# The async variant shares the request/response conversion, only the transport
+# differs (the genai aio client).
+
+class AsyncGeminiProvider(GeminiClient, AsyncLLMProvider):
+  
+  async def generate_content(self, contents: List[Dict], system_instruction: str, tools: List[Dict]) -> Any:
+    if self.client is None:
+      await asyncio.to_thread(self.warm_up)
+    
+    cached_content = None
+    if self.prompt_cache and tools:
+      # creating/refreshing the cache entry is rare, the sync client in a thread is good enough
+      cached_content = await asyncio.to_thread(self.prompt_cache.lookup, system_instruction, tools)
+    
+    try:
+      response = await self.client.aio.models.generate_content(
+        model=self.model,
+        contents=contents,
+        config=gemini_request_config(cached_content, system_instruction, tools)
+      )
+    except genai_errors.ClientError as e:
+      if not cached_content or not cache_missing(e):
+        raise
+      self.prompt_cache.invalidate(cached_content)
+      response = await self.client.aio.models.generate_content(
+        model=self.model,
+        contents=contents,
+        config=gemini_request_config(None, system_instruction, tools)
+      )
+    
+    record_gemini_usage(self.token_usage, response)
+    return response_from_gemini(response)
+
+
+def create_provider(config: Any) -> LLMProvider:
+  return GeminiProvider(
+    api_key=config.GOOGLE_API_KEY,
+    model=config.GEMINI_MODEL,
+    prompt_cache_ttl=config.PROMPT_CACHE_TTL if config.PROMPT_CACHE else 0
+  )
+
+def create_async_provider(config: Any) -> AsyncLLMProvider:
+  return AsyncGeminiProvider(
+    api_key=config.GOOGLE_API_KEY,
+    model=config.GEMINI_MODEL,
+    prompt_cache_ttl=config.PROMPT_CACHE_TTL if config.PROMPT_CACHE else 0
+  )
@@ -0,0 +1,197 @@
+import json
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Any, Callable, Optional
+
+# Provider-neutral response model plus the conversion helpers the HTTP providers
+# share. The chat history stays a list of plain {'role', 'parts'} dicts (it is
+# persisted, hashed by llm_cache.py and sent to Gemini as is); what the providers
+# derive from it is converted once and then only extended.
+
+
+class FunctionCall:
+  __slots__ = ('name', 'args')
+  
+  def __init__(self, name: str, args: Dict):
+    self.name = name
+    self.args = args
+
+
+class ModelResponse:
+  __slots__ = ('text', 'function_calls', 'raw', 'usage')
+  
+  def __init__(self, text: str = '', function_calls: Optional[List[FunctionCall]] = None, raw: Any = None,
+               usage: Optional[Dict] = None):
+    self.text = text
+    self.function_calls = function_calls or []
+    self.raw = raw
+    self.usage = usage  # prompt_tokens / output_tokens / cached_tokens, None when unknown (e.g. cached response)
+
+
+def parse_arguments(arguments: Any) -> Dict:
+  # OpenAI style APIs send the arguments as a JSON string, Ollama as an object
+  if isinstance(arguments, dict):
+    return arguments
+  
+  try:
+    parsed = json.loads(arguments or '{}')
+  except ValueError:
+    return {}
+  return parsed if isinstance(parsed, dict) else {}
+
+def usage_counts(prompt_tokens: Optional[int], output_tokens: Optional[int], cached_tokens: Optional[int] = None) -> Dict:
+  return {'prompt_tokens': prompt_tokens or 0, 'output_tokens': output_tokens or 0, 'cached_tokens': cached_tokens or 0}
+
+def response_from_message(message: Dict, raw: Any = None, usage: Optional[Dict] = None) -> ModelResponse:
+  function_calls = []
+  for tool_call in message.get('tool_calls') or []:
+    func = tool_call.get('function', {})
+    function_calls.append(FunctionCall(func.get('name', ''), parse_arguments(func.get('arguments'))))
+  
+  return ModelResponse(message.get('content') or '', function_calls, raw, usage)
+
+def response_from_gemini(response: Any) -> ModelResponse:
+  text = ''
+  function_calls = []
+  
+  candidates = getattr(response, 'candidates', None)
+  content = candidates[0].content if candidates else None
+  for part in (content.parts if content else None) or []:
+    if getattr(part, 'function_call', None):
+      args = part.function_call.args
+      function_calls.append(FunctionCall(part.function_call.name, dict(args) if args else {}))
+    elif getattr(part, 'text', None):
+      text += part.text
+  
+  usage = getattr(response, 'usage_metadata', None)
+  if usage:
+    usage = usage_counts(usage.prompt_token_count, usage.candidates_token_count, usage.cached_content_token_count)
+  
+  return ModelResponse(text, function_calls, response, usage)
+
+def function_call_fields(function_call: Any) -> tuple:
+  if hasattr(function_call, 'name'):
+    args = function_call.args
+    return function_call.name, (args if isinstance(args, dict) else dict(args or {}))
+  return function_call.get('name', ''), function_call.get('args', {})
+
+
+_tool_lock = threading.Lock()
+_converted_tools = {}  # id(function_declarations) -> (function_declarations, converted)
+
+def convert_tool_declarations(tools: List[Dict]) -> List[Dict]:
+  """OpenAI style tool list (Ollama, OpenRouter). The declarations are module
+  level constants, each list is converted once per process."""
+  converted_tools = []
+  
+  for tool_group in tools or []:
+    declarations = tool_group.get('function_declarations')
+    if not declarations:
+      continue
+    
+    with _tool_lock:
+      cached = _converted_tools.get(id(declarations))
+      if not cached or cached[0] is not declarations:
+        cached = (declarations, [{
+          'type': 'function',
+          'function': {
+            'name': func_decl.get('name', ''),
+            'description': func_decl.get('description', ''),
+            'parameters': func_decl.get('parameters', {})
+          }
+        } for func_decl in declarations])
+        _converted_tools[id(declarations)] = cached
+    
+    converted_tools.extend(cached[1])
+  
+  return converted_tools
+
+
+class ToolCallIds:
+  """Ids for the tool calls of a conversation. The history names a call only after
+  its function, so several calls of one tool would share an id: calls are numbered
+  in conversation order and a tool result gets the id of the oldest unanswered
+  call of its function."""
+  __slots__ = ('count', 'open_calls')
+  
+  def __init__(self, count: int = 0, open_calls: Optional[Dict[str, tuple]] = None):
+    self.count = count
+    self.open_calls = open_calls or {}  # function name -> ids of unanswered calls
+  
+  def call(self, name: str) -> str:
+    self.count += 1
+    call_id = f'call_{self.count}'
+    self.open_calls[name] = self.open_calls.get(name, ()) + (call_id,)
+    return call_id
+  
+  def answer(self, name: str) -> str:
+    ids = self.open_calls.pop(name, ())
+    if ids[1:]:
+      self.open_calls[name] = ids[1:]
+    return ids[0] if ids else f'call_{name}'
+  
+  def copy(self) -> 'ToolCallIds':
+    return ToolCallIds(self.count, dict(self.open_calls))
+
+
+class ConvertedHistory:
+  __slots__ = ('source', 'entries', 'messages', 'ends', 'tool_calls', 'lock')
+  
+  def __init__(self):
+    self.source = None  # the history list converted last
+    self.entries = []   # history entries converted so far
+    self.messages = []
+    self.ends = []      # per entry: len(messages) and the tool call ids after it
+    self.tool_calls = ToolCallIds()
+    self.lock = threading.Lock()
+  
+  def truncate(self, count: int) -> None:
+    del self.entries[count:]
+    del self.ends[count:]
+    end, tool_calls = self.ends[-1] if self.ends else (0, ToolCallIds())
+    del self.messages[end:]
+    self.tool_calls = tool_calls.copy()
+
+
+class HistoryConverter:
+  """Converts chat histories entry by entry and remembers the result per
+  conversation. The tool loop only appends to its history list, each iteration
+  converts the new entries; the next question's history is a new list whose
+  unchanged leading entries (all but the last turns, unless history compaction
+  dropped one) keep their conversion."""
+  
+  def __init__(self, convert_entry: Callable[[Dict, ToolCallIds], List[Dict]], max_histories: int = 64):
+    self.convert_entry = convert_entry
+    self.max_histories = max_histories
+    self.histories = OrderedDict()  # conversation id (or id(history list)) -> ConvertedHistory
+    self.lock = threading.Lock()
+  
+  def convert(self, contents: List[Dict], conversation_id: Optional[str], head: List[Dict] = ()) -> List[Dict]:
+    # head (the system message) followed by the converted history
+    key = conversation_id or id(contents)
+    with self.lock:
+      state = self.histories.get(key)
+      if not state:
+        state = self.histories[key] = ConvertedHistory()
+      self.histories.move_to_end(key)
+      
+      while len(self.histories) > self.max_histories:
+        self.histories.popitem(last=False)
+    
+    with state.lock:
+      converted = len(state.entries)
+      if not (contents is state.source and len(contents) >= converted and (not converted or contents[converted - 1] is state.entries[-1])):
+        same = 0
+        for entry, previous in zip(contents, state.entries):
+          if entry is not previous and entry != previous:
+            break
+          same += 1
+        state.truncate(same)
+        state.source = contents
+      
+      for entry in contents[len(state.entries):]:
+        state.messages.extend(self.convert_entry(entry, state.tool_calls))
+        state.entries.append(entry)
+        state.ends.append((len(state.messages), state.tool_calls.copy()))
+      
+      return [*head, *state.messages]
@@ -0,0 +1,126 @@
+import json
+import requests
+import httpx
+from typing import Dict, List, Any
+from llm_provider import LLMProvider, AsyncLLMProvider
+from llm_messages import ModelResponse, HistoryConverter, ToolCallIds, convert_tool_declarations, function_call_fields, response_from_message, usage_counts
+from scheduler import current_conversation
+
+# LLM_PROVIDER=ollama: a local Ollama server (/api/chat)
+
+class OllamaProvider(LLMProvider):
+  
+  def __init__(self, base_url: str, model: str):
+    self.base_url = base_url.rstrip('/')
+    self.model = model
+    self.history = HistoryConverter(self._convert_entry)
+  
+  def generate_content(self, contents: List[Dict], system_instruction: str, tools: List[Dict]) -> Any:
+    response = requests.post(
+      f"{self.base_url}/api/chat",
+      json=self._build_payload(contents, system_instruction, tools),
+      timeout=120
+    )
+    
+    return self._handle_response(response)
+  
+  def _build_payload(self, contents: List[Dict], system_instruction: str, tools: List[Dict]) -> Dict:
+    messages = self._convert_to_ollama_format(contents, system_instruction)
+    ollama_tools = convert_tool_declarations(tools)
+    
+    payload = {
+      'model': self.model,
+      'messages': messages,
+      'stream': False
+    }
+    
+    if ollama_tools:
+      payload['tools'] = ollama_tools
+    
+    return payload
+  
+  def _handle_response(self, response: Any) -> ModelResponse:
+    if response.status_code != 200:
+      raise Exception(f"Ollama API error: {response.status_code} - {response.text}")
+    
+    data = response.json()
+    usage = usage_counts(data.get('prompt_eval_count'), data.get('eval_count'))
+    return response_from_message(data.get('message', {}), data, usage)
+  
+  def _convert_to_ollama_format(self, contents: List[Dict], system_instruction: str) -> List[Dict]:
+    messages = []
+    
+    if system_instruction:
+      messages.append({
+        'role': 'system',
+        'content': system_instruction
+      })
+    
+    return self.history.convert(contents, current_conversation.get(), messages)
+  
+  def _convert_entry(self, content: Dict, tool_calls: ToolCallIds) -> List[Dict]:
+    # Ollama answers tool calls in order, they carry no ids
+    messages = []
+    role = content.get('role', '')
+    
+    if role == 'model':
+      role = 'assistant'
+    
+    for part in content.get('parts', []):
+      if isinstance(part, dict):
+        if 'text' in part:
+          messages.append({
+            'role': role,
+            'content': part['text']
+          })
+        elif 'function_call' in part:
+          func_name, func_args = function_call_fields(part['function_call'])
+          messages.append({
+            'role': role,
+            'content': '',
+            'tool_calls': [{
+              'function': {
+                'name': func_name,
+                'arguments': func_args
+              }
+            }]
+          })
+        elif 'function_response' in part:
+          func_resp = part['function_response']
+          messages.append({
+            'role': 'tool',
+            'content': json.dumps(func_resp.get('response', {}))
+          })
+    
+    return messages
+
+
+class AsyncOllamaProvider(OllamaProvider, AsyncLLMProvider):
+  
+  def __init__(self, base_url: str, model: str):
+    super().__init__(base_url, model)
+    self.http = httpx.AsyncClient(timeout=120)
+  
+  async def generate_content(self, contents: List[Dict], system_instruction: str, tools: List[Dict]) -> Any:
+    response = await self.http.post(
+      f"{self.base_url}/api/chat",
+      json=self._build_payload(contents, system_instruction, tools)
+    )
+    
+    return self._handle_response(response)
+  
+  async def aclose(self) -> None:
+    await self.http.aclose()
+
+
+def create_provider(config: Any) -> LLMProvider:
+  return OllamaProvider(
+    base_url=config.OLLAMA_BASE_URL,
+    model=config.OLLAMA_MODEL
+  )
+
+def create_async_provider(config: Any) -> AsyncLLMProvider:
+  return AsyncOllamaProvider(
+    base_url=config.OLLAMA_BASE_URL,
+    model=config.OLLAMA_MODEL
+  )
@@ -0,0 +1,156 @@
+import json
+import requests
+import httpx
+from typing import Dict, List, Any
+from llm_provider import LLMProvider, AsyncLLMProvider, TokenUsage
+from llm_messages import ModelResponse, HistoryConverter, ToolCallIds, convert_tool_declarations, function_call_fields, response_from_message, usage_counts
+from scheduler import current_conversation
+
+# LLM_PROVIDER=openrouter: OpenAI-compatible chat completions on openrouter.ai
+
+# Routed models that need an explicit cache_control breakpoint, OpenAI, DeepSeek
+# and others cache repeated prefixes on their own.
+OPENROUTER_CACHE_CONTROL_PREFIXES = ('anthropic/', 'google/gemini')
+
+class OpenRouterProvider(LLMProvider):
+  
+  def __init__(self, api_key: str, model: str, prompt_cache: bool = False):
+    self.api_key = api_key
+    self.model = model
+    self.base_url = 'https://openrouter.ai/api/v1'
+    self.cache_control = prompt_cache and self.model.startswith(OPENROUTER_CACHE_CONTROL_PREFIXES)
+    self.token_usage = TokenUsage()
+    self.history = HistoryConverter(self._convert_entry)
+  
+  def generate_content(self, contents: List[Dict], system_instruction: str, tools: List[Dict]) -> Any:
+    response = requests.post(
+      f"{self.base_url}/chat/completions",
+      headers=self._build_headers(),
+      json=self._build_payload(contents, system_instruction, tools),
+      timeout=120
+    )
+    
+    return self._handle_response(response)
+  
+  def _build_headers(self) -> Dict:
+    return {
+      'Authorization': f'Bearer {self.api_key}',
+      'Content-Type': 'application/json'
+    }
+  
+  def _build_payload(self, contents: List[Dict], system_instruction: str, tools: List[Dict]) -> Dict:
+    messages = self._convert_to_openrouter_format(contents, system_instruction)
+    openrouter_tools = convert_tool_declarations(tools)
+    
+    payload = {
+      'model': self.model,
+      'messages': messages,
+      'usage': {'include': True}
+    }
+    
+    if openrouter_tools:
+      payload['tools'] = openrouter_tools
+    
+    return payload
+  
+  def _handle_response(self, response: Any) -> ModelResponse:
+    if response.status_code != 200:
+      raise Exception(f"OpenRouter API error: {response.status_code} - {response.text}")
+    
+    data = response.json()
+    usage = data.get('usage') or {}
+    usage = usage_counts(usage.get('prompt_tokens'), usage.get('completion_tokens'),
+                        (usage.get('prompt_tokens_details') or {}).get('cached_tokens'))
+    self.token_usage.record(usage['prompt_tokens'], usage['cached_tokens'])
+    
+    choices = data.get('choices', [])
+    return response_from_message(choices[0].get('message', {}) if choices else {}, data, usage)
+  
+  def _convert_to_openrouter_format(self, contents: List[Dict], system_instruction: str) -> List[Dict]:
+    messages = []
+    
+    if system_instruction and self.cache_control:
+      # breakpoint after the static prefix, tools are cached along with the system message
+      messages.append({
+        'role': 'system',
+        'content': [{'type': 'text', 'text': system_instruction, 'cache_control': {'type': 'ephemeral'}}]
+      })
+    elif system_instruction:
+      messages.append({
+        'role': 'system',
+        'content': system_instruction
+      })
+    
+    return self.history.convert(contents, current_conversation.get(), messages)
+  
+  def _convert_entry(self, content: Dict, tool_calls: ToolCallIds) -> List[Dict]:
+    messages = []
+    role = content.get('role', '')
+    
+    if role == 'model':
+      role = 'assistant'
+    
+    for part in content.get('parts', []):
+      if isinstance(part, dict):
+        if 'text' in part:
+          messages.append({
+            'role': role,
+            'content': part['text']
+          })
+        elif 'function_call' in part:
+          func_name, func_args = function_call_fields(part['function_call'])
+          messages.append({
+            'role': role,
+            'content': None,
+            'tool_calls': [{
+              'id': tool_calls.call(func_name),
+              'type': 'function',
+              'function': {
+                'name': func_name,
+                'arguments': json.dumps(func_args)
+              }
+            }]
+          })
+        elif 'function_response' in part:
+          func_resp = part['function_response']
+          messages.append({
+            'role': 'tool',
+            'tool_call_id': tool_calls.answer(func_resp.get('name', '')),
+            'content': json.dumps(func_resp.get('response', {}))
+          })
+    
+    return messages
+
+
+class AsyncOpenRouterProvider(OpenRouterProvider, AsyncLLMProvider):
+  
+  def __init__(self, api_key: str, model: str, prompt_cache: bool = False):
+    super().__init__(api_key, model, prompt_cache)
+    self.http = httpx.AsyncClient(timeout=120)
+  
+  async def generate_content(self, contents: List[Dict], system_instruction: str, tools: List[Dict]) -> Any:
+    response = await self.http.post(
+      f"{self.base_url}/chat/completions",
+      headers=self._build_headers(),
+      json=self._build_payload(contents, system_instruction, tools)
+    )
+    
+    return self._handle_response(response)
+  
+  async def aclose(self) -> None:
+    await self.http.aclose()
+
+
+def create_provider(config: Any) -> LLMProvider:
+  return OpenRouterProvider(
+    api_key=config.OPENROUTER_API_KEY,
+    model=config.OPENROUTER_MODEL,
+    prompt_cache=config.PROMPT_CACHE
+  )
+
+def create_async_provider(config: Any) -> AsyncLLMProvider:
+  return AsyncOpenRouterProvider(
+    api_key=config.OPENROUTER_API_KEY,
+    model=config.OPENROUTER_MODEL,
+    prompt_cache=config.PROMPT_CACHE
+  )
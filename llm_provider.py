@@ -1,386 +1,149 @@
-import google.genai as genai
-import requests
-import json
+import importlib
+import threading
+import time
 from typing import Dict, List, Any, Optional
+import metrics
 
 
 class LLMProvider:
   
   def generate_content(self, contents: List[Dict], system_instruction: str, tools: List[Dict]) -> Any:
     raise NotImplementedError
-
-
-class GeminiProvider(LLMProvider):
-  
-  def __init__(self, api_key: str, model: str):
-    self.client = genai.Client(api_key=api_key)
-    self.model = model
   
-  def generate_content(self, contents: List[Dict], system_instruction: str, tools: List[Dict]) -> Any:
-    return self.client.models.generate_content(
-      model=self.model,
-      contents=contents,
-      config={
-        'system_instruction': system_instruction,
-        'tools': tools
-      }
-    )
+  def warm_up(self) -> None:
+    # setup that would otherwise delay the first request (SDK import, clients)
+    pass
 
 
-class OllamaProvider(LLMProvider):
-  
-  def __init__(self, base_url: str, model: str):
-    self.base_url = base_url.rstrip('/')
-    self.model = model
+class AsyncLLMProvider:
   
-  def generate_content(self, contents: List[Dict], system_instruction: str, tools: List[Dict]) -> Any:
-    messages = self._convert_to_ollama_format(contents, system_instruction)
-    ollama_tools = self._convert_tools_to_ollama_format(tools)
-    
-    payload = {
-      'model': self.model,
-      'messages': messages,
-      'stream': False
-    }
-    
-    if ollama_tools:
-      payload['tools'] = ollama_tools
-    
-    response = requests.post(
-      f"{self.base_url}/api/chat",
-      json=payload,
-      timeout=120
-    )
-    
-    if response.status_code != 200:
-      raise Exception(f"Ollama API error: {response.status_code} - {response.text}")
-    
-    return self._convert_ollama_response(response.json())
-  
-  def _convert_to_ollama_format(self, contents: List[Dict], system_instruction: str) -> List[Dict]:
-    messages = []
-    
-    if system_instruction:
-      messages.append({
-        'role': 'system',
-        'content': system_instruction
-      })
-    
-    for content in contents:
-      role = content.get('role', '')
-      
-      if role == 'model':
-        role = 'assistant'
-      
-      parts = content.get('parts', [])
-      
-      for part in parts:
-        if isinstance(part, dict):
-          if 'text' in part:
-            messages.append({
-              'role': role,
-              'content': part['text']
-            })
-          elif 'function_call' in part:
-            func_call = part['function_call']
-            
-            if hasattr(func_call, 'name'):
-              func_name = func_call.name
-              func_args = func_call.args if isinstance(func_call.args, dict) else dict(func_call.args)
-            else:
-              func_name = func_call.get('name', '')
-              func_args = func_call.get('args', {})
-            
-            messages.append({
-              'role': role,
-              'content': '',
-              'tool_calls': [{
-                'function': {
-                  'name': func_name,
-                  'arguments': func_args
-                }
-              }]
-            })
-          elif 'function_response' in part:
-            func_resp = part['function_response']
-            messages.append({
-              'role': 'tool',
-              'content': json.dumps(func_resp.get('response', {}))
-            })
-    
-    return messages
-  
-  def _convert_tools_to_ollama_format(self, tools: List[Dict]) -> List[Dict]:
-    if not tools:
-      return []
-    
-    ollama_tools = []
-    
-    for tool_group in tools:
-      if 'function_declarations' in tool_group:
-        for func_decl in tool_group['function_declarations']:
-          ollama_tools.append({
-            'type': 'function',
-            'function': {
-              'name': func_decl.get('name', ''),
-              'description': func_decl.get('description', ''),
-              'parameters': func_decl.get('parameters', {})
-            }
-          })
-    
-    return ollama_tools
-  
-  def _convert_ollama_response(self, ollama_response: Dict) -> 'OllamaResponse':
-    return OllamaResponse(ollama_response)
-
-
-class OllamaResponse:
-  
-  def __init__(self, response_data: Dict):
-    self.response_data = response_data
-    self.candidates = [OllamaCandidate(response_data)]
-
-
-class OllamaCandidate:
+  async def generate_content(self, contents: List[Dict], system_instruction: str, tools: List[Dict]) -> Any:
+    raise NotImplementedError
   
-  def __init__(self, response_data: Dict):
-    self.content = OllamaContent(response_data)
-
-
-class OllamaContent:
+  def warm_up(self) -> None:
+    pass
   
-  def __init__(self, response_data: Dict):
-    self.parts = []
-    
-    message = response_data.get('message', {})
-    content = message.get('content', '')
-    tool_calls = message.get('tool_calls', [])
-    
-    if content:
-      self.parts.append(OllamaTextPart(content))
-    
-    if tool_calls:
-      for tool_call in tool_calls:
-        self.parts.append(OllamaFunctionCallPart(tool_call))
+  async def aclose(self) -> None:
+    pass
 
 
-class OllamaTextPart:
+class TokenUsage:
   
-  def __init__(self, text: str):
-    self.text = text
-
-
-class OllamaFunctionCallPart:
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.requests = 0
+    self.prompt_tokens = 0
+    self.cached_tokens = 0
   
-  def __init__(self, tool_call: Dict):
-    self.function_call = OllamaFunctionCall(tool_call)
-
-
-class OllamaFunctionCall:
+  def record(self, prompt_tokens: Optional[int], cached_tokens: Optional[int]) -> None:
+    with self.lock:
+      self.requests += 1
+      self.prompt_tokens += prompt_tokens or 0
+      self.cached_tokens += cached_tokens or 0
   
-  def __init__(self, tool_call: Dict):
-    func = tool_call.get('function', {})
-    self.name = func.get('name', '')
-    
-    args_str = func.get('arguments', '{}')
-    try:
-      args_dict = json.loads(args_str) if isinstance(args_str, str) else args_str
-    except:
-      args_dict = {}
-    
-    self.args = args_dict
+  def stats(self) -> Dict:
+    with self.lock:
+      return {
+        'requests': self.requests,
+        'prompt_tokens': self.prompt_tokens,
+        'cached_tokens': self.cached_tokens
+      }
 
 
-class OpenRouterProvider(LLMProvider):
+# Times every request that actually reaches the provider (cache hits and queue
+# waits are not included) for /metrics and the per-response timings.
+class TracedProvider(LLMProvider):
   
-  def __init__(self, api_key: str, model: str):
-    self.api_key = api_key
-    self.model = model
-    self.base_url = 'https://openrouter.ai/api/v1'
+  def __init__(self, provider: LLMProvider, name: str):
+    self.provider = provider
+    self.name = name
+    self.token_usage = getattr(provider, 'token_usage', None)
   
   def generate_content(self, contents: List[Dict], system_instruction: str, tools: List[Dict]) -> Any:
-    messages = self._convert_to_openrouter_format(contents, system_instruction)
-    openrouter_tools = self._convert_tools_to_openrouter_format(tools)
-    
-    headers = {
-      'Authorization': f'Bearer {self.api_key}',
-      'Content-Type': 'application/json'
-    }
-    
-    payload = {
-      'model': self.model,
-      'messages': messages
-    }
-    
-    if openrouter_tools:
-      payload['tools'] = openrouter_tools
-    
-    response = requests.post(
-      f"{self.base_url}/chat/completions",
-      headers=headers,
-      json=payload,
-      timeout=120
-    )
-    
-    if response.status_code != 200:
-      raise Exception(f"OpenRouter API error: {response.status_code} - {response.text}")
-    
-    return self._convert_openrouter_response(response.json())
-  
-  def _convert_to_openrouter_format(self, contents: List[Dict], system_instruction: str) -> List[Dict]:
-    messages = []
-    
-    if system_instruction:
-      messages.append({
-        'role': 'system',
-        'content': system_instruction
-      })
-    
-    for content in contents:
-      role = content.get('role', '')
-      
-      if role == 'model':
-        role = 'assistant'
-      
-      parts = content.get('parts', [])
-      
-      for part in parts:
-        if isinstance(part, dict):
-          if 'text' in part:
-            messages.append({
-              'role': role,
-              'content': part['text']
-            })
-          elif 'function_call' in part:
-            func_call = part['function_call']
-            
-            if hasattr(func_call, 'name'):
-              func_name = func_call.name
-              func_args = func_call.args if isinstance(func_call.args, dict) else dict(func_call.args)
-            else:
-              func_name = func_call.get('name', '')
-              func_args = func_call.get('args', {})
-            
-            messages.append({
-              'role': role,
-              'content': None,
-              'tool_calls': [{
-                'id': f'call_{func_name}',
-                'type': 'function',
-                'function': {
-                  'name': func_name,
-                  'arguments': json.dumps(func_args)
-                }
-              }]
-            })
-          elif 'function_response' in part:
-            func_resp = part['function_response']
-            messages.append({
-              'role': 'tool',
-              'tool_call_id': f"call_{func_resp.get('name', '')}",
-              'content': json.dumps(func_resp.get('response', {}))
-            })
-    
-    return messages
-  
-  def _convert_tools_to_openrouter_format(self, tools: List[Dict]) -> List[Dict]:
-    if not tools:
-      return []
-    
-    openrouter_tools = []
-    
-    for tool_group in tools:
-      if 'function_declarations' in tool_group:
-        for func_decl in tool_group['function_declarations']:
-          openrouter_tools.append({
-            'type': 'function',
-            'function': {
-              'name': func_decl.get('name', ''),
-              'description': func_decl.get('description', ''),
-              'parameters': func_decl.get('parameters', {})
-            }
-          })
-    
-    return openrouter_tools
-  
-  def _convert_openrouter_response(self, openrouter_response: Dict) -> 'OpenRouterResponse':
-    return OpenRouterResponse(openrouter_response)
+    started = time.perf_counter()
+    response = None
+    try:
+      response = self.provider.generate_content(contents, system_instruction, tools)
+      return response
+    finally:
+      metrics.observe_llm(self.name, time.perf_counter() - started, response)
 
 
-class OpenRouterResponse:
+class AsyncTracedProvider(AsyncLLMProvider):
   
-  def __init__(self, response_data: Dict):
-    self.response_data = response_data
-    self.candidates = [OpenRouterCandidate(response_data)]
-
-
-class OpenRouterCandidate:
+  def __init__(self, provider: AsyncLLMProvider, name: str):
+    self.provider = provider
+    self.name = name
+    self.token_usage = getattr(provider, 'token_usage', None)
   
-  def __init__(self, response_data: Dict):
-    self.content = OpenRouterContent(response_data)
-
-
-class OpenRouterContent:
+  async def generate_content(self, contents: List[Dict], system_instruction: str, tools: List[Dict]) -> Any:
+    started = time.perf_counter()
+    response = None
+    try:
+      response = await self.provider.generate_content(contents, system_instruction, tools)
+      return response
+    finally:
+      metrics.observe_llm(self.name, time.perf_counter() - started, response)
   
-  def __init__(self, response_data: Dict):
-    self.parts = []
-    
-    choices = response_data.get('choices', [])
-    if choices:
-      message = choices[0].get('message', {})
-      content = message.get('content', '')
-      tool_calls = message.get('tool_calls', [])
-      
-      if content:
-        self.parts.append(OpenRouterTextPart(content))
-      
-      if tool_calls:
-        for tool_call in tool_calls:
-          self.parts.append(OpenRouterFunctionCallPart(tool_call))
+  async def aclose(self) -> None:
+    await self.provider.aclose()
 
 
-class OpenRouterTextPart:
-  
-  def __init__(self, text: str):
-    self.text = text
+def traced(provider: LLMProvider, name: str) -> LLMProvider:
+  return TracedProvider(provider, name) if metrics.enabled else provider
 
+def traced_async(provider: AsyncLLMProvider, name: str) -> AsyncLLMProvider:
+  return AsyncTracedProvider(provider, name) if metrics.enabled else provider
 
-class OpenRouterFunctionCallPart:
-  
-  def __init__(self, tool_call: Dict):
-    self.function_call = OpenRouterFunctionCall(tool_call)
+MODEL_SETTINGS = {
+  'gemini': 'GEMINI_MODEL',
+  'ollama': 'OLLAMA_MODEL',
+  'openrouter': 'OPENROUTER_MODEL'
+}
 
-
-class OpenRouterFunctionCall:
+def stage_config(config: Any, spec: str) -> Any:
+  """Config for a pipeline stage model given as 'provider' or 'provider:model',
+  e.g. 'ollama:qwen2.5-coder:7b'. Everything else comes from config."""
+  provider_type, _, model = spec.partition(':')
+  if provider_type not in MODEL_SETTINGS:
+    raise ValueError(f"Unknown LLM provider: {provider_type}")
   
-  def __init__(self, tool_call: Dict):
-    func = tool_call.get('function', {})
-    self.name = func.get('name', '')
-    
-    args_str = func.get('arguments', '{}')
-    try:
-      args_dict = json.loads(args_str) if isinstance(args_str, str) else args_str
-    except:
-      args_dict = {}
-    
-    self.args = args_dict
-
+  overrides = {'LLM_PROVIDER': provider_type}
+  if model:
+    overrides[MODEL_SETTINGS[provider_type]] = model
+  return type('StageConfig', (config if isinstance(config, type) else type(config),), overrides)
+
+def active_model(config: Any) -> str:
+  models = {
+    'gemini': config.GEMINI_MODEL,
+    'ollama': config.OLLAMA_MODEL,
+    'openrouter': config.OPENROUTER_MODEL
+  }
+  if config.LLM_PROVIDER == 'router':
+    return '+'.join(f'{name}:{models.get(name, "")}' for name in config.ROUTER_BACKENDS)
+  return models.get(config.LLM_PROVIDER, '')
+
+# Provider plugins: LLM_PROVIDER -> module with create_provider(config) and
+# create_async_provider(config). A module, and with it the backend's SDK, is only
+# imported once its provider is selected; LLM_PROVIDER=ollama never loads google.genai.
+PROVIDER_MODULES = {
+  'gemini':     'llm_gemini',
+  'ollama':     'llm_ollama',
+  'openrouter': 'llm_openrouter',
+  'router':     'llm_router',
+  'replay':     'llm_replay'
+}
+
+def register_provider(name: str, module: str) -> None:
+  PROVIDER_MODULES[name] = module
+
+def provider_module(provider_type: str) -> Any:
+  if provider_type not in PROVIDER_MODULES:
+    raise ValueError(f"Unknown LLM provider: {provider_type}")
+  return importlib.import_module(PROVIDER_MODULES[provider_type])
 
 def create_llm_provider(provider_type: str, config: Any) -> LLMProvider:
-  if provider_type == 'gemini':
-    return GeminiProvider(
-      api_key=config.GOOGLE_API_KEY,
-      model=config.GEMINI_MODEL
-    )
-  elif provider_type == 'ollama':
-    return OllamaProvider(
-      base_url=config.OLLAMA_BASE_URL,
-      model=config.OLLAMA_MODEL
-    )
-  elif provider_type == 'openrouter':
-    return OpenRouterProvider(
-      api_key=config.OPENROUTER_API_KEY,
-      model=config.OPENROUTER_MODEL
-    )
-  else:
-    raise ValueError(f"Unknown LLM provider: {provider_type}")
+  return provider_module(provider_type).create_provider(config)
+
+def create_async_llm_provider(provider_type: str, config: Any) -> AsyncLLMProvider:
+  return provider_module(provider_type).create_async_provider(config)
@@ -0,0 +1,210 @@
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Any, Optional
+from llm_provider import LLMProvider, AsyncLLMProvider, create_llm_provider, create_async_llm_provider
+from llm_messages import ModelResponse, FunctionCall
+from llm_cache import request_key, serialize_response, deserialize_response
+
+# LLM_PROVIDER=replay: benchmarks and load tests without a live model.
+#
+#   record     proxies REPLAY_BACKEND and appends every exchange to the cassette
+#   replay     answers from the cassette, keyed like the response cache (volatile
+#              fields such as result ids and timings do not break a match)
+#   synthetic  walks a scripted sequence of tool calls per question
+#
+# REPLAY_LATENCY: 'recorded' sleeps as long as the real request took, a number
+# sleeps that many milliseconds per request, 0 answers at once.
+
+# Used when synthetic mode has no REPLAY_SCRIPT: one query, one chart, one answer
+DEFAULT_SCRIPT = [
+  {
+    'steps': [
+      {'function_calls': [{'name': 'execute_sql_query', 'args': {'query': (
+        'SELECT c.name, SUM(o.amount_sum) AS revenue FROM customers c '
+        'JOIN orders o ON o.customer_id = c.id GROUP BY c.id ORDER BY revenue DESC LIMIT 10'
+      )}}]},
+      {'function_calls': [{'name': 'generate_diagram', 'args': {
+        'chart_type': 'bar', 'title': 'Top customers by revenue',
+        'labels': ['A', 'B', 'C'], 'datasets': [{'label': 'Revenue', 'data': [3, 2, 1]}]
+      }}]},
+      {'text': 'The top customers by revenue are listed in the table above.'}
+    ]
+  }
+]
+
+def cassette_key(contents: List[Dict], system_instruction: str, tools: List[Dict]) -> str:
+  return request_key('replay', contents, system_instruction, tools)
+
+def current_question(contents: List[Dict]) -> str:
+  for entry in reversed(contents):
+    if entry.get('role') == 'user':
+      texts = [part['text'] for part in entry.get('parts', []) if isinstance(part, dict) and 'text' in part]
+      if texts:
+        return texts[-1]
+  return ''
+
+def loop_step(contents: List[Dict]) -> int:
+  # model turns since the question was asked, i.e. the iteration of the tool loop
+  step = 0
+  for entry in reversed(contents):
+    if entry.get('role') == 'user' and any(isinstance(part, dict) and 'text' in part for part in entry.get('parts', [])):
+      break
+    if entry.get('role') == 'model':
+      step += 1
+  return step
+
+
+class Cassette:
+  
+  def __init__(self, file_path: str):
+    self.file_path = file_path
+    self.records = defaultdict(list)  # key -> recorded exchanges, in recording order
+    self.played = defaultdict(int)
+    self.lock = threading.Lock()
+    
+    if os.path.exists(file_path):
+      with open(file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+          if line.strip():
+            record = json.loads(line)
+            self.records[record['key']].append(record)
+  
+  def next(self, key: str) -> Optional[Dict]:
+    with self.lock:
+      records = self.records.get(key)
+      if not records:
+        return None
+      # identical requests replay their recordings in order, the last one repeats
+      index = min(self.played[key], len(records) - 1)
+      self.played[key] += 1
+      return records[index]
+  
+  def append(self, key: str, response: Any, latency: float) -> None:
+    record = {
+      'key': key,
+      'response': serialize_response(response),
+      'usage': getattr(response, 'usage', None),
+      'latency_ms': round(latency * 1000, 2)
+    }
+    
+    with self.lock:
+      self.records[key].append(record)
+      with open(self.file_path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+class ReplayProvider(LLMProvider):
+  
+  def __init__(self, mode: str, cassette_path: str, backend: Optional[Any] = None,
+               script_path: str = '', latency: str = 'recorded'):
+    if mode not in ('record', 'replay', 'synthetic'):
+      raise ValueError(f"Unknown replay mode: {mode}")
+    if mode == 'record' and backend is None:
+      raise ValueError("Replay mode 'record' needs a backend provider")
+    
+    self.mode = mode
+    self.backend = backend
+    self.latency = latency
+    self.cassette = Cassette(cassette_path) if mode != 'synthetic' else None
+    self.script = DEFAULT_SCRIPT
+    if mode == 'synthetic' and script_path:
+      with open(script_path, 'r', encoding='utf-8') as f:
+        self.script = json.load(f)
+  
+  def warm_up(self) -> None:
+    if self.backend:
+      self.backend.warm_up()
+  
+  def delay(self, recorded_ms: float = 0.0) -> float:
+    if self.latency == 'recorded':
+      return recorded_ms / 1000
+    return float(self.latency) / 1000
+  
+  def scripted(self, contents: List[Dict]) -> ModelResponse:
+    question = current_question(contents)
+    scenario = next(
+      (s for s in self.script if not s.get('match') or re.search(s['match'], question, re.IGNORECASE)),
+      self.script[-1]
+    )
+    
+    steps = scenario['steps']
+    step = steps[min(loop_step(contents), len(steps) - 1)]
+    return ModelResponse(
+      step.get('text', ''),
+      [FunctionCall(call['name'], call.get('args', {})) for call in step.get('function_calls', [])],
+      usage=step.get('usage')
+    )
+  
+  def replayed(self, key: str) -> tuple:
+    record = self.cassette.next(key)
+    if not record:
+      raise Exception('Replay cassette has no response for this request, record it first (REPLAY_MODE=record)')
+    
+    response = deserialize_response(record['response'])
+    response.usage = record.get('usage')
+    return response, record.get('latency_ms', 0.0)
+  
+  def generate_content(self, contents: List[Dict], system_instruction: str, tools: List[Dict]) -> Any:
+    if self.mode == 'synthetic':
+      time.sleep(self.delay())
+      return self.scripted(contents)
+    
+    key = cassette_key(contents, system_instruction, tools)
+    
+    if self.mode == 'record':
+      started = time.perf_counter()
+      response = self.backend.generate_content(contents, system_instruction, tools)
+      self.cassette.append(key, response, time.perf_counter() - started)
+      return response
+    
+    response, latency_ms = self.replayed(key)
+    time.sleep(self.delay(latency_ms))
+    return response
+
+
+class AsyncReplayProvider(ReplayProvider, AsyncLLMProvider):
+  
+  async def generate_content(self, contents: List[Dict], system_instruction: str, tools: List[Dict]) -> Any:
+    if self.mode == 'synthetic':
+      await asyncio.sleep(self.delay())
+      return self.scripted(contents)
+    
+    key = cassette_key(contents, system_instruction, tools)
+    
+    if self.mode == 'record':
+      started = time.perf_counter()
+      response = await self.backend.generate_content(contents, system_instruction, tools)
+      self.cassette.append(key, response, time.perf_counter() - started)
+      return response
+    
+    response, latency_ms = self.replayed(key)
+    await asyncio.sleep(self.delay(latency_ms))
+    return response
+  
+  async def aclose(self) -> None:
+    if self.backend:
+      await self.backend.aclose()
+
+
+def create_provider(config: Any) -> LLMProvider:
+  return ReplayProvider(
+    mode=config.REPLAY_MODE,
+    cassette_path=config.REPLAY_CASSETTE,
+    backend=create_llm_provider(config.REPLAY_BACKEND, config) if config.REPLAY_MODE == 'record' else None,
+    script_path=config.REPLAY_SCRIPT,
+    latency=config.REPLAY_LATENCY
+  )
+
+def create_async_provider(config: Any) -> AsyncLLMProvider:
+  return AsyncReplayProvider(
+    mode=config.REPLAY_MODE,
+    cassette_path=config.REPLAY_CASSETTE,
+    backend=create_async_llm_provider(config.REPLAY_BACKEND, config) if config.REPLAY_MODE == 'record' else None,
+    script_path=config.REPLAY_SCRIPT,
+    latency=config.REPLAY_LATENCY
+  )
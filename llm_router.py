@@ -0,0 +1,271 @@
+import asyncio
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, List, Any, Optional, Tuple
+from llm_provider import LLMProvider, AsyncLLMProvider, create_llm_provider, create_async_llm_provider
+from scheduler import schedule, schedule_async, SchedulerBusy
+
+# LLM_PROVIDER=router: several backends behind one provider. Each request goes to
+# the healthy backend with the lowest rolling median latency; if it is still
+# running after its own p95 latency, the next backend gets a duplicate (hedged)
+# request and whichever answers first wins. A failed request fails over at once.
+# Each backend waits for its own RATE_LIMITS entry, hedged requests included.
+
+MIN_SAMPLES = 5               # below this a backend's latency counts as unknown
+UNMEASURED_HEDGE_DELAY = 10.0  # seconds, until the primary has a p95 of its own
+ERROR_COOLDOWN = 30.0         # seconds an unhealthy backend is skipped before it gets probed again
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+  if not values:
+    return None
+  ordered = sorted(values)
+  index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))
+  return ordered[index]
+
+
+class Backend:
+  
+  def __init__(self, name: str, provider: Any, window: int = 50):
+    self.name = name
+    self.provider = provider
+    self.samples = deque(maxlen=window)  # (latency in seconds, succeeded)
+    self.last_error_at = 0.0
+    self.lock = threading.Lock()
+  
+  def record(self, latency: float, ok: bool) -> None:
+    with self.lock:
+      self.samples.append((latency, ok))
+      if not ok:
+        self.last_error_at = time.time()
+  
+  def latency(self, q: float) -> Optional[float]:
+    with self.lock:
+      latencies = [latency for latency, ok in self.samples if ok]
+    return percentile(latencies, q) if len(latencies) >= MIN_SAMPLES else None
+  
+  def error_rate(self) -> float:
+    with self.lock:
+      return sum(1 for _, ok in self.samples if not ok) / len(self.samples) if self.samples else 0.0
+  
+  def healthy(self, max_error_rate: float) -> bool:
+    return self.error_rate() <= max_error_rate or time.time() - self.last_error_at > ERROR_COOLDOWN
+  
+  def call(self, contents: List[Dict], system_instruction: str, tools: List[Dict]) -> Any:
+    started = time.perf_counter()
+    try:
+      response = self.provider.generate_content(contents, system_instruction, tools)
+    except SchedulerBusy:
+      raise  # its queue is full, says nothing about the backend
+    except Exception:
+      self.record(time.perf_counter() - started, False)
+      raise
+    self.record(time.perf_counter() - started, True)
+    return response
+  
+  async def acall(self, contents: List[Dict], system_instruction: str, tools: List[Dict]) -> Any:
+    started = time.perf_counter()
+    try:
+      response = await self.provider.generate_content(contents, system_instruction, tools)
+    except (asyncio.CancelledError, SchedulerBusy):
+      raise  # lost a hedge race or a full queue, says nothing about the backend
+    except Exception:
+      self.record(time.perf_counter() - started, False)
+      raise
+    self.record(time.perf_counter() - started, True)
+    return response
+  
+  def stats(self) -> Dict:
+    return {
+      'samples': len(self.samples),
+      'p50_ms': round(self.latency(50) * 1000, 1) if self.latency(50) is not None else None,
+      'p95_ms': round(self.latency(95) * 1000, 1) if self.latency(95) is not None else None,
+      'error_rate': round(self.error_rate(), 3)
+    }
+
+
+class Router:
+  
+  def __init__(self, backends: List[Tuple[str, Any]], hedge_percentile: float = 95, min_hedge_delay: float = 1.0,
+               max_error_rate: float = 0.5, window: int = 50):
+    self.backends = [Backend(name, provider, window) for name, provider in backends]
+    self.hedge_percentile = hedge_percentile
+    self.min_hedge_delay = min_hedge_delay
+    self.max_error_rate = max_error_rate
+    self.hedges = 0
+    self.hedge_wins = 0
+    self.failovers = 0
+    self.lock = threading.Lock()
+  
+  def ranked(self) -> List[Backend]:
+    # unmeasured backends sort first so every backend gets latency samples
+    return sorted(
+      self.backends,
+      key=lambda b: (not b.healthy(self.max_error_rate), b.latency(50) or 0.0)
+    )
+  
+  def hedge_delay(self, backend: Backend) -> float:
+    latency = backend.latency(self.hedge_percentile)
+    return UNMEASURED_HEDGE_DELAY if latency is None else max(self.min_hedge_delay, latency)
+  
+  def count(self, counter: str) -> None:
+    with self.lock:
+      setattr(self, counter, getattr(self, counter) + 1)
+  
+  def warm_up(self) -> None:
+    for backend in self.backends:
+      backend.provider.warm_up()
+  
+  def stats(self) -> Dict:
+    with self.lock:
+      stats = {'hedges': self.hedges, 'hedge_wins': self.hedge_wins, 'failovers': self.failovers}
+    stats['backends'] = {backend.name: backend.stats() for backend in self.backends}
+    return stats
+
+
+class RoutingProvider(Router, LLMProvider):
+  
+  def __init__(self, backends: List[Tuple[str, LLMProvider]], **options: Any):
+    super().__init__(backends, **options)
+    self.pool = ThreadPoolExecutor(max_workers=8 * len(self.backends), thread_name_prefix='llm-route')
+  
+  def generate_content(self, contents: List[Dict], system_instruction: str, tools: List[Dict]) -> Any:
+    ranked = self.ranked()
+    primary = ranked[0]
+    pending = {}  # future -> backend
+    launched = 0
+    hedged = False
+    last_error = None
+    
+    def launch() -> None:
+      nonlocal launched
+      backend = ranked[launched]
+      launched += 1
+      # the backend's scheduler and the metrics read the request's context variables
+      context = contextvars.copy_context()
+      pending[self.pool.submit(context.run, backend.call, contents, system_instruction, tools)] = backend
+    
+    launch()
+    while pending:
+      can_hedge = not hedged and launched < len(ranked)
+      done, _ = wait(pending, timeout=self.hedge_delay(primary) if can_hedge else None, return_when=FIRST_COMPLETED)
+      
+      if not done:
+        hedged = True
+        self.count('hedges')
+        launch()
+        continue
+      
+      for future in done:
+        backend = pending.pop(future)
+        try:
+          response = future.result()
+        except Exception as e:
+          last_error = e
+          continue
+        
+        # a blocking HTTP call cannot be interrupted, the loser finishes in the
+        # background (still feeding its latency stats) and its answer is dropped
+        for loser in pending:
+          loser.cancel()
+        if hedged and backend is not primary:
+          self.count('hedge_wins')
+        return response
+      
+      if not pending and launched < len(ranked):
+        self.count('failovers')
+        launch()
+    
+    raise last_error
+
+
+class AsyncRoutingProvider(Router, AsyncLLMProvider):
+  
+  async def generate_content(self, contents: List[Dict], system_instruction: str, tools: List[Dict]) -> Any:
+    ranked = self.ranked()
+    primary = ranked[0]
+    pending = {}  # task -> backend
+    launched = 0
+    hedged = False
+    last_error = None
+    
+    def launch() -> None:
+      nonlocal launched
+      backend = ranked[launched]
+      launched += 1
+      pending[asyncio.ensure_future(backend.acall(contents, system_instruction, tools))] = backend
+    
+    launch()
+    try:
+      while pending:
+        can_hedge = not hedged and launched < len(ranked)
+        done, _ = await asyncio.wait(pending, timeout=self.hedge_delay(primary) if can_hedge else None,
+                                     return_when=asyncio.FIRST_COMPLETED)
+        
+        if not done:
+          hedged = True
+          self.count('hedges')
+          launch()
+          continue
+        
+        for task in done:
+          backend = pending.pop(task)
+          if task.exception():
+            last_error = task.exception()
+            continue
+          
+          if hedged and backend is not primary:
+            self.count('hedge_wins')
+          return task.result()
+        
+        if not pending and launched < len(ranked):
+          self.count('failovers')
+          launch()
+    finally:
+      # the losing request is cancelled for real, httpx closes its connection
+      for task in pending:
+        task.cancel()
+    
+    raise last_error
+  
+  async def aclose(self) -> None:
+    for backend in self.backends:
+      await backend.provider.aclose()
+
+
+def router_options(config: Any) -> Dict:
+  return {
+    'hedge_percentile': config.ROUTER_HEDGE_AT,
+    'min_hedge_delay': config.ROUTER_HEDGE_MIN,
+    'max_error_rate': config.ROUTER_MAX_ERRORS,
+    'window': config.ROUTER_WINDOW
+  }
+
+def router_backends(config: Any) -> List[str]:
+  names = config.ROUTER_BACKENDS
+  if not names:
+    raise ValueError('LLM_PROVIDER=router needs at least one backend in ROUTER_BACKENDS')
+  if 'router' in names:
+    raise ValueError('ROUTER_BACKENDS cannot contain the router itself')
+  if len(set(names)) < len(names):
+    raise ValueError(f"ROUTER_BACKENDS lists a backend twice: {', '.join(names)}")
+  return names
+
+def backend_config(config: Any, name: str) -> Any:
+  # the backend's own provider name, for its RATE_LIMITS entry and scheduler
+  return type('BackendConfig', (config if isinstance(config, type) else type(config),), {'LLM_PROVIDER': name})
+
+def create_provider(config: Any) -> LLMProvider:
+  return RoutingProvider(
+    [(name, schedule(create_llm_provider(name, config), backend_config(config, name))) for name in router_backends(config)],
+    **router_options(config)
+  )
+
+def create_async_provider(config: Any) -> AsyncLLMProvider:
+  return AsyncRoutingProvider(
+    [(name, schedule_async(create_async_llm_provider(name, config), backend_config(config, name)))
+     for name in router_backends(config)],
+    **router_options(config)
+  )
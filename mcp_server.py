@@ -1,7 +1,11 @@
 import sqlite3
 import re
-from fastmcp import FastMCP
-import config
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+from config import Config
 
 # The functions get_db_connection, get_schema_dict, and validate_sql_against_schema
 # are duplicated from db_helpers.py. This is intentional:
@@ -9,9 +13,7 @@ import config
 # - Duplicating these functions avoids cross-dependencies between components
 # - Each component can be deployed/run separately without the other
 
-mcp = FastMCP('Sales Database Server')
-
-DB_PATH = config.DB_PATH
+DB_PATH = Config.DB_PATH
 
 def get_db_connection():
   conn = sqlite3.connect(DB_PATH)
@@ -94,7 +96,6 @@ def validate_sql_against_schema(query: str) -> tuple[bool, str]:
   
   return True, ""
 
-@mcp.tool()
 def get_database_schema() -> str:
   """
   Get the complete database schema including all tables and their columns.
@@ -124,18 +125,11 @@ def get_database_schema() -> str:
   conn.close()
   return "\n".join(schema_info)
 
-@mcp.tool()
-def execute_sql_query(query: str) -> str:
-  """
-  Execute a read-only SQL SELECT query against the sales database.
-  Returns the results as a formatted string.
-  
-  Args:
-    query: A SELECT SQL query to execute (INSERT, UPDATE, DELETE aren't allowed)
+def check_query(query: str) -> str:
+  # the read-only rules, an error message or ''
+  if not isinstance(query, str):
+    return "Error: The query must be SQL text."  # e.g. null or an object in a batch from the model
   
-  Returns:
-    Query results formatted as a table or an error message
-  """
   query_upper = query.strip().upper()
   if not query_upper.startswith('SELECT'):
     return "Error: Only SELECT queries are allowed."
@@ -144,18 +138,17 @@ def execute_sql_query(query: str) -> str:
     return "Error: DDL statements (DROP, ALTER, CREATE, TRUNCATE) aren't allowed."
   
   is_valid, error_msg = validate_sql_against_schema(query)
-  if not is_valid:
-    return error_msg
-  
+  return '' if is_valid else error_msg
+
+def run_select(conn: sqlite3.Connection, query: str) -> str:
+  # a query that passed check_query, formatted as a table
   try:
-    conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute(query)
     
     results = cursor.fetchall()
     
     if not results:
-      conn.close()
       return "Query executed successfully but returned no results."
     
     columns = [description[0] for description in cursor.description]
@@ -167,7 +160,6 @@ def execute_sql_query(query: str) -> str:
     for row in results:
       output.append(" | ".join(str(value) if value is not None else "NULL" for value in row))
     
-    conn.close()
     return "\n".join(output)
     
   except sqlite3.Error as e:
@@ -175,7 +167,78 @@ def execute_sql_query(query: str) -> str:
   except Exception as e:
     return f"Error: {str(e)}"
 
-@mcp.tool()
+def execute_sql_query(query: str) -> str:
+  """
+  Execute a read-only SQL SELECT query against the sales database.
+  Returns the results as a formatted string.
+  
+  Args:
+    query: A SELECT SQL query to execute (INSERT, UPDATE, DELETE aren't allowed)
+  
+  Returns:
+    Query results formatted as a table or an error message
+  """
+  error_msg = check_query(query)
+  if error_msg:
+    return error_msg
+  
+  try:
+    conn = get_db_connection()
+  except sqlite3.Error as e:
+    return f"SQL Error: {str(e)}"
+  
+  try:
+    return run_select(conn, query)
+  finally:
+    conn.close()
+
+# execute_sql_batch runs the queries on a small pool, each thread keeps a read-only connection
+_readonly = threading.local()
+batch_pool = ThreadPoolExecutor(max_workers=Config.SQL_BATCH_WORKERS, thread_name_prefix='sql')
+
+def get_readonly_connection():
+  conn = getattr(_readonly, 'conn', None)
+  if conn is None:
+    conn = sqlite3.connect(Path(DB_PATH).absolute().as_uri() + '?mode=ro', uri=True)
+    _readonly.conn = conn
+  return conn
+
+def timed_select(query: str) -> tuple:
+  started = time.perf_counter()
+  output = run_select(get_readonly_connection(), query)
+  return output, round((time.perf_counter() - started) * 1000, 2)
+
+def execute_sql_batch(queries: list[dict]) -> str:
+  """
+  Execute several independent read-only SQL SELECT queries at once, e.g. for a
+  dashboard or a comparison. All queries are validated before any runs, then
+  they run concurrently.
+  
+  Args:
+    queries: The queries as objects with "name" and "query" (at most 8)
+  
+  Returns:
+    One section per query with its name, duration and results, or an error message
+  """
+  if not queries:
+    return "Error: No queries given."
+  
+  if len(queries) > Config.SQL_BATCH_MAX:
+    return f"Error: At most {Config.SQL_BATCH_MAX} queries per batch."
+  
+  queries = [query if isinstance(query, dict) else {'query': query} for query in queries]
+  errors = []
+  for index, query in enumerate(queries):
+    error_msg = check_query(query.get('query', ''))
+    if error_msg:
+      errors.append(f"{query.get('name') or index + 1}: {error_msg}")
+  if errors:
+    return "Error: No query was run.\n" + "\n".join(errors)
+  
+  outputs = batch_pool.map(timed_select, [query['query'] for query in queries])
+  return "\n\n".join(f"## {query.get('name') or f'Query {index + 1}'} ({duration_ms} ms)\n{output}"
+                     for index, (query, (output, duration_ms)) in enumerate(zip(queries, outputs)))
+
 def get_sample_data(table_name: str, limit: int = 5) -> str:
   """
   Get sample rows from a specific table to understand the data structure.
@@ -219,7 +282,6 @@ def get_sample_data(table_name: str, limit: int = 5) -> str:
   except Exception as e:
     return f"Error: {str(e)}"
 
-@mcp.tool()
 def generate_diagram(chart_type: str, title: str, labels: list, datasets: list) -> str:
   """
   Generate a visual diagram/chart to present data insights.
@@ -236,5 +298,23 @@ def generate_diagram(chart_type: str, title: str, labels: list, datasets: list)
   """
   return f"Diagram '{title}' created successfully with {len(labels)} data points using {chart_type} chart."
 
+TOOLS = [get_database_schema, execute_sql_query, execute_sql_batch, get_sample_data, generate_diagram]
+
+def create_server() -> Any:
+  # fastmcp is imported only to serve, the functions above import without it
+  from fastmcp import FastMCP
+  
+  server = FastMCP('Sales Database Server')
+  for tool in TOOLS:
+    server.tool()(tool)
+  return server
+
+def __getattr__(name: str) -> Any:
+  # mcp_server.mcp (e.g. for `fastmcp run mcp_server.py`) is created on first access
+  if name == 'mcp':
+    globals()['mcp'] = create_server()
+    return globals()['mcp']
+  raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 if __name__ == '__main__':
-  mcp.run()
+  create_server().run()
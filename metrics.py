@@ -0,0 +1,215 @@
+import bisect
+import contextvars
+import functools
+import threading
+import time
+from typing import Dict, List, Any, Callable, Optional, Tuple
+from config import Config
+
+# Spans and counters for /metrics (Prometheus text format, no client library
+# needed). A span times one phase of a request - model call, SQL validation,
+# query, saving the conversations - into a histogram and, if the request is
+# traced, into its per-response timing breakdown.
+#
+# METRICS=false turns every span into a no-op; bench/micro.py measures the
+# cost of an enabled span (a few microseconds).
+
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+ROWS_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+enabled = Config.METRICS
+
+current_trace = contextvars.ContextVar('current_trace', default=None)
+
+
+class Counter:
+  
+  def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+    self.name = name
+    self.help = help
+    self.labels = labels
+    self.values = {}  # label values -> count
+    self.lock = threading.Lock()
+  
+  def inc(self, *label_values: str, amount: float = 1) -> None:
+    with self.lock:
+      self.values[label_values] = self.values.get(label_values, 0) + amount
+  
+  def render(self) -> List[str]:
+    lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+    with self.lock:
+      for label_values, value in sorted(self.values.items()):
+        lines.append(f'{self.name}{format_labels(self.labels, label_values)} {value}')
+    return lines
+
+
+class Histogram:
+  
+  def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = SECONDS_BUCKETS):
+    self.name = name
+    self.help = help
+    self.labels = labels
+    self.buckets = buckets
+    self.series = {}  # label values -> [bucket counts..., +Inf count, sum]
+    self.lock = threading.Lock()
+  
+  def observe(self, value: float, *label_values: str) -> None:
+    index = bisect.bisect_left(self.buckets, value)  # counts are cumulated when rendering
+    with self.lock:
+      series = self.series.get(label_values)
+      if series is None:
+        series = self.series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+      series[index] += 1
+      series[-1] += value
+  
+  def render(self) -> List[str]:
+    lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+    with self.lock:
+      series = sorted((label_values, list(values)) for label_values, values in self.series.items())
+    
+    for label_values, values in series:
+      cumulative = 0
+      for bound, count in zip(self.buckets + (float('inf'),), values):
+        cumulative += count
+        le = '+Inf' if bound == float('inf') else repr(bound)
+        lines.append(f'{self.name}_bucket{format_labels(self.labels + ("le",), label_values + (le,))} {cumulative}')
+      lines.append(f'{self.name}_sum{format_labels(self.labels, label_values)} {round(values[-1], 6)}')
+      lines.append(f'{self.name}_count{format_labels(self.labels, label_values)} {cumulative}')
+    return lines
+
+
+def format_labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+  if not names:
+    return ''
+  escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values)
+  return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, escaped)) + '}'
+
+
+span_seconds = Histogram('sales_assistant_span_seconds', 'Duration of request phases', ('span',))
+http_seconds = Histogram('sales_assistant_http_request_seconds', 'Duration of HTTP requests', ('endpoint',))
+http_requests = Counter('sales_assistant_http_requests_total', 'HTTP requests', ('endpoint', 'status'))
+http_bytes = Histogram('sales_assistant_http_response_bytes', 'Size of HTTP response bodies', ('endpoint',), BYTES_BUCKETS)
+llm_calls = Counter('sales_assistant_llm_calls_total', 'Requests sent to the model provider', ('provider', 'outcome'))
+llm_tokens = Counter('sales_assistant_llm_tokens_total', 'Tokens reported by the model provider', ('provider', 'type'))
+tool_calls = Counter('sales_assistant_tool_calls_total', 'Tool calls by the model', ('tool', 'outcome'))
+sql_rows = Histogram('sales_assistant_sql_rows', 'Rows returned per query', ('tool',), ROWS_BUCKETS)
+
+METRICS = [span_seconds, http_seconds, http_requests, http_bytes, llm_calls, llm_tokens, tool_calls, sql_rows]
+
+# name -> callable returning {stat: number}, e.g. cache and scheduler stats
+_collectors = {}
+
+
+class Trace:
+  
+  def __init__(self):
+    self.started = time.perf_counter()
+    self.spans = []  # (name, seconds), appended from tool threads as well
+  
+  def breakdown(self) -> Dict:
+    spans = {}
+    for name, seconds in self.spans:
+      entry = spans.setdefault(name, {'count': 0, 'ms': 0.0})
+      entry['count'] += 1
+      entry['ms'] += seconds * 1000
+    
+    for entry in spans.values():
+      entry['ms'] = round(entry['ms'], 2)
+    return {'total_ms': round((time.perf_counter() - self.started) * 1000, 2), 'spans': spans}
+
+
+def start_trace() -> Optional[Trace]:
+  trace = Trace() if enabled else None
+  current_trace.set(trace)
+  return trace
+
+def record_span(name: str, seconds: float) -> None:
+  span_seconds.observe(seconds, name)
+  trace = current_trace.get()
+  if trace is not None:
+    trace.spans.append((name, seconds))
+
+
+class Span:
+  __slots__ = ('name', 'started')
+  
+  def __init__(self, name: str):
+    self.name = name
+  
+  def __enter__(self) -> 'Span':
+    self.started = time.perf_counter()
+    return self
+  
+  def __exit__(self, *exc_info: Any) -> None:
+    if enabled:
+      record_span(self.name, time.perf_counter() - self.started)
+
+
+def span(name: str) -> Span:
+  """Times a with-block as the request phase `name`."""
+  return Span(name)
+
+def timed(name: str) -> Callable:
+  def decorator(fn: Callable) -> Callable:
+    @functools.wraps(fn)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+      with span(name):
+        return fn(*args, **kwargs)
+    return wrapper
+  return decorator
+
+def observe_request(endpoint: str, status: int, seconds: float, body_bytes: Optional[int]) -> None:
+  if not enabled:
+    return
+  http_seconds.observe(seconds, endpoint)
+  http_requests.inc(endpoint, str(status))
+  if body_bytes is not None:
+    http_bytes.observe(body_bytes, endpoint)
+
+def observe_tool(result: Dict, seconds: float) -> None:
+  if not enabled:
+    return
+  tool = result.get('name', '')
+  record_span(f'tool.{tool}', seconds)
+  tool_calls.inc(tool, 'error' if result.get('type') == 'error' else 'ok')
+  if 'row_count' in result:
+    sql_rows.observe(result['row_count'], tool)
+
+def observe_llm(provider: str, seconds: float, response: Any) -> None:
+  record_span('llm', seconds)
+  llm_calls.inc(provider, 'ok' if response is not None else 'error')
+  for key, value in (getattr(response, 'usage', None) or {}).items():
+    if value:
+      llm_tokens.inc(provider, key.replace('_tokens', ''), amount=value)
+
+def register_collector(name: str, collect: Callable[[], Dict]) -> None:
+  _collectors[name] = collect
+
+def render() -> str:
+  lines = []
+  for metric in METRICS:
+    lines.extend(metric.render())
+  
+  for name, collect in sorted(_collectors.items()):
+    try:
+      stats = collect()
+    except Exception:
+      continue
+    for stat, value in sorted(flatten(stats)):
+      metric = f'sales_assistant_{name}_{stat}'
+      lines.append(f'# TYPE {metric} gauge')
+      lines.append(f'{metric} {value}')
+  
+  return '\n'.join(lines) + '\n'
+
+def flatten(stats: Dict, prefix: str = '') -> List[Tuple[str, float]]:
+  # nested stats (router backends) become name_backend_stat, non-numbers are skipped
+  items = []
+  for key, value in stats.items():
+    name = f'{prefix}{key}'.replace('-', '_').replace('.', '_').replace(':', '_').replace('/', '_')
+    if isinstance(value, dict):
+      items.extend(flatten(value, name + '_'))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+      items.append((name, value))
+  return items
@@ -0,0 +1,303 @@
+import asyncio
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Callable, Optional, Tuple
+from config import Config
+from llm_messages import ModelResponse, FunctionCall
+import result_store
+import metrics
+from jobs import report_progress
+
+# The tool loop shared by the Flask endpoints (app.py) and the ASGI entry point (asgi.py).
+# run_tool_loop and run_tool_loop_async must stay behaviourally identical, only the
+# way the provider and the tools are awaited differs.
+
+# Bounded pool for the tool calls of one model turn, shared by all conversations
+tool_pool = ThreadPoolExecutor(max_workers=Config.TOOL_WORKERS, thread_name_prefix='tool')
+
+def build_chat_history(messages: List[Dict], include_function_results: bool = False) -> List[Dict]:
+  chat_history = []
+  
+  for msg in messages:
+    if msg['role'] == 'user':
+      chat_history.append({'role': 'user', 'parts': [{'text': msg['content']}]})
+    elif msg['role'] == 'assistant':
+      if include_function_results:
+        for func_result in msg.get('function_results') or []:
+          append_tool_exchange(chat_history, func_result.get('name', ''), func_result.get('args', {}), func_result)
+      
+      if msg.get('content'):
+        chat_history.append({'role': 'model', 'parts': [{'text': msg['content']}]})
+  
+  return chat_history
+
+def append_tool_exchange(chat_history: List[Dict], function_name: str, function_args: Dict, result: Dict) -> None:
+  # plain dicts instead of the provider's function call objects keep the history
+  # provider-neutral and hashable (see llm_cache.py)
+  chat_history.append({'role': 'model', 'parts': [{'function_call': {'name': function_name, 'args': function_args}}]})
+  chat_history.append({
+    'role': 'user',
+    'parts': [{
+      'function_response': {
+        'name': function_name,
+        'response': result_store.model_view(result)
+      }
+    }]
+  })
+
+def split_response(response: ModelResponse) -> Tuple[str, List[FunctionCall]]:
+  return response.text, response.function_calls
+
+def function_call_signature(function_call: Any) -> Tuple[str, Dict]:
+  function_name = getattr(function_call, 'name', None)
+  args = getattr(function_call, 'args', None)
+  function_args = (args if isinstance(args, dict) else dict(args)) if args else {}
+  return function_name, function_args
+
+def collect_tool_calls(function_calls: List[Any]) -> List[Tuple[str, Dict]]:
+  tool_calls = []
+  for function_call in function_calls:
+    function_name, function_args = function_call_signature(function_call)
+    if function_name:
+      tool_calls.append((function_name, function_args))
+  return tool_calls
+
+def timed_execute(execute: Callable[[str, Dict], Dict], function_name: str, function_args: Dict) -> Dict:
+  started = time.perf_counter()
+  result = execute(function_name, function_args)
+  result['name'] = function_name
+  result['args'] = function_args
+  elapsed = time.perf_counter() - started
+  result['duration_ms'] = round(elapsed * 1000, 2)
+  metrics.observe_tool(result, elapsed)
+  return result
+
+def execute_tool_calls(tool_calls: List[Tuple[str, Dict]], execute: Callable[[str, Dict], Dict]) -> List[Dict]:
+  if len(tool_calls) == 1:
+    function_name, function_args = tool_calls[0]
+    return [timed_execute(execute, function_name, function_args)]
+  
+  # copy_context: spans of the tool threads count towards the request's trace
+  futures = [tool_pool.submit(contextvars.copy_context().run, timed_execute, execute, function_name, function_args)
+             for function_name, function_args in tool_calls]
+  return [future.result() for future in futures]
+
+async def execute_tool_calls_async(tool_calls: List[Tuple[str, Dict]], execute: Callable[[str, Dict], Dict]) -> List[Dict]:
+  # SQLite access is blocking, keep it off the event loop
+  loop = asyncio.get_running_loop()
+  return await asyncio.gather(*[
+    loop.run_in_executor(tool_pool, contextvars.copy_context().run, timed_execute, execute, function_name, function_args)
+    for function_name, function_args in tool_calls
+  ])
+
+def run_tool_loop(llm_client: Any, chat_history: List[Dict], system_instruction: str, tools: List[Dict],
+                  max_iterations: int, execute: Callable[[str, Dict], Dict]) -> Tuple[str, List[Dict]]:
+  assistant_text = ''
+  function_results = []
+  
+  for iteration in range(max_iterations):
+    report_progress(iteration=iteration + 1, tools=[])
+    response = llm_client.generate_content(
+      contents=chat_history,
+      system_instruction=system_instruction,
+      tools=[{'function_declarations': tools}]
+    )
+    
+    text, function_calls = split_response(response)
+    assistant_text += text
+    
+    if not function_calls:
+      break
+    
+    tool_calls = collect_tool_calls(function_calls)
+    report_progress(tools=[function_name for function_name, _ in tool_calls])
+    results = execute_tool_calls(tool_calls, execute)
+    
+    for (function_name, function_args), result in zip(tool_calls, results):
+      function_results.append(result_store.preview(result))
+      append_tool_exchange(chat_history, function_name, function_args, result)
+  
+  return assistant_text, function_results
+
+async def run_tool_loop_async(llm_client: Any, chat_history: List[Dict], system_instruction: str, tools: List[Dict],
+                              max_iterations: int, execute: Callable[[str, Dict], Dict]) -> Tuple[str, List[Dict]]:
+  assistant_text = ''
+  function_results = []
+  
+  for iteration in range(max_iterations):
+    report_progress(iteration=iteration + 1, tools=[])
+    response = await llm_client.generate_content(
+      contents=chat_history,
+      system_instruction=system_instruction,
+      tools=[{'function_declarations': tools}]
+    )
+    
+    text, function_calls = split_response(response)
+    assistant_text += text
+    
+    if not function_calls:
+      break
+    
+    tool_calls = collect_tool_calls(function_calls)
+    report_progress(tools=[function_name for function_name, _ in tool_calls])
+    results = await execute_tool_calls_async(tool_calls, execute)
+    
+    for (function_name, function_args), result in zip(tool_calls, results):
+      function_results.append(result_store.preview(result))
+      append_tool_exchange(chat_history, function_name, function_args, result)
+  
+  return assistant_text, function_results
+
+PLAN_NARRATION_PROMPT = """
+
+The data for this question has already been retrieved with the queries shown in the conversation. Do not call any tools, answer from these results."""
+
+PLAN_FAST_MODE_TEXT = 'Answered from a saved query plan for a similar question.'
+
+def run_cached_plan(llm_client: Any, chat_history: List[Dict], system_instruction: str, tools: List[Dict],
+                    queries: List[str], execute: Callable[[str, Dict], Dict], narrate: bool) -> Optional[Tuple[str, List[Dict]]]:
+  tool_calls = [('execute_sql_query', {'query': query}) for query in queries]
+  report_progress(plan=True, tools=['execute_sql_query'] * len(tool_calls))
+  function_results = execute_tool_calls(tool_calls, execute)
+  
+  if any(result.get('type') == 'error' for result in function_results):
+    return None
+  
+  if not narrate:
+    return PLAN_FAST_MODE_TEXT, [result_store.preview(result) for result in function_results]
+  
+  for (function_name, function_args), result in zip(tool_calls, function_results):
+    append_tool_exchange(chat_history, function_name, function_args, result)
+  
+  response = llm_client.generate_content(
+    contents=chat_history,
+    system_instruction=system_instruction + PLAN_NARRATION_PROMPT,
+    tools=[{'function_declarations': tools}]
+  )
+  
+  text, _ = split_response(response)
+  return text, [result_store.preview(result) for result in function_results]
+
+async def run_cached_plan_async(llm_client: Any, chat_history: List[Dict], system_instruction: str, tools: List[Dict],
+                                queries: List[str], execute: Callable[[str, Dict], Dict], narrate: bool) -> Optional[Tuple[str, List[Dict]]]:
+  tool_calls = [('execute_sql_query', {'query': query}) for query in queries]
+  report_progress(plan=True, tools=['execute_sql_query'] * len(tool_calls))
+  function_results = await execute_tool_calls_async(tool_calls, execute)
+  
+  if any(result.get('type') == 'error' for result in function_results):
+    return None
+  
+  if not narrate:
+    return PLAN_FAST_MODE_TEXT, [result_store.preview(result) for result in function_results]
+  
+  for (function_name, function_args), result in zip(tool_calls, function_results):
+    append_tool_exchange(chat_history, function_name, function_args, result)
+  
+  response = await llm_client.generate_content(
+    contents=chat_history,
+    system_instruction=system_instruction + PLAN_NARRATION_PROMPT,
+    tools=[{'function_declarations': tools}]
+  )
+  
+  text, _ = split_response(response)
+  return text, [result_store.preview(result) for result in function_results]
+
+# Tiered pipeline (SQL_STAGE_MODEL): a small model runs the tool loop, i.e. looks up
+# the schema, drafts the SQL and repairs it from the validator's error results; the
+# main model only writes the final answer from the retrieved data.
+
+SQL_STAGE_PROMPT = """
+
+In this step you only retrieve the data: call the tools, fix a failing query from its error message, and once everything the answer needs (including diagrams) is retrieved reply with just DONE. The written answer is produced in a later step."""
+
+class StageMeter:
+  
+  def __init__(self, llm_client: Any, stage: str):
+    self.llm_client = llm_client
+    self.stage = stage
+    self.calls = 0
+    self.model_seconds = 0.0
+    self.usage = {'prompt_tokens': 0, 'output_tokens': 0, 'cached_tokens': 0}
+  
+  def generate_content(self, contents: List[Dict], system_instruction: str, tools: List[Dict]) -> Any:
+    started = time.perf_counter()
+    response = self.llm_client.generate_content(contents=contents, system_instruction=system_instruction, tools=tools)
+    self.add(response, started)
+    return response
+  
+  def add(self, response: Any, started: float) -> None:
+    self.calls += 1
+    self.model_seconds += time.perf_counter() - started
+    for key, value in (getattr(response, 'usage', None) or {}).items():
+      self.usage[key] += value
+  
+  def record(self, started: float) -> Dict:
+    return {
+      'stage': self.stage,
+      'calls': self.calls,
+      'duration_ms': round((time.perf_counter() - started) * 1000, 2),
+      'model_ms': round(self.model_seconds * 1000, 2),
+      **self.usage
+    }
+
+
+class AsyncStageMeter(StageMeter):
+  
+  async def generate_content(self, contents: List[Dict], system_instruction: str, tools: List[Dict]) -> Any:
+    started = time.perf_counter()
+    response = await self.llm_client.generate_content(contents=contents, system_instruction=system_instruction, tools=tools)
+    self.add(response, started)
+    return response
+
+
+def run_tiered_loop(sql_client: Any, narrate_client: Any, chat_history: List[Dict], system_instruction: str, tools: List[Dict],
+                    max_iterations: int, execute: Callable[[str, Dict], Dict], stages: List[Dict]) -> Tuple[str, List[Dict]]:
+  started = time.perf_counter()
+  meter = StageMeter(sql_client, 'sql')
+  _, function_results = run_tool_loop(meter, chat_history, system_instruction + SQL_STAGE_PROMPT, tools, max_iterations, execute)
+  stages.append(meter.record(started))
+  
+  started = time.perf_counter()
+  if not function_results:
+    # nothing retrieved, not a data question or the small model gave up: the main model answers on its own
+    meter = StageMeter(narrate_client, 'answer')
+    answer = run_tool_loop(meter, chat_history, system_instruction, tools, max_iterations, execute)
+    stages.append(meter.record(started))
+    return answer
+  
+  meter = StageMeter(narrate_client, 'narrate')
+  response = meter.generate_content(
+    contents=chat_history,
+    system_instruction=system_instruction + PLAN_NARRATION_PROMPT,
+    tools=[{'function_declarations': tools}]
+  )
+  stages.append(meter.record(started))
+  
+  text, _ = split_response(response)
+  return text, function_results
+
+async def run_tiered_loop_async(sql_client: Any, narrate_client: Any, chat_history: List[Dict], system_instruction: str, tools: List[Dict],
+                                max_iterations: int, execute: Callable[[str, Dict], Dict], stages: List[Dict]) -> Tuple[str, List[Dict]]:
+  started = time.perf_counter()
+  meter = AsyncStageMeter(sql_client, 'sql')
+  _, function_results = await run_tool_loop_async(meter, chat_history, system_instruction + SQL_STAGE_PROMPT, tools, max_iterations, execute)
+  stages.append(meter.record(started))
+  
+  started = time.perf_counter()
+  if not function_results:
+    meter = AsyncStageMeter(narrate_client, 'answer')
+    answer = await run_tool_loop_async(meter, chat_history, system_instruction, tools, max_iterations, execute)
+    stages.append(meter.record(started))
+    return answer
+  
+  meter = AsyncStageMeter(narrate_client, 'narrate')
+  response = await meter.generate_content(
+    contents=chat_history,
+    system_instruction=system_instruction + PLAN_NARRATION_PROMPT,
+    tools=[{'function_declarations': tools}]
+  )
+  stages.append(meter.record(started))
+  
+  text, _ = split_response(response)
+  return text, function_results
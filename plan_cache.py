@@ -0,0 +1,251 @@
+import difflib
+import json
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Any, Optional, Tuple
+from query_stats import file_lock
+
+# Question -> SQL plan cache. Successful first-turn answers are stored as a question
+# template ("top <num> customers") plus the executed SQL with the question's constants
+# replaced by slots. A new question with the same (or a very similar) template gets
+# the SQL re-rendered with its own constants and executed without the model.
+#
+# Worker processes of the production server share the plan file: a save re-reads it
+# under a lock and writes back only the plans this process added or forgot.
+
+MONTHS = ['january', 'february', 'march', 'april', 'may', 'june', 'july',
+          'august', 'september', 'october', 'november', 'december']
+MONTH_ABBREVIATIONS = {name[:3]: index for index, name in enumerate(MONTHS)}
+
+TOKEN_RE = re.compile(r"'[^']*'|\"[^\"]*\"|\d+(?:\.\d+)?|\w+")
+SLOT_RE = re.compile(r'\{\{(\d+):(\w+)\}\}')
+
+# "last month" means something else tomorrow, unless the SQL computes it with date('now')
+RELATIVE_TIME_WORDS = {'today', 'yesterday', 'last', 'this', 'current', 'recent', 'recently', 'ago', 'past', 'previous', 'now'}
+DATE_LITERAL_RE = re.compile(r"'\d{4}-\d{2}")
+
+# the only words a similar question may add, drop or swap: "show me the top 5 customers"
+# and "top 5 customers" are the same question, "... in germany" and "... in france" are not
+FILLER_WORDS = {'a', 'an', 'the', 'me', 'us', 'please', 'show', 'list', 'give', 'get', 'find', 'tell',
+                'display', 'what', 'which', 'who', 'are', 'is', 'were', 'was', 'do', 'does', 'of', 'for',
+                'all', 'our', 'my', 'can', 'you', 'could', 'would', 'i', 'want', 'see', 'to', 'know', 'pls'}
+
+def parse_question(question: str) -> Tuple[List[str], List[Tuple[str, Any]]]:
+  tokens = []
+  slots = []
+  
+  for token in TOKEN_RE.findall(question.lower()):
+    if token[0] in '\'"':
+      tokens.append('<str>')
+      slots.append(('str', token[1:-1]))
+    elif token[0].isdigit():
+      tokens.append('<num>')
+      slots.append(('num', token))
+    elif token != 'may' and (token in MONTHS or token in MONTH_ABBREVIATIONS):
+      tokens.append('<month>')
+      slots.append(('month', MONTHS.index(token) if token in MONTHS else MONTH_ABBREVIATIONS[token]))
+    else:
+      tokens.append(token)
+  
+  return tokens, slots
+
+def render_slot(slot_type: str, value: Any, form: str) -> str:
+  if slot_type == 'month':
+    if form == 'number':
+      return f'{value + 1:02d}'
+    name = MONTHS[value]
+    return name.capitalize() if form == 'title' else name
+  if slot_type == 'str':
+    return value.replace("'", "''")
+  return value
+
+def slot_forms(slot_type: str) -> List[str]:
+  return ['number', 'title', 'lower'] if slot_type == 'month' else ['raw']
+
+def literal_pattern(literal: str) -> str:
+  return r'(?<![\w.])' + re.escape(literal) + r'(?![\w.])'
+
+def parametrize_sql(query: str, slots: List[Tuple[str, Any]]) -> Tuple[str, List[bool]]:
+  bound = []
+  
+  for index, (slot_type, value) in enumerate(slots):
+    matches = [(form, m) for form in slot_forms(slot_type)
+               for m in re.finditer(literal_pattern(render_slot(slot_type, value, form)), query)]
+    
+    # a literal that shows up more than once may be a coincidence, keep the slot fixed
+    if len(matches) != 1:
+      bound.append(False)
+      continue
+    
+    form, match = matches[0]
+    query = query[:match.start()] + '{{' + f'{index}:{form}' + '}}' + query[match.end():]
+    bound.append(True)
+  
+  return query, bound
+
+def differing_tokens(tokens: List[str], other: List[str]) -> set:
+  matcher = difflib.SequenceMatcher(None, tokens, other)
+  changed = set()
+  for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+    if tag != 'equal':
+      changed.update(tokens[i1:i2], other[j1:j2])
+  return changed
+
+def interchangeable(tokens: List[str], plan: Dict) -> bool:
+  # a fuzzy match may only differ in filler words, and in none the cached SQL mentions
+  changed = differing_tokens(tokens, plan['tokens'])
+  if not changed <= FILLER_WORDS:
+    return False
+  sql = ' '.join(plan['queries']).lower()
+  return not any(re.search(literal_pattern(token), sql) for token in changed)
+
+def render_sql(template: str, slots: List[Tuple[str, Any]]) -> str:
+  return SLOT_RE.sub(lambda m: render_slot(slots[int(m.group(1))][0], slots[int(m.group(1))][1], m.group(2)), template)
+
+
+class PlanCache:
+  
+  def __init__(self, file_path: Optional[str] = None, max_entries: int = 500, similarity: float = 0.9):
+    self.file_path = file_path
+    self.max_entries = max_entries
+    self.similarity = similarity
+    self.plans = {}  # template -> plan
+    self.changed = set()  # templates recorded or forgotten since the last save
+    self.lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+    
+    if file_path:
+      self.plans = self._load()
+  
+  def match(self, question: str) -> Optional[Tuple[str, List[str]]]:
+    tokens, slots = parse_question(question)
+    slot_types = [slot_type for slot_type, _ in slots]
+    
+    with self.lock:
+      plan = self.plans.get(' '.join(tokens))
+      
+      if not plan:
+        candidates = [p for p in self.plans.values() if p['slot_types'] == slot_types and interchangeable(tokens, p)]
+        scored = [(difflib.SequenceMatcher(None, tokens, p['tokens']).ratio(), p) for p in candidates]
+        best = max(scored, key=lambda item: item[0], default=(0, None))
+        plan = best[1] if best[0] >= self.similarity else None
+      
+      if plan:
+        for index, (_, value) in enumerate(slots):
+          if not plan['bound'][index] and value != plan['slot_values'][index]:
+            plan = None
+            break
+      
+      if not plan:
+        self.misses += 1
+        return None
+      
+      self.hits += 1
+      plan['uses'] += 1
+      return plan['template'], [render_sql(query, slots) for query in plan['queries']]
+  
+  def record(self, question: str, queries: List[str]) -> None:
+    tokens, slots = parse_question(question)
+    if not queries:
+      return
+    
+    if RELATIVE_TIME_WORDS & set(tokens) and any(DATE_LITERAL_RE.search(query) for query in queries):
+      return
+    
+    bound = [False] * len(slots)
+    templates = []
+    for query in queries:
+      template, query_bound = parametrize_sql(query, slots)
+      templates.append(template)
+      bound = [a or b for a, b in zip(bound, query_bound)]
+    
+    template_key = ' '.join(tokens)
+    with self.lock:
+      self.plans.pop(template_key, None)
+      self.plans[template_key] = {
+        'template': template_key,
+        'tokens': tokens,
+        'slot_types': [slot_type for slot_type, _ in slots],
+        'slot_values': [value for _, value in slots],
+        'bound': bound,
+        'queries': templates,
+        'uses': 0,
+        'created_at': time.time()
+      }
+      self.changed.add(template_key)
+      
+      while len(self.plans) > self.max_entries:
+        self.plans.pop(next(iter(self.plans)))
+      
+      self._save()
+  
+  def forget(self, template: str) -> None:
+    with self.lock:
+      if self.plans.pop(template, None):
+        self.changed.add(template)
+        self._save()
+  
+  def stats(self) -> Dict:
+    with self.lock:
+      return {'hits': self.hits, 'misses': self.misses, 'plans': len(self.plans)}
+  
+  def _load(self) -> Dict:
+    if not os.path.exists(self.file_path):
+      return {}
+    
+    try:
+      with open(self.file_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+    except (OSError, ValueError):
+      return {}
+  
+  def _save(self) -> None:
+    if not self.file_path:
+      return
+    
+    # other worker processes write the same file, apply our changes to what is there
+    with file_lock(self.file_path):
+      plans = self._load()
+      for template in self.changed:
+        plans.pop(template, None)
+        if template in self.plans:
+          plans[template] = self.plans[template]
+      
+      while len(plans) > self.max_entries:
+        plans.pop(next(iter(plans)))
+      
+      tmp_path = f'{self.file_path}.{os.getpid()}.tmp'
+      with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(plans, f, indent=2, ensure_ascii=False)
+      os.replace(tmp_path, self.file_path)
+    
+    self.plans = plans
+    self.changed = set()
+
+
+def successful_queries(function_results: List[Dict]) -> List[str]:
+  # failed attempts the model corrected itself are not part of the plan; the
+  # queries of a batch are replayed one by one like execute_sql_query calls
+  queries = []
+  for result in function_results:
+    if result.get('name') == 'execute_sql_query' and result.get('type') == 'table':
+      queries.append(result['query'])
+    elif result.get('name') == 'execute_sql_batch' and result.get('type') == 'batch':
+      queries += [item['query'] for item in result['results'] if item.get('type') == 'table']
+  return queries
+
+def create_plan_cache(config: Any) -> Optional[PlanCache]:
+  if config.PLAN_CACHE_MODE not in ('narrate', 'fast'):
+    return None
+  
+  if config.PLAN_CACHE_FILE:
+    os.makedirs(os.path.dirname(config.PLAN_CACHE_FILE) or '.', exist_ok=True)
+  
+  return PlanCache(
+    file_path=config.PLAN_CACHE_FILE or None,
+    max_entries=config.PLAN_CACHE_SIZE,
+    similarity=config.PLAN_SIMILARITY
+  )
@@ -0,0 +1,152 @@
+import cProfile
+import hmac
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# Opt-in profiling of a single chat request: an admin sends X-Profile (or
+# ?profile=) together with X-Admin-Token and the request runs under cProfile
+# (deterministic, written as .pstats) or a sampling profiler (low overhead,
+# written as speedscope JSON) - open the files with `python -m pstats` or
+# https://www.speedscope.app. ProfileGate caps how many requests are profiled at
+# once; a request over the cap runs normally.
+#
+# Only the request's own thread is profiled; with the ASGI server that is the
+# event loop, so other conversations served meanwhile show up in the profile.
+
+PROFILE_MODES = ('cprofile', 'sampling')
+
+def requested_mode(flag: Optional[str], default_mode: str) -> Optional[str]:
+  flag = (flag or '').strip().lower()
+  if flag in ('', '0', 'false', 'off'):
+    return None
+  if flag in ('1', 'true', 'on'):
+    return default_mode
+  return flag if flag in PROFILE_MODES else None
+
+def is_authorized(token: Optional[str], admin_token: str) -> bool:
+  # no ADMIN_TOKEN configured: profiling is off
+  return bool(admin_token) and hmac.compare_digest((token or '').encode('utf-8'), admin_token.encode('utf-8'))
+
+
+class ProfileGate:
+  
+  def __init__(self, max_concurrent: int = 1):
+    self.slots = threading.BoundedSemaphore(max(1, max_concurrent))
+  
+  def acquire(self) -> bool:
+    return self.slots.acquire(blocking=False)
+  
+  def release(self) -> None:
+    self.slots.release()
+
+
+class SamplingProfiler:
+  """Samples the stack of one thread from a background thread every
+  `interval` seconds, the target thread runs at full speed in between."""
+  
+  def __init__(self, thread_id: int, interval: float = 0.005):
+    self.thread_id = thread_id
+    self.interval = interval
+    self.frames = {}   # (name, file, line) -> index in the speedscope frame table
+    self.samples = []  # stacks of frame indexes, outermost first
+    self.weights = []  # seconds each sample stands for
+    self.stopped = threading.Event()
+    self.sampler = None
+    self.started = 0.0
+    self.duration = 0.0
+  
+  def start(self) -> None:
+    self.started = time.perf_counter()
+    self.sampler = threading.Thread(target=self.run, name='profile-sampler', daemon=True)
+    self.sampler.start()
+  
+  def stop(self) -> None:
+    self.stopped.set()
+    self.sampler.join()
+    self.duration = time.perf_counter() - self.started
+  
+  def run(self) -> None:
+    last = time.perf_counter()
+    while not self.stopped.wait(self.interval):
+      frame = sys._current_frames().get(self.thread_id)
+      now = time.perf_counter()
+      if frame is not None:
+        self.samples.append(self.stack(frame))
+        self.weights.append(now - last)
+      last = now
+  
+  def stack(self, frame) -> List[int]:
+    stack = []
+    while frame is not None:
+      code = frame.f_code
+      key = (code.co_name, code.co_filename, code.co_firstlineno)
+      stack.append(self.frames.setdefault(key, len(self.frames)))
+      frame = frame.f_back
+    stack.reverse()
+    return stack
+  
+  def speedscope(self, name: str) -> Dict:
+    return {
+      '$schema': 'https://www.speedscope.app/file-format-schema.json',
+      'name': name,
+      'exporter': 'sales-assistant',
+      'shared': {'frames': [{'name': fn, 'file': file, 'line': line} for fn, file, line in self.frames]},
+      'profiles': [{
+        'type': 'sampled',
+        'name': name,
+        'unit': 'seconds',
+        'startValue': 0,
+        'endValue': round(self.duration, 6),
+        'samples': self.samples,
+        'weights': [round(weight, 6) for weight in self.weights]
+      }]
+    }
+
+
+class ProfileSession:
+  
+  def __init__(self, mode: str, interval: float = 0.005):
+    self.mode = mode
+    self.interval = interval
+    self.profiler = None
+  
+  def start(self) -> bool:
+    if self.mode == 'cprofile':
+      self.profiler = cProfile.Profile()
+      try:
+        self.profiler.enable()
+      except ValueError:
+        # Python 3.12+ allows one cProfile per process, another request holds it
+        self.profiler = None
+        return False
+    else:
+      self.profiler = SamplingProfiler(threading.get_ident(), self.interval)
+      self.profiler.start()
+    return True
+  
+  def stop(self) -> None:
+    if self.mode == 'cprofile':
+      self.profiler.disable()
+    else:
+      self.profiler.stop()
+  
+  def write(self, directory: str, tag: Optional[str]) -> str:
+    os.makedirs(directory, exist_ok=True)
+    tag = re.sub(r'[^\w-]', '_', tag or 'new')[:64]
+    base = os.path.join(directory, f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{tag}-{uuid.uuid4().hex[:6]}")
+    
+    if self.mode == 'cprofile':
+      path = base + '.pstats'
+      self.profiler.dump_stats(path)
+    else:
+      path = base + '.speedscope.json'
+      with open(path, 'w', encoding='utf-8') as f:
+        json.dump(self.profiler.speedscope(tag), f)
+    return path
@@ -0,0 +1,316 @@
+import argparse
+import atexit
+import contextlib
+import functools
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from logging.handlers import RotatingFileHandler
+from typing import Dict, List, Any, Callable, Optional, Tuple
+
+try:
+  import fcntl
+except ImportError:  # Windows, no multi-process server there
+  fcntl = None
+
+# Statement statistics for the SQL the model writes, in the spirit of
+# pg_stat_statements: queries are grouped by shape (literals replaced by ?), each
+# shape keeps call count, time, rows and its query plan. Shapes that are slow or
+# full-scan a big table are the candidates for an index or a cached result.
+#
+#   python query_stats.py --sort total_ms --limit 20
+#
+# Worker processes of the production server share the stats file: each one
+# merges what it recorded since its last save into the file under a lock.
+
+STRING_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_RE = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?(?![\w.])')
+IN_LIST_RE = re.compile(r'\bin\s*\(\s*\?(?:\s*,\s*\?)*\s*\)')
+WHITESPACE_RE = re.compile(r'\s+')
+
+PROGRESS_STEPS = 1000  # SQLite VM instructions between progress callbacks
+SAVE_INTERVAL = 30     # seconds between writes of the stats file
+SORT_KEYS = ('total_ms', 'mean_ms', 'max_ms', 'calls', 'rows', 'steps')
+
+def normalize_query(query: str) -> str:
+  shape = STRING_RE.sub('?', query.strip().rstrip(';'))
+  shape = NUMBER_RE.sub('?', shape)
+  shape = WHITESPACE_RE.sub(' ', shape).lower()
+  return IN_LIST_RE.sub('in (?)', shape)
+
+def fingerprint(shape: str) -> str:
+  return hashlib.sha1(shape.encode('utf-8')).hexdigest()[:12]
+
+@functools.lru_cache(maxsize=1024)
+def query_shape(query: str) -> Tuple[str, str]:
+  # the same SQL text comes back often (reruns, plan cache, paging the model does)
+  shape = normalize_query(query)
+  return shape, fingerprint(shape)
+
+def explain(conn: Any, query: str, params: tuple = ()) -> List[str]:
+  try:
+    return [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + query, params).fetchall()]
+  except Exception:
+    return []
+
+def new_entry(shape: str, query: str, now: float) -> Dict:
+  return {
+    'query': shape,
+    'example': query,
+    'calls': 0,
+    'errors': 0,
+    'total_ms': 0.0,
+    'max_ms': 0.0,
+    'rows': 0,
+    'steps': 0,
+    'plan': [],
+    'first_seen': now,
+    'last_seen': now
+  }
+
+def accumulate(entry: Dict, ms: float, rows: int, steps: int, now: float,
+               plan: Optional[List[str]], error: Optional[str]) -> None:
+  entry['calls'] += 1
+  entry['total_ms'] += ms
+  entry['max_ms'] = max(entry['max_ms'], ms)
+  entry['rows'] += rows
+  entry['steps'] += steps
+  entry['last_seen'] = now
+  if error:
+    entry['errors'] += 1
+    entry['last_error'] = error
+  if plan:
+    entry['plan'] = plan
+
+def merge_entry(stored: Optional[Dict], delta: Dict) -> Dict:
+  if not stored:
+    return delta
+  
+  merged = dict(stored)
+  for key in ('calls', 'errors', 'total_ms', 'rows', 'steps'):
+    merged[key] += delta[key]
+  merged['max_ms'] = max(stored['max_ms'], delta['max_ms'])
+  merged['first_seen'] = min(stored['first_seen'], delta['first_seen'])
+  merged['last_seen'] = max(stored.get('last_seen', 0), delta['last_seen'])
+  merged['plan'] = delta['plan'] or stored['plan']
+  if 'last_error' in delta:
+    merged['last_error'] = delta['last_error']
+  return merged
+
+@contextlib.contextmanager
+def file_lock(path: str):
+  with open(path + '.lock', 'a') as f:
+    if fcntl:
+      fcntl.flock(f, fcntl.LOCK_EX)  # released when the file is closed
+    yield
+
+def full_scans(plan: List[str]) -> List[str]:
+  # 'SCAN orders' reads the whole table, 'SCAN orders USING COVERING INDEX ...' only an index
+  return [step.split()[1] for step in plan if step.startswith('SCAN ') and 'USING' not in step and len(step.split()) > 1]
+
+
+class StepCounter:
+  """Counts SQLite VM instructions of one statement through the progress
+  handler, a cheap stand-in for the rows the statement had to look at."""
+  
+  def __init__(self, conn: Any):
+    self.conn = conn
+    self.ticks = 0
+  
+  def tick(self) -> int:
+    self.ticks += 1
+    return 0  # non-zero would abort the statement
+  
+  def __enter__(self) -> 'StepCounter':
+    self.conn.set_progress_handler(self.tick, PROGRESS_STEPS)
+    return self
+  
+  def __exit__(self, *exc_info: Any) -> None:
+    self.conn.set_progress_handler(None, 0)
+  
+  @property
+  def steps(self) -> int:
+    return self.ticks * PROGRESS_STEPS
+
+
+class QueryStats:
+  
+  def __init__(self, file_path: Optional[str] = None, max_entries: int = 1000,
+               slow_ms: float = 500, slow_log_path: Optional[str] = None):
+    self.file_path = file_path
+    self.max_entries = max_entries
+    self.slow_ms = slow_ms
+    self.entries = OrderedDict()  # fingerprint -> statement stats, least recently run first
+    self.pending = {}  # fingerprint -> stats recorded since the last save
+    self.lock = threading.Lock()
+    self.slow_queries = 0
+    self.saved_at = time.time()
+    self.slow_log = None
+    
+    if slow_log_path:
+      self.slow_log = logging.getLogger('sales_assistant.slow_queries')
+      if not self.slow_log.handlers:
+        handler = RotatingFileHandler(slow_log_path, maxBytes=10240000, backupCount=5)
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        self.slow_log.addHandler(handler)
+        self.slow_log.setLevel(logging.INFO)
+        self.slow_log.propagate = False
+    
+    if file_path:
+      self.entries = self._load()
+  
+  def record(self, query: str, seconds: float, rows: int, steps: int = 0,
+             get_plan: Optional[Callable[[], List[str]]] = None, error: Optional[str] = None) -> None:
+    shape, key = query_shape(query)
+    ms = seconds * 1000
+    now = time.time()
+    slow = ms >= self.slow_ms
+    
+    # the plan of a new shape, and a fresh one whenever a statement was slow
+    with self.lock:
+      known = self.entries.get(key)
+    plan = get_plan() if get_plan and (slow or not known or not known['plan']) else None
+    
+    with self.lock:
+      entry = self.entries.pop(key, None) or new_entry(shape, query, now)
+      self.entries[key] = entry
+      accumulate(entry, ms, rows, steps, now, plan, error)
+      if self.file_path:
+        accumulate(self.pending.setdefault(key, new_entry(shape, query, now)), ms, rows, steps, now, plan, error)
+      
+      while len(self.entries) > self.max_entries:
+        self.entries.popitem(last=False)
+      
+      if slow:
+        self.slow_queries += 1
+      
+      if self.file_path and now - self.saved_at >= SAVE_INTERVAL:
+        self._save()
+    
+    if slow and self.slow_log:
+      self.slow_log.info(json.dumps({
+        'fingerprint': key,
+        'ms': round(ms, 2),
+        'rows': rows,
+        'steps': steps,
+        'query': query,
+        'plan': plan or entry['plan'],
+        'error': error
+      }, ensure_ascii=False))
+  
+  def report(self, sort: str = 'total_ms', limit: int = 20) -> List[Dict]:
+    with self.lock:
+      entries = [(key, dict(entry)) for key, entry in self.entries.items()]
+    return build_report(entries, sort, limit)
+  
+  def stats(self) -> Dict:
+    with self.lock:
+      return {
+        'statements': len(self.entries),
+        'calls': sum(entry['calls'] for entry in self.entries.values()),
+        'slow_queries': self.slow_queries
+      }
+  
+  def flush(self) -> None:
+    with self.lock:
+      self._save()
+  
+  def _load(self) -> OrderedDict:
+    if not os.path.exists(self.file_path):
+      return OrderedDict()
+    
+    try:
+      with open(self.file_path, 'r', encoding='utf-8') as f:
+        return OrderedDict(json.load(f))
+    except (OSError, ValueError):
+      return OrderedDict()
+  
+  def _save(self) -> None:
+    if not self.file_path or not self.pending:
+      return
+    
+    # other worker processes write the same file, add our counts to what is there
+    with file_lock(self.file_path):
+      entries = self._load()
+      for key, delta in self.pending.items():
+        entries[key] = merge_entry(entries.get(key), delta)
+      
+      ordered = sorted(entries.items(), key=lambda item: item[1].get('last_seen', 0))[-self.max_entries:]
+      tmp_path = f'{self.file_path}.{os.getpid()}.tmp'
+      with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(ordered, f, ensure_ascii=False)
+      os.replace(tmp_path, self.file_path)
+    
+    self.entries = OrderedDict(ordered)
+    self.pending = {}
+    self.saved_at = time.time()
+
+
+def build_report(entries: List, sort: str = 'total_ms', limit: int = 20) -> List[Dict]:
+  report = []
+  for key, entry in entries:
+    calls = entry['calls'] or 1
+    report.append({
+      'fingerprint': key,
+      'query': entry['query'],
+      'calls': entry['calls'],
+      'errors': entry['errors'],
+      'total_ms': round(entry['total_ms'], 2),
+      'mean_ms': round(entry['total_ms'] / calls, 2),
+      'max_ms': round(entry['max_ms'], 2),
+      'rows': entry['rows'],
+      'mean_rows': round(entry['rows'] / calls, 1),
+      'steps': entry['steps'],
+      'full_scans': full_scans(entry['plan']),
+      'plan': entry['plan'],
+      'example': entry['example']
+    })
+  
+  report.sort(key=lambda item: item[sort if sort in SORT_KEYS else 'total_ms'], reverse=True)
+  return report[:limit]
+
+def create_query_stats(config: Any) -> Optional[QueryStats]:
+  if not config.QUERY_STATS:
+    return None
+  
+  if config.QUERY_STATS_FILE:
+    os.makedirs(os.path.dirname(config.QUERY_STATS_FILE) or '.', exist_ok=True)
+  os.makedirs('logs', exist_ok=True)
+  
+  stats = QueryStats(
+    file_path=config.QUERY_STATS_FILE or None,
+    max_entries=config.QUERY_STATS_SIZE,
+    slow_ms=config.SLOW_QUERY_MS,
+    slow_log_path='logs/slow_queries.log'
+  )
+  atexit.register(stats.flush)
+  return stats
+
+def print_report(report: List[Dict]) -> None:
+  print(f"{'calls':>7} {'total ms':>10} {'mean ms':>9} {'max ms':>9} {'rows':>8}  query")
+  for item in report:
+    print(f"{item['calls']:>7} {item['total_ms']:>10.1f} {item['mean_ms']:>9.2f} {item['max_ms']:>9.2f} {item['mean_rows']:>8.1f}  {item['query']}")
+    if item['full_scans']:
+      print(f"{'':>48}  full scan: {', '.join(item['full_scans'])}")
+
+if __name__ == '__main__':
+  from config import Config
+  
+  parser = argparse.ArgumentParser(description='Report the statement statistics of the SQL run by the assistant.')
+  parser.add_argument('--file', default=Config.QUERY_STATS_FILE)
+  parser.add_argument('--sort', choices=SORT_KEYS, default='total_ms')
+  parser.add_argument('--limit', type=int, default=20)
+  parser.add_argument('--json', action='store_true', help='print the report as JSON, including plans')
+  args = parser.parse_args()
+  
+  stats = QueryStats(file_path=args.file)
+  report = stats.report(args.sort, args.limit)
+  if args.json:
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+  else:
+    print_report(report)
@@ -0,0 +1,282 @@
+import json
+import os
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from typing import Dict, List, Any, Optional, Tuple
+
+# Query results are kept server-side under a short-lived result id. The UI gets a
+# preview of the rows and pages, sorts and filters the rest through
+# /api/results/<result_id>; the model only gets a bounded digest (head/tail rows,
+# per-column aggregates) and can page through the rest with the get_result_rows tool.
+#
+# With a spill directory every result is also written to disk: results evicted from
+# memory stay available until the TTL, and any worker process of a production server
+# can serve the pages of a result another worker registered.
+
+FULL_ROWS_LIMIT = 20  # smaller results are sent to the model as they are
+HEAD_ROWS = 10
+TAIL_ROWS = 5
+PAGE_LIMIT = 50
+TOP_VALUES = 5
+PREVIEW_ROWS = 100  # rows of a result sent with the answer and saved in the conversation
+VIEW_CACHE_SIZE = 32  # sorted and filtered row orders kept for paging
+PURGE_INTERVAL = 60  # seconds between sweeps of the spill directory
+
+
+class ResultStore:
+  
+  def __init__(self, max_entries: int = 200, ttl: float = 1800, spill_dir: Optional[str] = None, memory_rows: int = 200000):
+    self.max_entries = max_entries
+    self.ttl = ttl
+    self.spill_dir = spill_dir
+    self.memory_rows = memory_rows
+    self.entries = OrderedDict()  # result_id -> (stored_at, result)
+    self.views = OrderedDict()  # (result_id, sort, descending, filter) -> row indices
+    self.lock = threading.Lock()
+    self.purged_at = 0.0
+    if spill_dir:
+      os.makedirs(spill_dir, exist_ok=True)
+  
+  def register(self, result: Dict) -> str:
+    # the id goes into the result before it is spilled, a result read back from disk has it too
+    result_id = uuid.uuid4().hex[:12]
+    result['result_id'] = result_id
+    stored_at = time.time()
+    
+    if self.spill_dir:
+      self.spill(result_id, result)
+    
+    with self.lock:
+      self.entries[result_id] = (stored_at, result)
+      self.evict()
+    
+    return result_id
+  
+  def evict(self) -> None:
+    # least recently used first; the newest result stays even if it is over the row budget
+    rows = sum(len(result['rows']) for _, result in self.entries.values())
+    while len(self.entries) > 1 and (len(self.entries) > self.max_entries or rows > self.memory_rows):
+      result_id, (_, result) = self.entries.popitem(last=False)
+      rows -= len(result['rows'])
+      self.drop_views(result_id)
+  
+  def drop_views(self, result_id: str) -> None:
+    for key in [key for key in self.views if key[0] == result_id]:
+      del self.views[key]
+  
+  def spill_path(self, result_id: str) -> str:
+    return os.path.join(self.spill_dir, f'{result_id}.json')
+  
+  def spill(self, result_id: str, result: Dict) -> None:
+    path = self.spill_path(result_id)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+      f.write(json.dumps(result, ensure_ascii=False))  # one C-encoded string, json.dump writes in small pieces
+    os.replace(temp_path, path)
+    
+    if time.time() - self.purged_at > PURGE_INTERVAL:
+      self.purge()
+  
+  def purge(self) -> int:
+    self.purged_at = time.time()
+    removed = 0
+    for name in os.listdir(self.spill_dir):
+      path = os.path.join(self.spill_dir, name)
+      try:
+        if self.purged_at - os.path.getmtime(path) > self.ttl:
+          os.remove(path)
+          removed += 1
+      except OSError:
+        pass  # removed by another worker
+    return removed
+  
+  def load(self, result_id: str) -> Optional[Tuple[float, Dict]]:
+    if not self.spill_dir or not result_id.isalnum():
+      return None
+    
+    path = self.spill_path(result_id)
+    try:
+      stored_at = os.path.getmtime(path)
+      if time.time() - stored_at > self.ttl:
+        return None
+      with open(path, 'r', encoding='utf-8') as f:
+        return stored_at, json.load(f)
+    except (OSError, ValueError):
+      return None
+  
+  def get(self, result_id: str) -> Optional[Dict]:
+    with self.lock:
+      entry = self.entries.get(result_id)
+      if entry and time.time() - entry[0] > self.ttl:
+        del self.entries[result_id]
+        self.drop_views(result_id)
+        return None
+      if entry:
+        self.entries.move_to_end(result_id)
+        return entry[1]
+    
+    entry = self.load(result_id)
+    if not entry:
+      return None
+    
+    with self.lock:
+      self.entries[result_id] = entry
+      self.evict()
+    return entry[1]
+  
+  def row_order(self, result_id: str, result: Dict, sort: Optional[str], descending: bool, filter_text: str) -> List[int]:
+    key = (result_id, sort, descending, filter_text)
+    with self.lock:
+      if key in self.views:
+        self.views.move_to_end(key)
+        return self.views[key]
+    
+    rows = result['rows']
+    indices = range(len(rows))
+    if filter_text:
+      needle = filter_text.casefold()
+      indices = [i for i in indices if any(needle in value.casefold() for value in rows[i])]
+    
+    if sort in result['columns']:
+      column = result['columns'].index(sort)
+      present = [i for i in indices if rows[i][column] != 'NULL']
+      nulls = [i for i in indices if rows[i][column] == 'NULL']
+      if all(is_number(rows[i][column]) for i in present):
+        present.sort(key=lambda i: float(rows[i][column]), reverse=descending)
+      else:
+        present.sort(key=lambda i: rows[i][column].casefold(), reverse=descending)
+      indices = present + nulls  # NULL last in both directions
+    
+    indices = list(indices)
+    with self.lock:
+      self.views[key] = indices
+      while len(self.views) > VIEW_CACHE_SIZE:
+        self.views.popitem(last=False)
+    return indices
+  
+  def view(self, result_id: str, offset: int = 0, limit: int = PAGE_LIMIT, sort: Optional[str] = None,
+           descending: bool = False, filter_text: str = '', max_limit: int = PAGE_LIMIT) -> Optional[Dict]:
+    # a page of the rows, sorted by a column and filtered by a case-insensitive substring
+    result = self.get(result_id)
+    if not result:
+      return None
+    
+    try:
+      offset = max(0, int(offset))
+      limit = max(1, min(int(limit), max_limit))
+    except (TypeError, ValueError):
+      offset, limit = 0, max_limit
+    
+    page = {
+      'type': 'result_page',
+      'result_id': result_id,
+      'columns': result['columns'],
+      'offset': offset,
+      'row_count': result['row_count']
+    }
+    
+    if sort or filter_text:
+      order = self.row_order(result_id, result, sort, descending, filter_text)
+      page['rows'] = [result['rows'][i] for i in order[offset:offset + limit]]
+      page['match_count'] = len(order)
+      page['sort'] = sort if sort in result['columns'] else None
+      page['descending'] = descending
+      page['filter'] = filter_text
+    else:
+      page['rows'] = result['rows'][offset:offset + limit]
+      page['match_count'] = result['row_count']
+    
+    return page
+  
+  def page(self, result_id: str, offset: int = 0, limit: int = PAGE_LIMIT) -> Dict:
+    page = self.view(result_id, offset, limit)
+    if not page:
+      return {'type': 'error', 'error': f'Result {result_id} is unknown or expired, run the query again.'}
+    
+    del page['match_count']
+    return page
+  
+  def stats(self) -> Dict:
+    with self.lock:
+      return {
+        'entries': len(self.entries),
+        'rows': sum(len(result['rows']) for _, result in self.entries.values()),
+        'views': len(self.views)
+      }
+
+
+def is_number(value: str) -> bool:
+  try:
+    float(value)
+    return True
+  except ValueError:
+    return False
+
+def column_stats(columns: List[str], rows: List[List[str]]) -> Dict:
+  stats = {}
+  
+  for index, column in enumerate(columns):
+    values = [row[index] for row in rows if row[index] != 'NULL']
+    nulls = len(rows) - len(values)
+    
+    if values and all(is_number(value) for value in values):
+      numbers = [float(value) for value in values]
+      stats[column] = {
+        'min': min(numbers),
+        'max': max(numbers),
+        'sum': round(sum(numbers), 4),
+        'avg': round(sum(numbers) / len(numbers), 4)
+      }
+    else:
+      counts = Counter(values)
+      stats[column] = {
+        'distinct': len(counts),
+        'top': [[value, count] for value, count in counts.most_common(TOP_VALUES)]
+      }
+    
+    if nulls:
+      stats[column]['nulls'] = nulls
+  
+  return stats
+
+def model_view(result: Dict) -> Dict:
+  if result.get('type') == 'batch':
+    return {**result, 'results': [model_view(item) for item in result['results']]}
+  
+  if result.get('type') == 'diagram' and 'source' in result:
+    # built from a stored result (diagrams.py), the values are in the model's digest already
+    return {k: result[k] for k in ('type', 'name', 'chart_type', 'title', 'source') if k in result}
+  
+  if result.get('type') != 'table' or result.get('row_count', 0) <= FULL_ROWS_LIMIT or 'result_id' not in result:
+    return result
+  
+  rows = result['rows']
+  view = {k: result[k] for k in ('type', 'name', 'title', 'query', 'table_name', 'result_id', 'columns', 'row_count') if k in result}
+  view['head'] = rows[:HEAD_ROWS]
+  if 'digest' in result:
+    # a preview, the tail and the aggregates were taken from the full rows
+    view.update(result['digest'])
+  else:
+    view['tail'] = rows[-TAIL_ROWS:]
+    view['column_stats'] = column_stats(result['columns'], rows)
+  view['note'] = (f"Digest of {result['row_count']} rows, the user sees the full table. "
+                  'Call get_result_rows with this result_id to read other rows.')
+  return view
+
+def preview(result: Dict) -> Dict:
+  # what the answer and the saved conversation carry of a large result: the first
+  # rows for the UI, which loads the rest by result_id, and the model's digest
+  if result.get('type') == 'batch':
+    return {**result, 'results': [preview(item) for item in result['results']]}
+  
+  if result.get('type') != 'table' or 'result_id' not in result or len(result['rows']) <= PREVIEW_ROWS:
+    return result
+  
+  digest = model_view(result)
+  return {
+    **result,
+    'rows': result['rows'][:PREVIEW_ROWS],
+    'digest': {'tail': digest['tail'], 'column_stats': digest['column_stats']}
+  }
@@ -0,0 +1,311 @@
+import asyncio
+import contextvars
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List, Any, Optional
+from llm_provider import LLMProvider, AsyncLLMProvider
+from history import count_tokens
+import metrics
+
+# Admission control in front of generate_content. Every provider (API key) gets a
+# requests-per-minute and a tokens-per-minute token bucket; requests wait in a
+# bounded queue that is served round robin across conversations, so one long
+# tool loop cannot starve everybody else. A request that would have to wait too
+# long is refused up front with its queue position and an ETA.
+
+current_conversation = contextvars.ContextVar('current_conversation', default=None)
+
+def set_conversation(conversation_id: Optional[str]) -> None:
+  # contextvars follow the request thread / asyncio task, nothing to reset
+  current_conversation.set(conversation_id)
+
+
+class SchedulerBusy(Exception):
+  
+  def __init__(self, position: int, eta: float):
+    super().__init__(f'The assistant is busy, you are number {position} in the queue. Please try again in about {max(1, round(eta))} seconds.')
+    self.position = position
+    self.eta = eta
+
+
+class TokenBucket:
+  
+  def __init__(self, per_minute: float):
+    self.rate = per_minute / 60.0
+    self.capacity = float(per_minute)
+    self.level = self.capacity
+    self.updated = time.monotonic()
+  
+  def refill(self) -> None:
+    now = time.monotonic()
+    self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+    self.updated = now
+  
+  def wait_time(self, amount: float) -> float:
+    self.refill()
+    return max(0.0, (amount - self.level) / self.rate)
+  
+  def take(self, amount: float) -> None:
+    self.refill()
+    self.level -= amount
+  
+  def adjust(self, amount: float) -> None:
+    # positive: the request used more than estimated, negative: refund
+    self.refill()
+    self.level = min(self.capacity, self.level - amount)
+  
+  def drain(self) -> None:
+    self.refill()
+    self.level = min(self.level, 0.0)
+
+
+class Ticket:
+  __slots__ = ('conversation_id', 'tokens', 'admit')
+  
+  def __init__(self, conversation_id: Optional[str], tokens: int, admit: Any):
+    self.conversation_id = conversation_id
+    self.tokens = tokens
+    self.admit = admit  # called by the dispatcher thread once the request may run
+
+
+class Scheduler:
+  
+  def __init__(self, name: str, rpm: Optional[float] = None, tpm: Optional[float] = None,
+               max_queue: int = 50, max_wait: float = 60.0):
+    self.name = name
+    self.requests = TokenBucket(rpm) if rpm else None
+    self.tokens = TokenBucket(tpm) if tpm else None
+    self.max_queue = max_queue
+    self.max_wait = max_wait
+    self.queues = OrderedDict()  # conversation id -> deque of tickets, served round robin
+    self.queued = 0
+    self.condition = threading.Condition()
+    self.dispatcher = None
+    self.admitted = 0
+    self.rejected = 0
+    self.throttled = 0
+  
+  def enqueue(self, tokens: int, admit: Any) -> Ticket:
+    conversation_id = current_conversation.get()
+    if self.tokens:
+      tokens = min(tokens, int(self.tokens.capacity))  # a huge prompt must not wait forever
+    
+    with self.condition:
+      position = self.queued + 1
+      eta = self.eta(position, tokens)
+      if self.queued >= self.max_queue or eta > self.max_wait:
+        self.rejected += 1
+        raise SchedulerBusy(position, eta)
+      
+      ticket = Ticket(conversation_id, tokens, admit)
+      self.queues.setdefault(conversation_id, deque()).append(ticket)
+      self.queued += 1
+      
+      if not self.dispatcher:
+        self.dispatcher = threading.Thread(target=self.dispatch, name=f'scheduler-{self.name}', daemon=True)
+        self.dispatcher.start()
+      self.condition.notify()
+    return ticket
+  
+  def withdraw(self, ticket: Ticket) -> None:
+    # the request gave up waiting: leave the queue, or give back the budget the
+    # dispatcher already took for it
+    with self.condition:
+      queue = self.queues.get(ticket.conversation_id)
+      if queue and ticket in queue:
+        queue.remove(ticket)
+        self.queued -= 1
+        if not queue:
+          del self.queues[ticket.conversation_id]
+      else:
+        self.admitted -= 1
+        if self.requests:
+          self.requests.adjust(-1)
+        if self.tokens:
+          self.tokens.adjust(-ticket.tokens)
+      self.condition.notify()
+  
+  def eta(self, position: int, tokens: int) -> float:
+    tokens_ahead = sum(ticket.tokens for queue in self.queues.values() for ticket in queue) + tokens
+    eta = 0.0
+    if self.requests:
+      eta = max(eta, self.requests.wait_time(position))
+    if self.tokens:
+      eta = max(eta, self.tokens.wait_time(tokens_ahead))
+    return eta
+  
+  def dispatch(self) -> None:
+    with self.condition:
+      while True:
+        if not self.queues:
+          self.condition.wait()
+          continue
+        
+        conversation_id, queue = next(iter(self.queues.items()))
+        ticket = queue[0]
+        
+        wait = 0.0
+        if self.requests:
+          wait = max(wait, self.requests.wait_time(1))
+        if self.tokens:
+          wait = max(wait, self.tokens.wait_time(ticket.tokens))
+        if wait > 0:
+          self.condition.wait(wait)
+          continue
+        
+        if self.requests:
+          self.requests.take(1)
+        if self.tokens:
+          self.tokens.take(ticket.tokens)
+        
+        queue.popleft()
+        self.queued -= 1
+        self.admitted += 1
+        del self.queues[conversation_id]
+        if queue:
+          self.queues[conversation_id] = queue  # back of the line, the next conversation goes first
+        ticket.admit()
+  
+  def acquire(self, tokens: int) -> None:
+    admitted = threading.Event()
+    self.enqueue(tokens, admitted.set)
+    admitted.wait()
+  
+  async def acquire_async(self, tokens: int) -> None:
+    loop = asyncio.get_running_loop()
+    admitted = loop.create_future()
+    # the waiting task may have been cancelled by the time the dispatcher gets to it
+    ticket = self.enqueue(tokens, lambda: loop.call_soon_threadsafe(lambda: admitted.done() or admitted.set_result(None)))
+    try:
+      await admitted
+    except asyncio.CancelledError:
+      self.withdraw(ticket)
+      raise
+  
+  def settle(self, estimated: int, response: Any) -> None:
+    usage = getattr(response, 'usage', None)
+    if not self.tokens or not usage:
+      return
+    with self.condition:
+      self.tokens.adjust(usage['prompt_tokens'] + usage['output_tokens'] - estimated)
+      self.condition.notify()
+  
+  def throttle(self) -> None:
+    # the provider answered 429 anyway (shared key, wrong limits): stop bursting
+    with self.condition:
+      self.throttled += 1
+      if self.requests:
+        self.requests.drain()
+      if self.tokens:
+        self.tokens.drain()
+  
+  def stats(self) -> Dict:
+    with self.condition:
+      return {
+        'queued': self.queued,
+        'conversations': len(self.queues),
+        'admitted': self.admitted,
+        'rejected': self.rejected,
+        'throttled': self.throttled
+      }
+
+
+def estimate_tokens(contents: List[Dict], system_instruction: str, tools: List[Dict]) -> int:
+  return count_tokens(contents) + count_tokens(system_instruction) + count_tokens(tools)
+
+def is_rate_limit(error: Exception) -> bool:
+  text = str(error).lower()
+  return any(marker in text for marker in ('429', 'rate limit', 'quota', 'resource_exhausted'))
+
+
+class SchedulingProvider(LLMProvider):
+  
+  def __init__(self, provider: LLMProvider, scheduler: Scheduler):
+    self.provider = provider
+    self.scheduler = scheduler
+    self.token_usage = getattr(provider, 'token_usage', None)
+  
+  def generate_content(self, contents: List[Dict], system_instruction: str, tools: List[Dict]) -> Any:
+    estimated = estimate_tokens(contents, system_instruction, tools)
+    with metrics.span('llm.queue'):
+      self.scheduler.acquire(estimated)
+    
+    try:
+      response = self.provider.generate_content(contents, system_instruction, tools)
+    except Exception as e:
+      if is_rate_limit(e):
+        self.scheduler.throttle()
+      raise
+    
+    self.scheduler.settle(estimated, response)
+    return response
+  
+  def warm_up(self) -> None:
+    self.provider.warm_up()
+
+
+class AsyncSchedulingProvider(AsyncLLMProvider):
+  
+  def __init__(self, provider: AsyncLLMProvider, scheduler: Scheduler):
+    self.provider = provider
+    self.scheduler = scheduler
+    self.token_usage = getattr(provider, 'token_usage', None)
+  
+  async def generate_content(self, contents: List[Dict], system_instruction: str, tools: List[Dict]) -> Any:
+    estimated = estimate_tokens(contents, system_instruction, tools)
+    with metrics.span('llm.queue'):
+      await self.scheduler.acquire_async(estimated)
+    
+    try:
+      response = await self.provider.generate_content(contents, system_instruction, tools)
+    except Exception as e:
+      if is_rate_limit(e):
+        self.scheduler.throttle()
+      raise
+    
+    self.scheduler.settle(estimated, response)
+    return response
+  
+  def warm_up(self) -> None:
+    self.provider.warm_up()
+  
+  async def aclose(self) -> None:
+    await self.provider.aclose()
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+def get_scheduler(config: Any) -> Optional[Scheduler]:
+  """One scheduler per provider, shared by the sync and async clients of the
+  process since they spend the same API key's limits. With several worker
+  processes each one gets its share of the limits."""
+  limits = config.RATE_LIMITS.get(config.LLM_PROVIDER)
+  if not limits:
+    return None
+  workers = max(1, getattr(config, 'WORKERS', 1))
+  
+  with _schedulers_lock:
+    if config.LLM_PROVIDER not in _schedulers:
+      _schedulers[config.LLM_PROVIDER] = Scheduler(
+        config.LLM_PROVIDER,
+        rpm=limits['rpm'] / workers if limits.get('rpm') else None,
+        tpm=limits['tpm'] / workers if limits.get('tpm') else None,
+        max_queue=config.QUEUE_SIZE,
+        max_wait=config.QUEUE_MAX_WAIT
+      )
+    return _schedulers[config.LLM_PROVIDER]
+
+def scheduler_stats() -> Dict:
+  with _schedulers_lock:
+    schedulers = dict(_schedulers)
+  return {name: scheduler.stats() for name, scheduler in schedulers.items()}
+
+def schedule(provider: LLMProvider, config: Any) -> LLMProvider:
+  scheduler = get_scheduler(config)
+  return SchedulingProvider(provider, scheduler) if scheduler else provider
+
+def schedule_async(provider: AsyncLLMProvider, config: Any) -> AsyncLLMProvider:
+  scheduler = get_scheduler(config)
+  return AsyncSchedulingProvider(provider, scheduler) if scheduler else provider
@@ -269,15 +269,30 @@ async function handleSubmit(e)
       },
       body: JSON.stringify({
         message: message,
-        conversation_id: currentConversationId
+        conversation_id: currentConversationId,
+        background: true
       })
     });
     
-    const data = await response.json();
+    let data = await response.json();
+    let ok = response.ok;
+    
+    if( response.status === 202 )
+    {
+      if( !currentConversationId )
+      {
+        currentConversationId = data.conversation_id;
+        loadConversations();
+      }
+      
+      const job = await waitForJob(data.job_id, loadingDiv);
+      data = job.result || {};
+      ok = job.status === 'done';
+    }
     
     loadingDiv.remove();
     
-    if( response.ok )
+    if( ok )
     {
       if( !currentConversationId )
       {
@@ -382,6 +397,14 @@ function addAssistantMessage(content, functionResults)
       {
         html += renderError(result);
       }
+      else if( result.type === 'batch' )
+      {
+        // execute_sql_batch: one table (or error) per query
+        result.results.forEach(item =>
+        {
+          html += item.type === 'table' ? renderTable(item) : renderError(item);
+        });
+      }
     });
   }
   
@@ -419,6 +442,17 @@ function renderTable(result)
   {
     html += `<div class="table-title">Sample data from <strong>${result.table_name}</strong></div>`;
   }
+  else if( result.title )
+  {
+    html += `<div class="table-title"><strong>${escapeHtml(result.title)}</strong></div>`;
+  }
+  
+  if( result.result_id && result.row_count > VIRTUAL_TABLE_MIN_ROWS )
+  {
+    html += renderVirtualTable(result);
+    html += '</div>';
+    return html;
+  }
   
   html += '<div class="table-wrapper"><table>';
   
@@ -443,13 +477,276 @@ function renderTable(result)
   
   html += '</table></div>';
   
-  html += `<div class="table-footer">${result.row_count} row${result.row_count !== 1 ? 's' : ''}</div>`;
+  const duration = result.duration_ms !== undefined ? ` · ${result.duration_ms} ms` : '';
+  html += `<div class="table-footer">${result.row_count} row${result.row_count !== 1 ? 's' : ''}${duration}${renderExportLink(result)}</div>`;
   
   html += '</div>';
   
   return html;
 }
 
+function renderExportLink(result)
+{
+  // streamed by /api/export, from the result store or by running the result's query
+  // from the conversation again
+  if( !result.result_id )
+    return '';
+  
+  const params = new URLSearchParams({format: 'csv', result_id: result.result_id});
+  if( currentConversationId )
+    params.set('conversation_id', currentConversationId);
+  
+  return ` · <a class="table-export" href="/api/export?${params}" download>Download CSV</a>`;
+}
+
+// Large results stay on the server (result_store.py): the table renders only the rows
+// in view and loads further pages, sorted and filtered by /api/results, while scrolling
+
+const VIRTUAL_TABLE_MIN_ROWS = 20;
+const VIRTUAL_PAGE_SIZE = 200;
+const VIRTUAL_OVERSCAN = 10;   // rows rendered above and below the visible ones
+const VIRTUAL_ROW_HEIGHT = 45; // until the first row is measured
+const virtualTables = new Map();
+
+function renderVirtualTable(result)
+{
+  const tableId = 'table-' + Math.random().toString(36).substr(2, 9);
+  
+  let html = `<div class="table-tools">
+    <input type="search" class="table-filter" id="${tableId}-filter" placeholder="Filter rows">
+  </div>`;
+  
+  html += `<div class="table-wrapper virtual-table" id="${tableId}"><table>`;
+  html += '<thead><tr>';
+  result.columns.forEach((col, index) =>
+  {
+    html += `<th class="sortable" data-column="${index}">${escapeHtml(col)}<span class="sort-indicator"></span></th>`;
+  });
+  html += '</tr></thead>';
+  html += '<tbody></tbody>';
+  html += '</table></div>';
+  
+  html += `<div class="table-footer"><span id="${tableId}-count"></span>${renderExportLink(result)}</div>`;
+  
+  setTimeout(() =>
+  {
+    initVirtualTable(tableId, result);
+  }, 0);
+  
+  return html;
+}
+
+function initVirtualTable(tableId, result)
+{
+  const wrapper = document.getElementById(tableId);
+  if( !wrapper )
+    return;
+  
+  const table = {
+    wrapper,
+    tbody: wrapper.querySelector('tbody'),
+    count: document.getElementById(tableId + '-count'),
+    resultId: result.result_id,
+    query: result.query,
+    columns: result.columns,
+    totalRows: result.row_count,
+    rowCount: result.row_count,
+    durationMs: result.duration_ms,
+    rowHeight: VIRTUAL_ROW_HEIGHT,
+    rows: result.rows.slice(),  // sparse, by position in the current order
+    loading: new Set(),
+    loaded: new Set(),
+    sort: null,
+    descending: false,
+    filter: '',
+    generation: 0,
+    frame: null
+  };
+  virtualTables.set(tableId, table);
+  
+  wrapper.addEventListener('scroll', () =>
+  {
+    if( table.frame === null )
+      table.frame = requestAnimationFrame(() =>
+      {
+        table.frame = null;
+        renderVirtualRows(table);
+      });
+  });
+  
+  wrapper.querySelectorAll('th.sortable').forEach(th =>
+  {
+    th.addEventListener('click', () =>
+    {
+      const column = table.columns[th.dataset.column];
+      
+      // ascending, descending, unsorted
+      if( table.sort !== column )
+      {
+        table.sort = column;
+        table.descending = false;
+      }
+      else if( !table.descending )
+        table.descending = true;
+      else
+        table.sort = null;
+      
+      wrapper.querySelectorAll('th.sortable').forEach(header =>
+      {
+        const sorted = table.columns[header.dataset.column] === table.sort;
+        header.querySelector('.sort-indicator').textContent = sorted ? (table.descending ? ' ▼' : ' ▲') : '';
+      });
+      
+      resetVirtualTable(table);
+    });
+  });
+  
+  let filterTimer = null;
+  document.getElementById(tableId + '-filter').addEventListener('input', (e) =>
+  {
+    clearTimeout(filterTimer);
+    filterTimer = setTimeout(() =>
+    {
+      table.filter = e.target.value.trim();
+      resetVirtualTable(table);
+    }, 300);
+  });
+  
+  renderVirtualRows(table);
+}
+
+function resetVirtualTable(table)
+{
+  // a new order: pages of the old one that are still on their way are dropped
+  table.generation++;
+  table.rows = [];
+  table.loading.clear();
+  table.loaded.clear();
+  table.wrapper.scrollTop = 0;
+  renderVirtualRows(table);
+}
+
+function renderVirtualRows(table)
+{
+  const visibleRows = Math.ceil(table.wrapper.clientHeight / table.rowHeight) || VIRTUAL_TABLE_MIN_ROWS;
+  const first = Math.max(0, Math.floor(table.wrapper.scrollTop / table.rowHeight) - VIRTUAL_OVERSCAN);
+  const last = Math.min(table.rowCount, first + visibleRows + 2 * VIRTUAL_OVERSCAN);
+  const colspan = table.columns.length;
+  const missingPages = new Set();
+  
+  let html = `<tr class="virtual-spacer"><td colspan="${colspan}" style="height: ${first * table.rowHeight}px"></td></tr>`;
+  
+  for( let index = first; index < last; index++ )
+  {
+    const row = table.rows[index];
+    
+    if( !row )
+    {
+      missingPages.add(Math.floor(index / VIRTUAL_PAGE_SIZE));
+      html += `<tr class="virtual-pending"><td colspan="${colspan}">Loading…</td></tr>`;
+      continue;
+    }
+    
+    html += '<tr>' + row.map(cell => `<td>${escapeHtml(cell)}</td>`).join('') + '</tr>';
+  }
+  
+  html += `<tr class="virtual-spacer"><td colspan="${colspan}" style="height: ${(table.rowCount - last) * table.rowHeight}px"></td></tr>`;
+  table.tbody.innerHTML = html;
+  
+  const firstRow = table.tbody.querySelector('tr:not(.virtual-spacer)');
+  if( firstRow && firstRow.offsetHeight && Math.abs(firstRow.offsetHeight - table.rowHeight) > 1 )
+  {
+    table.rowHeight = firstRow.offsetHeight;
+    renderVirtualRows(table);
+    return;
+  }
+  
+  updateVirtualFooter(table);
+  missingPages.forEach(page => loadVirtualPage(table, page));
+}
+
+async function loadVirtualPage(table, page)
+{
+  if( table.loading.has(page) || table.loaded.has(page) )
+    return;
+  
+  const generation = table.generation;
+  table.loading.add(page);
+  
+  try
+  {
+    const params = new URLSearchParams({offset: page * VIRTUAL_PAGE_SIZE, limit: VIRTUAL_PAGE_SIZE});
+    if( table.sort !== null )
+    {
+      params.set('sort', table.sort);
+      params.set('order', table.descending ? 'desc' : 'asc');
+    }
+    if( table.filter )
+      params.set('filter', table.filter);
+    
+    let response = await fetch(`/api/results/${table.resultId}?${params}`);
+    
+    // the result expired on the server: run its query again under a new result id
+    if( response.status === 404 && table.query && await reopenVirtualTable(table) )
+      response = await fetch(`/api/results/${table.resultId}?${params}`);
+    
+    if( !response.ok )
+      throw new Error(`HTTP ${response.status}`);
+    
+    const data = await response.json();
+    if( generation !== table.generation )
+      return;
+    
+    data.rows.forEach((row, i) =>
+    {
+      table.rows[data.offset + i] = row;
+    });
+    table.rowCount = data.match_count;
+    table.loaded.add(page);
+    renderVirtualRows(table);
+  }
+  catch( error )
+  {
+    console.error('Error loading result rows:', error);
+    if( generation === table.generation )
+    {
+      table.loaded.add(page);  // no retry loop, scrolling shows the rows that are there
+      table.count.textContent = 'Could not load the rows, run the question again.';
+    }
+  }
+  finally
+  {
+    if( generation === table.generation )
+      table.loading.delete(page);
+  }
+}
+
+async function reopenVirtualTable(table)
+{
+  const response = await fetch('/api/results', {
+    method: 'POST',
+    headers: {'Content-Type': 'application/json'},
+    body: JSON.stringify({query: table.query})
+  });
+  
+  if( !response.ok )
+    return false;
+  
+  const data = await response.json();
+  table.resultId = data.result_id;
+  table.totalRows = data.row_count;
+  return true;
+}
+
+function updateVirtualFooter(table)
+{
+  const duration = table.durationMs !== undefined ? ` · ${table.durationMs} ms` : '';
+  const rows = table.rowCount !== table.totalRows
+    ? `${table.rowCount} of ${table.totalRows} rows`
+    : `${table.totalRows} row${table.totalRows !== 1 ? 's' : ''}`;
+  table.count.textContent = rows + duration;
+}
+
 function renderDiagram(result)
 {
   const chartId = 'chart-' + Math.random().toString(36).substr(2, 9);
@@ -465,6 +762,12 @@ function renderDiagram(result)
     <canvas id="${chartId}"></canvas>
   </div>`;
   
+  if( result.source && result.source.downsampled )
+  {
+    const method = {lttb: 'shape-preserving sampling', buckets: 'averaged neighbours', top_slices: 'smaller slices as Other'}[result.source.downsampled];
+    html += `<div class="diagram-note">${result.source.points} of ${result.source.rows} points (${method})</div>`;
+  }
+  
   html += '</div>';
   
   setTimeout(() =>
@@ -519,7 +822,8 @@ function createChart(chartId, result)
       backgroundColor: isPieType ? colorPalette : colorPalette[index % colorPalette.length],
       borderColor: isPieType ? borderColorPalette : borderColorPalette[index % borderColorPalette.length],
       borderWidth: 2,
-      tension: result.chart_type === 'line' ? 0.4 : 0
+      tension: result.chart_type === 'line' ? 0.4 : 0,
+      pointRadius: result.labels.length > 50 ? 0 : 3  // long series (thinned out on the server) as a plain line
     };
   });
   
@@ -600,6 +904,10 @@ function addLoadingMessage()
         <span></span>
         <span></span>
       </div>
+      <div class="loading-status">
+        <span class="loading-progress"></span>
+        <button type="button" class="edit-cancel-btn job-cancel-btn" hidden>Cancel</button>
+      </div>
     </div>
   `;
   
@@ -609,6 +917,72 @@ function addLoadingMessage()
   return loadingDiv;
 }
 
+async function waitForJob(jobId, loadingDiv)
+{
+  // the answer is computed in a background job (jobs.py), long-poll until it is finished
+  const progress = loadingDiv.querySelector('.loading-progress');
+  const cancelBtn = loadingDiv.querySelector('.job-cancel-btn');
+  
+  cancelBtn.hidden = false;
+  cancelBtn.addEventListener('click', () =>
+  {
+    cancelBtn.disabled = true;
+    progress.textContent = 'Cancelling...';
+    fetch(`/api/jobs/${jobId}/cancel`, { method: 'POST' });
+  });
+  
+  let version = -1;
+  let failures = 0;
+  
+  while( true )
+  {
+    let response;
+    
+    try
+    {
+      response = await fetch(`/api/jobs/${jobId}?since=${version}&wait=25`);
+    }
+    catch( error )
+    {
+      // the job keeps running on the server, try again unless the connection stays down
+      if( ++failures > 5 )
+        throw error;
+      
+      await new Promise(resolve => setTimeout(resolve, 2000));
+      continue;
+    }
+    
+    const job = await response.json();
+    failures = 0;
+    
+    if( !response.ok )
+      throw new Error(job.error || 'Job not found');
+    
+    if( ['done', 'failed', 'cancelled'].includes(job.status) )
+      return job;
+    
+    version = job.version;
+    if( !cancelBtn.disabled )
+      progress.textContent = describeJobProgress(job);
+  }
+}
+
+function describeJobProgress(job)
+{
+  const progress = job.progress || {};
+  
+  if( job.status === 'queued' )
+    return 'Waiting for a free worker...';
+  
+  if( progress.tools && progress.tools.length > 0 )
+    return `Running ${progress.tools.join(', ')}...`;
+  
+  if( progress.iteration > 1 )
+    return `Thinking (step ${progress.iteration})...`;
+  
+  return 'Thinking...';
+}
+
 function addErrorMessage(message, isCritical)
 {
   const chatMessages = document.getElementById('chat-messages');
@@ -0,0 +1,12 @@
+import os
+import sys
+
+# Tests for the parts that are easy to get wrong without a live model or server:
+#
+#   pip install pytest
+#   python -m pytest -q
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if ROOT not in sys.path:
+  sys.path.insert(0, ROOT)
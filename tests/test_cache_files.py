@@ -0,0 +1,60 @@
+import multiprocessing
+import pytest
+import db_helpers
+from llm_cache import ResponseCache
+from plan_cache import PlanCache
+
+# The plan and response cache files are shared by the worker processes of the
+# production server; a save of one worker must not drop what another one wrote.
+
+if 'fork' not in multiprocessing.get_all_start_methods():
+  pytest.skip('needs fork', allow_module_level=True)
+
+fork = multiprocessing.get_context('fork')
+
+def run_workers(*workers):
+  processes = [fork.Process(target=target, args=args) for target, args in workers]
+  for process in processes:
+    process.start()
+  for process in processes:
+    process.join(10)
+  assert [process.exitcode for process in processes] == [0] * len(processes)
+
+def record_plan(path, question, query, loaded):
+  cache = PlanCache(file_path=path)
+  loaded.wait()  # both workers read the file before either saves
+  cache.record(question, [query])
+
+def test_plan_cache_workers_keep_each_others_plans(tmp_path):
+  path = str(tmp_path / 'plans.json')
+  loaded = fork.Barrier(2)
+  
+  run_workers(
+    (record_plan, (path, 'top 5 customers', 'SELECT name FROM customers LIMIT 5', loaded)),
+    (record_plan, (path, 'sales by region', 'SELECT region, SUM(total) FROM orders GROUP BY region', loaded))
+  )
+  
+  assert sorted(PlanCache(file_path=path).plans) == ['sales by region', 'top <num> customers']
+
+def put_response(path, key, loaded, appended, rewrite):
+  cache = ResponseCache(max_entries=4, file_path=path)
+  loaded.wait()
+  if rewrite:
+    appended.wait()  # the other worker's entry is in the file, not in our memory
+    cache.file_lines = 4 * cache.max_entries  # this put rewrites the file
+  cache.put(key, {'text': key, 'function_calls': []})
+  if not rewrite:
+    appended.wait()
+
+def test_response_cache_rewrite_keeps_other_workers_entries(tmp_path, monkeypatch):
+  monkeypatch.setattr(db_helpers, 'get_data_version', lambda: 'v1')
+  path = str(tmp_path / 'responses.jsonl')
+  loaded, appended = fork.Barrier(2), fork.Barrier(2)
+  
+  run_workers(
+    (put_response, (path, 'appended', loaded, appended, False)),
+    (put_response, (path, 'rewritten', loaded, appended, True))
+  )
+  
+  cache = ResponseCache(max_entries=4, file_path=path)
+  assert sorted(cache.entries) == ['appended', 'rewritten']
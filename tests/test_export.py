@@ -0,0 +1,55 @@
+import io
+import pytest
+import export
+
+# Parquet exports whose column types change between batches, as SQLite allows
+
+pq = pytest.importorskip('pyarrow.parquet')
+
+def read_parquet(columns, batches):
+  return pq.read_table(io.BytesIO(b''.join(export.parquet_chunks(columns, batches))))
+
+def test_null_first_batch_takes_type_of_later_batch():
+  table = read_parquet(['id', 'discount'], [[[1, None], [2, None]], [[3, 5], [4, 7]]])
+  
+  assert str(table.schema.field('discount').type) == 'int64'
+  assert table.column('discount').to_pylist() == [None, None, 5, 7]
+
+def test_column_without_values_is_text():
+  table = read_parquet(['note'], [[[None]], [[None]]])
+  
+  assert str(table.schema.field('note').type) == 'string'
+  assert table.num_rows == 2
+
+def test_int_and_float_make_a_float_column():
+  table = read_parquet(['amount'], [[[1], [2]], [[2.5]]])
+  
+  assert table.column('amount').to_pylist() == [1.0, 2.0, 2.5]
+
+def test_mixed_column_is_text():
+  table = read_parquet(['value'], [[[1]], [['n/a']]])
+  
+  assert table.column('value').to_pylist() == ['1', 'n/a']
+
+def test_values_after_the_type_batches_are_converted(monkeypatch):
+  monkeypatch.setattr(export, 'PARQUET_TYPE_BATCHES', 1)
+  table = read_parquet(['amount', 'label', 'quantity'], [[[1.5, 'a', 1]], [[2, 3, 2.0]], [[3, 'c', 2.5]]])
+  
+  assert table.column('amount').to_pylist() == [1.5, 2.0, 3.0]
+  assert table.column('label').to_pylist() == ['a', '3', 'c']
+  assert table.column('quantity').to_pylist() == [1, 2, None]
+
+def test_empty_result_has_the_columns():
+  table = read_parquet(['id', 'id'], [])
+  
+  assert table.column_names == ['id', 'id_2']
+  assert table.num_rows == 0
+
+def test_stored_result_gets_its_numbers_back():
+  rows = [['1', '007', '2.5', 'NULL'], ['2', '010', '3.0', 'x']]
+  table = read_parquet(['id', 'code', 'price', 'name'], export.stored_batches(rows, 10, typed=True))
+  
+  assert table.column('id').to_pylist() == [1, 2]
+  assert table.column('code').to_pylist() == ['007', '010']
+  assert table.column('price').to_pylist() == [2.5, 3.0]
+  assert table.column('name').to_pylist() == [None, 'x']
@@ -0,0 +1,26 @@
+from history import HistoryManager, count_tokens
+
+def turn(question, answer):
+  return [{'role': 'user', 'parts': [{'text': question}]}, {'role': 'model', 'parts': [{'text': answer}]}]
+
+def conversation(turns):
+  return [entry for index in range(turns) for entry in turn(f'Question {index} ' + 'x' * 400, f'Answer {index} ' + 'y' * 400)]
+
+def test_system_instruction_counts_towards_the_budget():
+  history = conversation(4)
+  manager = HistoryManager(token_budget=count_tokens(history) + 10)
+  
+  assert manager.compact(history) == history
+  assert len(manager.compact(history, 'schema ' * 200)) < len(history)
+
+def test_summary_is_made_once_per_drop_point():
+  calls = []
+  manager = HistoryManager(token_budget=600, summarize=lambda text: calls.append(text) or f'summary {len(calls)}')
+  
+  history = conversation(4)
+  first = manager.compact(history)
+  assert manager.compact(history) == first
+  assert len(calls) == 1
+  
+  manager.compact(conversation(5))  # one more turn dropped
+  assert len(calls) == 2
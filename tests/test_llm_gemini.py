@@ -0,0 +1,190 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+import pytest
+
+pytest.importorskip('google.genai')
+
+import llm_gemini
+from llm_gemini import GeminiProvider, AsyncGeminiProvider, GeminiPromptCache
+
+# A fake genai client: caches.create/update and models.generate_content answer
+# from queues of results, where an exception in the queue is raised
+
+def client_error(code, status, message='error'):
+  llm_gemini.load_sdk()
+  return llm_gemini.genai_errors.ClientError(code, {'error': {'code': code, 'message': message, 'status': status}})
+
+def text_response(text):
+  part = SimpleNamespace(text=text, function_call=None)
+  return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]))], usage_metadata=None)
+
+
+class FakeCaches:
+  
+  def __init__(self, results):
+    self.results = list(results)
+    self.created = 0
+    self.updated = 0
+  
+  def next_result(self):
+    result = self.results.pop(0) if self.results else SimpleNamespace(name=f'cachedContents/{self.created}')
+    if isinstance(result, Exception):
+      raise result
+    return result
+  
+  def create(self, model, config):
+    self.created += 1
+    return self.next_result()
+  
+  def update(self, name, config):
+    self.updated += 1
+    return self.next_result()
+
+
+class FakeModels:
+  
+  def __init__(self, results):
+    self.results = list(results)
+    self.configs = []
+  
+  def generate_content(self, model, contents, config):
+    self.configs.append(config)
+    result = self.results.pop(0)
+    if isinstance(result, Exception):
+      raise result
+    return result
+
+
+class FakeAsyncModels(FakeModels):
+  
+  async def generate_content(self, model, contents, config):
+    return FakeModels.generate_content(self, model, contents, config)
+
+
+class FakeClient:
+  
+  def __init__(self, cache_results=(), responses=()):
+    self.caches = FakeCaches(cache_results)
+    self.models = FakeModels(responses)
+    self.aio = SimpleNamespace(models=FakeAsyncModels(responses))
+
+
+def provider(provider_class, client):
+  llm_gemini.load_sdk()
+  instance = provider_class(api_key='test', model='gemini-test', prompt_cache_ttl=3600)
+  instance.prompt_cache = GeminiPromptCache(client, 'gemini-test', 3600)
+  instance.client = client
+  return instance
+
+TOOLS = [{'function_declarations': [{'name': 'execute_sql_query'}]}]
+
+
+def test_too_small_prefix_is_refused_once():
+  client = FakeClient([client_error(400, 'INVALID_ARGUMENT', 'Cached content is too small')])
+  cache = provider(GeminiProvider, client).prompt_cache
+  
+  assert cache.lookup('system', TOOLS) is None
+  assert cache.lookup('system', TOOLS) is None
+  assert client.caches.created == 1
+
+def test_rate_limit_is_raised_and_retried_later():
+  client = FakeClient([client_error(429, 'RESOURCE_EXHAUSTED')])
+  cache = provider(GeminiProvider, client).prompt_cache
+  
+  with pytest.raises(llm_gemini.genai_errors.ClientError):
+    cache.lookup('system', TOOLS)
+  assert not cache.refused
+  assert cache.lookup('system', TOOLS) == 'cachedContents/2'
+
+def test_expired_entry_is_recreated_on_refresh():
+  client = FakeClient([SimpleNamespace(name='cachedContents/old'), client_error(404, 'NOT_FOUND')])
+  cache = provider(GeminiProvider, client).prompt_cache
+  
+  assert cache.lookup('system', TOOLS) == 'cachedContents/old'
+  key = cache.prefix_key('system', TOOLS)
+  cache.entries[key] = ('cachedContents/old', cache.entries[key][1] - 3500)  # inside the refresh margin
+  
+  assert cache.lookup('system', TOOLS) == 'cachedContents/2'
+  assert client.caches.updated == 1
+
+class BlockingCaches(FakeCaches):
+  # holds every API call until released, to look at the cache meanwhile
+  
+  def __init__(self):
+    super().__init__([])
+    self.called = threading.Event()
+    self.release = threading.Event()
+  
+  def next_result(self):
+    self.called.set()
+    self.release.wait(5)
+    return super().next_result()
+
+def lookup_in_thread(cache):
+  names = []
+  thread = threading.Thread(target=lambda: names.append(cache.lookup('system', TOOLS)))
+  thread.start()
+  cache.client.caches.called.wait(5)
+  return thread, names
+
+def test_lookups_during_a_create_go_uncached():
+  client = FakeClient()
+  client.caches = BlockingCaches()
+  cache = provider(GeminiProvider, client).prompt_cache
+  
+  thread, names = lookup_in_thread(cache)
+  assert cache.lookup('system', TOOLS) is None  # not blocked by the create
+  client.caches.release.set()
+  thread.join(5)
+  
+  assert names == ['cachedContents/1']
+  assert client.caches.created == 1
+
+def test_lookups_during_a_refresh_use_the_old_entry():
+  client = FakeClient()
+  client.caches = BlockingCaches()
+  client.caches.release.set()
+  cache = provider(GeminiProvider, client).prompt_cache
+  assert cache.lookup('system', TOOLS) == 'cachedContents/1'
+  key = cache.prefix_key('system', TOOLS)
+  cache.entries[key] = ('cachedContents/1', cache.entries[key][1] - 3500)  # inside the refresh margin
+  
+  client.caches.called.clear()
+  client.caches.release.clear()
+  thread, names = lookup_in_thread(cache)
+  assert cache.lookup('system', TOOLS) == 'cachedContents/1'
+  client.caches.release.set()
+  thread.join(5)
+  
+  assert names == ['cachedContents/1']
+  assert client.caches.updated == 1
+  assert not cache.refreshing
+
+def test_missing_cached_content_falls_back_uncached():
+  client = FakeClient(responses=[client_error(403, 'PERMISSION_DENIED', 'CachedContent not found (or permission denied)'),
+                                 text_response('ok')])
+  gemini = provider(GeminiProvider, client)
+  
+  assert gemini.generate_content([], 'system', TOOLS).text == 'ok'
+  assert client.models.configs[0] == {'cached_content': 'cachedContents/1'}
+  assert 'system_instruction' in client.models.configs[1]
+  assert not gemini.prompt_cache.entries
+
+def test_other_client_errors_are_not_retried():
+  client = FakeClient(responses=[client_error(429, 'RESOURCE_EXHAUSTED'), text_response('ok')])
+  gemini = provider(GeminiProvider, client)
+  
+  with pytest.raises(llm_gemini.genai_errors.ClientError):
+    gemini.generate_content([], 'system', TOOLS)
+  assert len(client.models.configs) == 1
+  assert gemini.prompt_cache.entries
+
+def test_async_fallback_only_for_missing_cached_content():
+  client = FakeClient(responses=[client_error(404, 'NOT_FOUND'), text_response('ok'), client_error(400, 'INVALID_ARGUMENT')])
+  gemini = provider(AsyncGeminiProvider, client)
+  
+  assert asyncio.run(gemini.generate_content([], 'system', TOOLS)).text == 'ok'
+  with pytest.raises(llm_gemini.genai_errors.ClientError):
+    asyncio.run(gemini.generate_content([], 'system', TOOLS))
+  assert len(client.aio.models.configs) == 3
@@ -0,0 +1,56 @@
+import copy
+from llm_messages import HistoryConverter
+
+# HistoryConverter keeps the conversion of a conversation between requests
+
+def turn(index):
+  return [{'role': 'user', 'parts': [{'text': f'Question {index}'}]}, {'role': 'model', 'parts': [{'text': f'Answer {index}'}]}]
+
+def counting_converter():
+  converted = []
+  def convert_entry(entry, tool_calls):
+    converted.append(entry)
+    return [{'role': entry['role'], 'content': entry['parts'][0]['text']}]
+  return HistoryConverter(convert_entry), converted
+
+def test_next_question_converts_only_the_new_entries():
+  converter, converted = counting_converter()
+  history = turn(1) + turn(2)
+  converter.convert(history, 'conversation')
+  
+  # every question builds a new history list of new dicts
+  history = copy.deepcopy(history) + turn(3)
+  messages = converter.convert(history, 'conversation', [{'role': 'system', 'content': 'system'}])
+  
+  assert len(converted) == 6
+  assert [message['content'] for message in messages] == ['system', 'Question 1', 'Answer 1', 'Question 2', 'Answer 2', 'Question 3', 'Answer 3']
+
+def test_tool_loop_appends_to_the_same_list():
+  converter, converted = counting_converter()
+  history = turn(1)
+  converter.convert(history, 'conversation')
+  history += turn(2)
+  
+  assert len(converter.convert(history, 'conversation')) == 4
+  assert len(converted) == 4
+
+def test_changed_entry_is_converted_again_with_the_ones_after_it():
+  converter, converted = counting_converter()
+  history = turn(1) + turn(2) + turn(3)
+  converter.convert(history, 'conversation')
+  
+  history = copy.deepcopy(history)
+  history[2] = {'role': 'user', 'parts': [{'text': 'Question 2, digested'}]}
+  messages = converter.convert(history, 'conversation')
+  
+  assert len(converted) == 6 + 4
+  assert messages[2]['content'] == 'Question 2, digested'
+  assert len(messages) == 6
+
+def test_conversations_are_kept_apart():
+  converter, converted = counting_converter()
+  converter.convert(turn(1), 'first')
+  
+  assert converter.convert(turn(2), 'second')[0]['content'] == 'Question 2'
+  assert converter.convert(turn(1), 'first')[0]['content'] == 'Question 1'
+  assert len(converted) == 4
@@ -0,0 +1,42 @@
+import contextvars
+from llm_openrouter import OpenRouterProvider
+from scheduler import set_conversation
+
+def tool_exchange(name, args):
+  return [
+    {'role': 'model', 'parts': [{'function_call': {'name': name, 'args': args}}]},
+    {'role': 'user', 'parts': [{'function_response': {'name': name, 'response': {'success': True}}}]}
+  ]
+
+def test_calls_of_the_same_tool_get_their_own_ids():
+  contents = [{'role': 'user', 'parts': [{'text': 'Compare 2023 and 2024'}]}]
+  contents += tool_exchange('execute_sql_query', {'query': 'SELECT 2023'})
+  contents += tool_exchange('execute_sql_query', {'query': 'SELECT 2024'})
+  contents += tool_exchange('generate_diagram', {'chart_type': 'bar'})
+  
+  messages = OpenRouterProvider('key', 'openai/gpt-4o')._convert_to_openrouter_format(contents, 'system')
+  calls = [message['tool_calls'][0]['id'] for message in messages if message.get('tool_calls')]
+  answers = [message['tool_call_id'] for message in messages if message['role'] == 'tool']
+  
+  assert calls == ['call_1', 'call_2', 'call_3']
+  assert answers == calls
+
+def test_call_ids_continue_in_the_next_question():
+  contents = [{'role': 'user', 'parts': [{'text': 'Sales in 2023'}]}]
+  contents += tool_exchange('execute_sql_query', {'query': 'SELECT 2023'})
+  contents += [{'role': 'model', 'parts': [{'text': 'Done'}]}]
+  # the next question is a new list, its first entries are converted already
+  following = [dict(entry) for entry in contents] + [{'role': 'user', 'parts': [{'text': 'And 2024?'}]}]
+  following += tool_exchange('execute_sql_query', {'query': 'SELECT 2024'})
+  
+  provider = OpenRouterProvider('key', 'openai/gpt-4o')
+  def ask():
+    set_conversation('conversation')
+    provider._convert_to_openrouter_format(contents, 'system')
+    return provider._convert_to_openrouter_format(following, 'system')
+  messages = contextvars.Context().run(ask)
+  
+  assert len(provider.history.histories) == 1
+  assert [message['tool_calls'][0]['id'] for message in messages if message.get('tool_calls')] == ['call_1', 'call_2']
+  assert [message['tool_call_id'] for message in messages if message['role'] == 'tool'] == ['call_1', 'call_2']
+  assert messages == OpenRouterProvider('key', 'openai/gpt-4o')._convert_to_openrouter_format(following, 'system')
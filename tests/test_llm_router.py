@@ -0,0 +1,158 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from config import Config
+from llm_ollama import OllamaProvider, AsyncOllamaProvider
+from llm_provider import LLMProvider
+import llm_router
+import scheduler
+
+# The router against local stub Ollama servers (/api/chat) that answer after a
+# delay, or with an error
+
+
+class StubOllama(ThreadingHTTPServer):
+  
+  daemon_threads = True
+  
+  def __init__(self, text, delay=0.0, status=200):
+    super().__init__(('127.0.0.1', 0), StubHandler)
+    self.text = text
+    self.delay = delay
+    self.status = status
+    self.requests = 0
+    threading.Thread(target=self.serve_forever, daemon=True).start()
+  
+  @property
+  def url(self):
+    return f'http://127.0.0.1:{self.server_address[1]}'
+
+
+class StubHandler(BaseHTTPRequestHandler):
+  
+  def do_POST(self):
+    self.rfile.read(int(self.headers['Content-Length']))
+    self.server.requests += 1
+    time.sleep(self.server.delay)
+    
+    body = json.dumps({'message': {'role': 'assistant', 'content': self.server.text}}).encode('utf-8')
+    self.send_response(self.server.status)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+  
+  def log_message(self, *args):
+    pass
+
+
+@pytest.fixture
+def servers():
+  started = []
+  
+  def start(*args, **kwargs):
+    server = StubOllama(*args, **kwargs)
+    started.append(server)
+    return server
+  
+  yield start
+  for server in started:
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture(autouse=True)
+def fast_hedging(monkeypatch):
+  monkeypatch.setattr(llm_router, 'UNMEASURED_HEDGE_DELAY', 0.1)
+  monkeypatch.setattr(scheduler, '_schedulers', {})
+
+CONTENTS = [{'role': 'user', 'parts': [{'text': 'Top 5 customers'}]}]
+
+
+def test_slow_primary_is_hedged(servers):
+  slow, fast = servers('slow', delay=1.0), servers('fast')
+  router = llm_router.RoutingProvider([('slow', OllamaProvider(slow.url, 'm')), ('fast', OllamaProvider(fast.url, 'm'))],
+                                      min_hedge_delay=0.05)
+  
+  assert router.generate_content(CONTENTS, 'system', []).text == 'fast'
+  assert (router.hedges, router.hedge_wins) == (1, 1)
+
+def test_failed_backend_fails_over(servers):
+  broken, working = servers('', status=500), servers('ok')
+  router = llm_router.RoutingProvider([('broken', OllamaProvider(broken.url, 'm')), ('working', OllamaProvider(working.url, 'm'))])
+  
+  assert router.generate_content(CONTENTS, 'system', []).text == 'ok'
+  assert router.failovers == 1
+  assert router.backends[0].error_rate() == 1.0
+
+def test_async_slow_primary_is_hedged(servers):
+  slow, fast = servers('slow', delay=1.0), servers('fast')
+  
+  async def run():
+    router = llm_router.AsyncRoutingProvider([('slow', AsyncOllamaProvider(slow.url, 'm')), ('fast', AsyncOllamaProvider(fast.url, 'm'))],
+                                             min_hedge_delay=0.05)
+    try:
+      return await router.generate_content(CONTENTS, 'system', []), router
+    finally:
+      await router.aclose()
+  
+  response, router = asyncio.run(run())
+  assert response.text == 'fast'
+  assert router.hedge_wins == 1
+
+
+class ConversationProbe(LLMProvider):
+  # remembers the conversation the scheduler would see for the backend call
+  
+  def __init__(self, provider):
+    self.provider = provider
+    self.conversations = []
+  
+  def generate_content(self, contents, system_instruction, tools):
+    self.conversations.append(scheduler.current_conversation.get())
+    return self.provider.generate_content(contents, system_instruction, tools)
+
+
+def test_backend_calls_see_the_request_context(servers):
+  slow, fast = servers('slow', delay=0.5), servers('fast')
+  probes = [ConversationProbe(OllamaProvider(slow.url, 'm')), ConversationProbe(OllamaProvider(fast.url, 'm'))]
+  router = llm_router.RoutingProvider([('slow', probes[0]), ('fast', probes[1])], min_hedge_delay=0.05)
+  
+  scheduler.set_conversation('conversation-1')
+  router.generate_content(CONTENTS, 'system', [])
+  assert [probe.conversations for probe in probes] == [['conversation-1'], ['conversation-1']]
+
+
+class RouterConfig(Config):
+  LLM_PROVIDER = 'router'
+  ROUTER_BACKENDS = ['ollama', 'openrouter']
+  RATE_LIMITS = {'ollama': {'rpm': 600}}
+
+
+def test_each_backend_is_scheduled_under_its_own_limits():
+  router = llm_router.create_provider(RouterConfig)
+  ollama, openrouter = [backend.provider for backend in router.backends]
+  
+  assert isinstance(ollama, scheduler.SchedulingProvider)
+  assert ollama.scheduler is scheduler.get_scheduler(llm_router.backend_config(RouterConfig, 'ollama'))
+  assert not isinstance(openrouter, scheduler.SchedulingProvider)  # no RATE_LIMITS entry
+
+def test_full_backend_queue_is_not_a_backend_error(servers):
+  working = servers('ok')
+  
+  class Busy(LLMProvider):
+    def generate_content(self, contents, system_instruction, tools):
+      raise scheduler.SchedulerBusy(3, 20.0)
+  
+  router = llm_router.RoutingProvider([('busy', Busy()), ('working', OllamaProvider(working.url, 'm'))])
+  assert router.generate_content(CONTENTS, 'system', []).text == 'ok'
+  assert router.backends[0].error_rate() == 0.0
+
+@pytest.mark.parametrize('backends', [[], ['ollama', 'router'], ['ollama', 'ollama']])
+def test_invalid_backend_list_is_a_config_error(backends):
+  config = type('Config', (RouterConfig,), {'ROUTER_BACKENDS': backends})
+  
+  with pytest.raises(ValueError):
+    llm_router.create_provider(config)
@@ -0,0 +1,37 @@
+import asyncio
+import time
+import pytest
+from scheduler import Scheduler, SchedulerBusy
+
+def test_cancelled_waiter_leaves_the_queue():
+  scheduler = Scheduler('test', rpm=60, max_wait=120)
+  scheduler.requests.level = 0  # the next request may run in a second
+  
+  async def main():
+    waiting = asyncio.ensure_future(scheduler.acquire_async(10))
+    await asyncio.sleep(0)
+    assert scheduler.stats()['queued'] == 1
+    
+    waiting.cancel()
+    with pytest.raises(asyncio.CancelledError):
+      await waiting
+  
+  asyncio.run(main())
+  assert scheduler.stats()['queued'] == 0
+  assert not scheduler.queues
+  
+  scheduler.max_queue = 0  # report the position the next request would get
+  with pytest.raises(SchedulerBusy) as busy:
+    scheduler.enqueue(10, lambda: None)
+  assert busy.value.position == 1
+
+def test_cancel_after_admission_refunds_the_budget():
+  scheduler = Scheduler('test', rpm=60, tpm=1000)
+  ticket = scheduler.enqueue(100, lambda: None)
+  while scheduler.stats()['admitted'] == 0:
+    time.sleep(0.01)
+  
+  scheduler.withdraw(ticket)
+  assert scheduler.requests.level == pytest.approx(60, abs=0.1)
+  assert scheduler.tokens.level == pytest.approx(1000, abs=1)
+  assert scheduler.stats()['admitted'] == 0